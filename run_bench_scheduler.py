@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+# collisions per simulated round of run_exp_fuzzing_time_with_guiding.py,
+# the fixed sorted loop against the energy scheduler, on the kinematic
+# stand-in (no CARLA needed): python run_bench_scheduler.py
+_DRIVER = Path(__file__).resolve().parent / "run_exp_fuzzing_time_with_guiding.py"
+_POLICIES = ["sorted", "energy"]
+_RANDOM_SEEDS = [0, 1, 2]
+_OVERRIDES = {
+    "_BACKEND": '"kinematic"',
+    "_V_NPC_RANGE": "(0, 20)",
+    "_TOTAL_ROUND": "1500",
+}
+
+
+def driver_source(policy: str, random_seed: int, result_dir: Path, cache_path: Path) -> str:
+    overrides = dict(
+        _OVERRIDES,
+        _SCHEDULER=repr(policy),
+        _META_RESULT_DIR=f"Path({str(result_dir)!r})",
+        _RESULT_CACHE=f"Path({str(cache_path)!r})",  # <-- the initial grid is simulated once
+    )
+    source = _DRIVER.read_text()
+    for name, value in overrides.items():
+        source, count = re.subn(rf"^{name} = .*$", f"{name} = {value}", source, flags=re.M)
+        assert count == 1, f"{name} not found in {_DRIVER.name}"
+    return source.replace(
+        'if __name__ == "__main__":\n',
+        f'if __name__ == "__main__":\n    random.seed({random_seed})\n',
+        1,
+    )
+
+
+def campaign_stats(result_dir: Path) -> tuple[int, int, int]:
+    # (fuzzing rounds, collisions found by fuzzing, initial seeds that led to one)
+    db = sqlite3.connect(result_dir / "corpus.sqlite")
+    rounds, collisions, chains = db.execute(
+        "SELECT COUNT(*), SUM(r.result = 'collision, hit NPC'), "
+        "COUNT(DISTINCT CASE WHEN r.result = 'collision, hit NPC' THEN s.chain_no END) "
+        "FROM seeds s JOIN round_results r ON r.seed_id = s.id WHERE s.kind = 'fuzz'"
+    ).fetchone()
+    db.close()
+    return rounds, collisions or 0, chains
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = Path(tmp_dir) / "result_cache.sqlite"
+        print(f"{'policy':>8} {'seed':>4} {'rounds':>6} {'collisions':>10} {'per round':>9} {'chains':>6} {'seconds':>7}")
+        for random_seed in _RANDOM_SEEDS:
+            for policy in _POLICIES:
+                run_dir = Path(tmp_dir) / f"{policy}_{random_seed}"
+                run_dir.mkdir()
+                (run_dir / "driver.py").write_text(
+                    driver_source(policy, random_seed, run_dir / "meta", cache_path)
+                )
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, "driver.py"],
+                    cwd=run_dir,
+                    env=dict(os.environ, PYTHONPATH=str(_DRIVER.parent)),
+                    stdout=subprocess.DEVNULL,
+                    check=True,
+                )
+                seconds = time.perf_counter() - start
+                rounds, collisions, chains = campaign_stats(run_dir / "meta")
+                print(
+                    f"{policy:>8} {random_seed:>4} {rounds:>6} {collisions:>10} "
+                    f"{collisions / max(rounds, 1):>9.3f} {chains:>6} {seconds:>7.1f}"
+                )
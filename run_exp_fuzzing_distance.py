@@ -1,15 +1,25 @@
+import json
 from pathlib import Path
 import random
 from typing import Optional
 import yaml
 
-from scenario import Scenario
+from scenario import Scenario, create_backend
+from scenario.artifact_writer import Artifact_Writer
 from scenario import Scenario_case00 as case00
 from scenario import Scenario_case04 as case04
 from scenario import Scenario_case06 as case06
-from scenario.conflict_point import Conflict_Point
-from scenario.loss import Loss
-from scenario.seed import Seed, Round_Result
+from scenario.corpus import Seed_Corpus
+from scenario.init_seed import record_init_seed, recover_init_seed, run_init_seed
+from scenario.journal import (
+    Result_Journal,
+    count_journal,
+    recover_seed_lists,
+    truncate_journal,
+)
+from scenario.prescreen import Prescreen
+from scenario.seed import Seed
+from scenario.worker_pool import Scenario_Pool, Seed_Chain, Serial_Runner, run_chains
 
 _P_EGO_RANGE = (0, 10)
 _P_NPC_RANGE = (0, 10)
@@ -123,16 +133,16 @@ def gen_new_seed(seed: Seed, round_no) -> Seed:
     return new_seed
 
 
-def fuzzing(seed):
+def fuzzing(seed_no: int, seed: Seed, fuzzing_round: int = 0) -> Seed_Chain:
+    # a resumed chain starts from its checkpointed best seed and round
     global round_cnt
-    global collision_seed_list
-    global other_seed_list
+    global collision_seed_cnt
+    global other_seed_cnt
 
     last_seed = seed
-    fuzzing_round = 0
+    chain_states[seed_no] = (last_seed, fuzzing_round)
     while fuzzing_round < _SEED_FUZZING_MAX_ITER:
         new_seed: Seed = gen_new_seed(last_seed, round_cnt)
-        round_cnt += 1
         fuzzing_round += 1
 
         assert last_seed.round_result is not None
@@ -156,23 +166,69 @@ def fuzzing(seed):
         #             )
         #         )
 
-        new_seed.round_result = scene.run(new_seed)
+        if prescreen is not None and not prescreen.admit(new_seed):
+            chain_states[seed_no] = (last_seed, fuzzing_round)
+            continue
+        round_cnt += 1
+        new_seed.round_result = yield new_seed  # <-- simulated by the runner
+        if prescreen is not None:
+            prescreen.record(new_seed)
         if new_seed.round_result.result == "collision, hit NPC":
             print(f"Found collision, round: {round_cnt}")
-            collision_seed_list.append(new_seed)
-            return "collision"
-
-        other_seed_list.append(new_seed)
+            journal.record("collision", new_seed)
+            corpus.add_seeds([new_seed], "fuzz", seed_no)
+            collision_seed_cnt += 1
+            return end_chain(seed_no, "collision")
+
+        journal.record("other", new_seed)
+        corpus.add_seeds([new_seed], "fuzz", seed_no)
+        other_seed_cnt += 1
         if new_seed.round_result.min_distance < last_seed.round_result.min_distance:
             last_seed = new_seed
+        chain_states[seed_no] = (last_seed, fuzzing_round)
 
         if round_cnt >= _TOTAL_ROUND:
-            return "not found collision, max round"
+            return end_chain(seed_no, "not found collision, max round")
+        record_state()
+
+    return end_chain(seed_no, "not found collision, max fuzzing")
+
+
+def end_chain(seed_no: int, fuzzing_result: str) -> str:
+    del chain_states[seed_no]
+    record_state()
+    return fuzzing_result
 
-    return "not found collision, max fuzzing"
+
+def seed_chains(resumed_chains: list[tuple[int, Seed, int]]):
+    # chains cut off by the last stop first, then the lowest-loss initial
+    # seed no chain was started from, asked from the corpus each time
+    global next_seed_no
+
+    for seed_no, last_seed, fuzzing_round in resumed_chains:
+        yield seed_no, fuzzing(seed_no, last_seed, fuzzing_round)
+    while round_cnt <= _TOTAL_ROUND:
+        unexplored = corpus.next_unexplored(kind="init")
+        if len(unexplored) == 0:
+            break
+        seed_id, seed = unexplored[0]
+        seed_no = init_seed_nos[seed_id]
+        next_seed_no += 1  # <-- the corpus ids follow the sorted initial list, the checkpoint counts in it
+        corpus.set_explored([seed_id])
+        yield seed_no, fuzzing(seed_no, seed)
+
+
+def report_chain(seed_no: int, fuzzing_result: str):
+    print(fuzzing_result)
+    print(f"Collision seed: {collision_seed_cnt}")
+    print(f"Other seed: {other_seed_cnt}")
 
 
 def record_seed(init_seed_list: list[Seed]):
+    # yaml export of the result journal
+    collision_seed_list, other_seed_list = recover_seed_lists(
+        _META_RESULT_DIR / "result_journal.jsonl"
+    )
     collision_record = {}
     for seed in collision_seed_list:
         collision_record[f"{seed.round_num}"] = {
@@ -182,9 +238,7 @@ def record_seed(init_seed_list: list[Seed]):
             "action_chain": seed.action_chain,
             "result": seed.round_result,
         }
-    with open(_META_RESULT_DIR / "collision_seed.yml", "w") as f:
-        yaml.dump(collision_record, f)
-        f.close()
+    artifact_writer.write_file(_META_RESULT_DIR / "collision_seed.yml", yaml.dump(collision_record))
 
     other_record = {}
     for seed in other_seed_list:
@@ -195,9 +249,7 @@ def record_seed(init_seed_list: list[Seed]):
             "action_chain": seed.action_chain,
             "result": seed.round_result,
         }
-    with open(_META_RESULT_DIR / "other_seed.yml", "w") as f:
-        yaml.dump(other_record, f)
-        f.close()
+    artifact_writer.write_file(_META_RESULT_DIR / "other_seed.yml", yaml.dump(other_record))
 
     init_record = {}
     for seed in init_seed_list:
@@ -208,153 +260,171 @@ def record_seed(init_seed_list: list[Seed]):
             "action_chain": seed.action_chain,
             "result": seed.round_result,
         }
-    with open(_META_RESULT_DIR / "init_seed.yml", "w") as f:
-        yaml.dump(init_record, f)
-        f.close()
-
-
-def record_init_seed(init_seed_list: list[Seed]):
-    init_record = {}
-    seed_order_record = []
-    for seed in init_seed_list:
-        init_record[f"{seed.round_num}"] = seed.to_basic_data()
-        seed_order_record.append(seed.round_num)
-    with open(_META_RESULT_DIR / "init_seed_result.yml", "w") as f:
-        yaml.dump(init_record, f)
-        f.close()
-    with open(_META_RESULT_DIR / "init_seed_order.yml", "w") as f:
-        yaml.dump(seed_order_record, f)
-        f.close()
-
-
-def recover_init_seed() -> list[Seed]:
-    with open(_META_RESULT_DIR / "init_seed_order.yml", "r") as f:
-        seed_order_record = yaml.load(f, yaml.FullLoader)
-        f.close()
-    with open(_META_RESULT_DIR / "init_seed_result.yml", "r") as f:
-        seed_list = yaml.load(f, yaml.FullLoader)
-        f.close()
-    init_seed_list: list[Seed] = []
-
-    print("recovering ... ", end='', flush=True)
-    for seed_name in seed_list:
-        seed = seed_list[seed_name]
-        if seed["round_result"] is not None:
-            if seed["round_result"]["conflict_point"] is not None:
-                cp = Conflict_Point(
-                    ego_pass_tick=seed["round_result"]["conflict_point"][
-                        "ego_pass_tick"
-                    ],
-                    obj_pass_tick=seed["round_result"]["conflict_point"][
-                        "obj_pass_tick"
-                    ],
-                    loss=Loss(
-                        time_gap=seed["round_result"]["conflict_point"]["loss"]["time_gap"],
-                        distance=seed["round_result"]["conflict_point"]["loss"]["distance"],
-                    ),
-                )
-            else:
-                cp = None
-            round_result = Round_Result(
-                result=seed["round_result"]["result"],
-                loss=Loss(
-                    time_gap=seed["round_result"]["loss"]["time_gap"],
-                    distance=seed["round_result"]["loss"]["distance"],
-                ),
-                action_seq=seed["round_result"]["action_seq"],
-                conflict_point=cp,
-            )
-        else:
-            round_result = None
-        init_seed_list.append(
-            Seed(
-                round_num=seed["round_num"],
-                p_ego=seed["p_ego"],
-                p_npc=seed["p_npc"],
-                v_npc=seed["v_npc"],
-                action_capability=seed["action_cap"],
-                action_chain=seed["action_chain"],
-                round_result=round_result,
-            )
-        )
-    print("Done")
-
-    return init_seed_list
-
-
-def record_state(round_cnt, seed_no):
-    state = {"current_round": round_cnt, "current_seed": seed_no}
-    with open(_META_RESULT_DIR / "current_state.yml", "w") as f:
-        yaml.dump(state, f)
-        f.close()
+    artifact_writer.write_file(_META_RESULT_DIR / "init_seed.yml", yaml.dump(init_record))
+
+
+def record_state():
+    # round-granular checkpoint, rewritten after every finished round. With
+    # several workers, the rounds in flight at a stop are lost: their chains
+    # resume from the last finished round and their round numbers are skipped
+    state = {
+        "current_round": round_cnt,
+        "current_seed": next_seed_no,
+        "chains": [
+            {
+                "seed_no": seed_no,
+                "last_seed": last_seed.to_basic_data(),
+                "fuzzing_round": fuzzing_round,
+            }
+            for seed_no, (last_seed, fuzzing_round) in chain_states.items()
+        ],
+        "journal_offset": journal.tell(),
+        "random_state": random.getstate(),
+        "prescreen": None if prescreen is None else prescreen.to_basic_data(),
+    }
+    artifact_writer.replace_file(_META_RESULT_DIR / "current_state.json", json.dumps(state))
 
 
 def restore_state():
-    with open(_META_RESULT_DIR / "current_state.yml", "r") as f:
-        state = yaml.load(f, yaml.FullLoader)
+    with open(_META_RESULT_DIR / "current_state.json", "r") as f:
+        state = json.load(f)
         f.close()
-    return state["current_round"], state["current_seed"]
+    version, internal_state, gauss_next = state["random_state"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+    resumed_chains = [
+        (chain["seed_no"], Seed.recover_from_basic_data(chain["last_seed"]), chain["fuzzing_round"])
+        for chain in state["chains"]
+    ]
+    return (
+        state["current_round"],
+        state["current_seed"],
+        resumed_chains,
+        state["journal_offset"],
+        state.get("prescreen"),
+    )
 
 
 scenario_type = "town05_case06"
 _HOST = "localhost"
 _PORT = 2000
 _WORLD_MAP = "Town05"
+_BACKEND = "carla"  # <-- "carla" or "kinematic" (no simulator needed)
 _META_RESULT_DIR = Path(f"./result_ver_3_{scenario_type}/loss_distance")
 _OUTPUT_ROOT_DIR = _META_RESULT_DIR / "result"
 
 _TOTAL_ROUND = 10000
 _SEED_FUZZING_MAX_ITER = 50
+_EARLY_TERMINATION = False
+_PERSISTENT_ACTORS = False  # <-- reuse the vehicles between rounds instead of respawning
+_SNAPSHOT_LOG_FORMAT = "npy"  # <-- "csv" for the old text log, python -m scenario.snapshot_log converts
+_WORKERS = 1  # <-- simulators run in parallel, worker k uses port _PORT + 3 * k
+_RESULT_CACHE = Path("./result_cache.sqlite")  # <-- shared by the three drivers, None: always simulate
+_PRESCREEN = False  # <-- kinematic prediction in front of the simulator, see scenario.prescreen
+_PRESCREEN_THRESHOLD = 2.0  # <-- predicted conflict time gap (s) a candidate needs to be simulated
+_PRESCREEN_AUDIT_RATE = 0.05  # <-- rejected candidates simulated anyway, for the false-negative rate
 
 round_cnt = 0
-collision_seed_list: list[Seed] = []
-other_seed_list: list[Seed] = []
+prescreen: Optional[Prescreen] = None
+next_seed_no = 0
+chain_states: dict[int, tuple[Seed, int]] = {}  # <-- seed_no: (last_seed, fuzzing_round)
+collision_seed_cnt = 0
+other_seed_cnt = 0
 
 if __name__ == "__main__":
-    scene: Scenario
+    artifact_writer = Artifact_Writer()  # <-- result files are written off the main thread
+    _META_RESULT_DIR.mkdir(parents=True, exist_ok=True)
+    resumed_chains: list[tuple[int, Seed, int]] = []
+    prescreen_state: Optional[dict] = None
+    if (_META_RESULT_DIR / "current_state.json").exists():
+        round_cnt, next_seed_no, resumed_chains, journal_offset, prescreen_state = restore_state()
+        truncate_journal(_META_RESULT_DIR / "result_journal.jsonl", journal_offset)
+    collision_seed_cnt, other_seed_cnt = count_journal(
+        _META_RESULT_DIR / "result_journal.jsonl"
+    )
+    journal = Result_Journal(_META_RESULT_DIR / "result_journal.jsonl")  # <-- every round's result
+    corpus = Seed_Corpus(_META_RESULT_DIR / "corpus.sqlite", scenario_type, _META_RESULT_DIR.name)
     if scenario_type == "town05_case04":
-        scene = case04(_HOST, _PORT, _WORLD_MAP, _OUTPUT_ROOT_DIR)
+        scenario_cls = case04
     elif scenario_type == "town05_case06":
-        scene = case06(_HOST, _PORT, _WORLD_MAP, _OUTPUT_ROOT_DIR)
+        scenario_cls = case06
     elif scenario_type == "town05_case00":
-        scene = case00(_HOST, _PORT, _WORLD_MAP, _OUTPUT_ROOT_DIR)
-
-    if not (_META_RESULT_DIR / "init_seed_result.yml").exists():
+        scenario_cls = case00
+    if _PRESCREEN:
+        prescreen = Prescreen(
+            scenario_cls, _WORLD_MAP, _PRESCREEN_THRESHOLD, _PRESCREEN_AUDIT_RATE
+        )
+        if prescreen_state is not None:
+            prescreen.recover_from_basic_data(prescreen_state)
+
+    runner: Serial_Runner | Scenario_Pool
+    if _WORKERS > 1:
+        runner = Scenario_Pool(
+            scenario_cls,
+            _HOST,
+            _PORT,
+            _WORLD_MAP,
+            _OUTPUT_ROOT_DIR,
+            backend=_BACKEND,
+            workers=_WORKERS,
+            options={
+                "early_termination": _EARLY_TERMINATION,
+                "persistent_actors": _PERSISTENT_ACTORS,
+                "snapshot_log_format": _SNAPSHOT_LOG_FORMAT,
+                "result_cache_path": _RESULT_CACHE,
+            },
+        )
+    else:
+        backend = create_backend(_BACKEND, _HOST, _PORT, _WORLD_MAP)
+        scene: Scenario = scenario_cls(
+            _HOST, _PORT, _WORLD_MAP, _OUTPUT_ROOT_DIR, backend
+        )
+        scene.early_termination = _EARLY_TERMINATION
+        scene.persistent_actors = _PERSISTENT_ACTORS
+        scene.snapshot_log_format = _SNAPSHOT_LOG_FORMAT
+        scene.result_cache_path = _RESULT_CACHE
+        runner = Serial_Runner(scene)
+
+    if not (
+        (_META_RESULT_DIR / "init_seed_result.npz").exists()
+        or (_META_RESULT_DIR / "init_seed_result.yml").exists()  # <-- campaigns from before the .npz
+    ):
         seed_list = gen_seed_list()
-        runned_seed_list: list[Seed] = []
         # seed_list = [Seed(0, 0, 4, 2)]
-        for seed in seed_list:
-            seed.round_num = round_cnt
-            round_cnt += 1
-            seed.round_result = scene.run(seed=seed)
-            if seed.round_result.result == "collision, hit NPC":
-                collision_seed_list.append(seed)
-            else:
-                runned_seed_list.append(seed)
-
-        runned_seed_list.sort(key=lambda x: x.round_result.loss.value)  # type: ignore
-        record_init_seed(runned_seed_list)
-    else:
-        runned_seed_list = recover_init_seed()
-
-    if (_META_RESULT_DIR / "current_state.yml").exists():
-        round_cnt, current_seed_no = restore_state()
+        runned_seed_list, init_collision_cnt = run_init_seed(
+            runner, seed_list, round_cnt, _META_RESULT_DIR, journal
+        )
+        round_cnt += len(seed_list)
+        collision_seed_cnt += init_collision_cnt
+        record_init_seed(artifact_writer, _META_RESULT_DIR, runned_seed_list)
     else:
+        runned_seed_list = recover_init_seed(_META_RESULT_DIR)
+
+    if corpus.count("init") == 0:
+        # the grid's collisions are only in the journal, as the action-free ones
+        init_collision_seeds = [
+            seed
+            for seed in recover_seed_lists(_META_RESULT_DIR / "result_journal.jsonl")[0]
+            if seed.action_capability == 0
+        ]
+        corpus.add_seeds([*runned_seed_list, *init_collision_seeds], "init")
+    init_seed_ids = corpus.seed_ids("init")[: len(runned_seed_list)]  # <-- runned_seed_list first
+    init_seed_nos = {seed_id: seed_no for seed_no, seed_id in enumerate(init_seed_ids)}
+    if not (_META_RESULT_DIR / "current_state.json").exists():
         round_cnt = len(runned_seed_list)
-        current_seed_no = 0
-
-    for i in range(len(runned_seed_list)):
-        if i < current_seed_no:
-            continue
-
-        seed = runned_seed_list[i]
-        record_state(round_cnt, i)
-        fuzzing_result = fuzzing(seed)
-        print(fuzzing_result)
-        print(f"Collision seed: {len(collision_seed_list)}")
-        print(f"Other seed: {len(other_seed_list)}")
-
-        if round_cnt > _TOTAL_ROUND:
-            break
+    else:
+        # rows written after the checkpoint are simulated again
+        corpus.discard_rounds_from(round_cnt)
+        corpus.set_explored(init_seed_ids[next_seed_no:], False)
+
+    run_chains(runner, seed_chains(resumed_chains), report_chain)
+    runner.close()
+    journal.close()
+    corpus.close()
+    if prescreen is not None:
+        prescreen_report = prescreen.report()
+        print(f"prescreen: {prescreen_report}")
+        artifact_writer.write_file(_META_RESULT_DIR / "prescreen.yml", yaml.dump(prescreen_report))
+        prescreen.close()
 
     record_seed(runned_seed_list)
+    artifact_writer.close()
@@ -0,0 +1,451 @@
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import yaml
+
+from scenario import Scenario, create_backend
+from scenario.artifact_writer import Artifact_Writer
+from scenario import Scenario_case00 as case00
+from scenario import Scenario_case04 as case04
+from scenario import Scenario_case06 as case06
+from scenario.corpus import Seed_Corpus
+from scenario.init_seed import record_init_seed, recover_init_seed, run_init_seed
+from scenario.journal import (
+    Result_Journal,
+    count_journal,
+    recover_seed_lists,
+    truncate_journal,
+)
+from scenario.seed import Seed
+from scenario.surrogate import Surrogate
+from scenario.worker_pool import Scenario_Pool, Serial_Runner
+
+_P_EGO_RANGE = (0, 10)
+_P_NPC_RANGE = (0, 10)
+_V_NPC_RANGE = (0, 60)
+
+_D_P_EGO = 1
+_D_P_NPC = 1
+_D_V_NPC = 4
+
+_LR = 0.2
+
+_LOW = np.array([_P_EGO_RANGE[0], _P_NPC_RANGE[0], _V_NPC_RANGE[0]], dtype=float)
+_HIGH = np.array([_P_EGO_RANGE[1], _P_NPC_RANGE[1], _V_NPC_RANGE[1]], dtype=float)
+_STEP = np.array([_D_P_EGO, _D_P_NPC, _D_V_NPC], dtype=float) * _LR  # <-- mutation sigma
+
+
+def gen_seed_list() -> list[Seed]:
+    print("generate initial seed ... ", end="", flush=True)
+    seed_list: list[Seed] = []
+    p_ego_list = [
+        x / 10
+        for x in range(
+            int((_P_EGO_RANGE[0] + _D_P_EGO) * 10 / 2),
+            int(_P_EGO_RANGE[1] * 10),
+            _D_P_EGO * 10,
+        )
+    ]
+    p_npc_list = [
+        x / 10
+        for x in range(
+            int((_P_NPC_RANGE[0] + _D_P_NPC) * 10 / 2),
+            int(_P_NPC_RANGE[1] * 10),
+            _D_P_NPC * 10,
+        )
+    ]
+    v_npc_list = [
+        x / 10
+        for x in range(
+            int((_V_NPC_RANGE[0] + _D_V_NPC) * 10 / 2),
+            int(_V_NPC_RANGE[1] * 10),
+            _D_V_NPC * 10,
+        )
+    ]
+    for p_ego in p_ego_list:
+        for p_npc in p_npc_list:
+            for v_npc in v_npc_list:
+                seed_list.append(
+                    Seed(
+                        round_num=-1,
+                        p_ego=p_ego,
+                        p_npc=p_npc,
+                        v_npc=v_npc,
+                        action_capability=0,
+                        action_chain=[],
+                    )
+                )
+    # for v_npc in v_npc_list:
+    #     seed_list.append(
+    #         Seed(
+    #             round_num=len(seed_list),
+    #             p_ego=0,
+    #             p_npc=0,
+    #             v_npc=v_npc,
+    #             action_capability=0,
+    #             action_chain=[],
+    #         )
+    #     )
+    print("Done")
+    return seed_list
+
+
+def param_matrix(seeds: list[Seed]) -> np.ndarray:
+    # (p_ego, p_npc, v_npc) per row
+    return np.array([[seed.p_ego, seed.p_npc, seed.v_npc] for seed in seeds], dtype=float)
+
+
+def fitness(seeds: list[Seed]) -> np.ndarray:
+    # lower is better: (1 + conflict time gap) / novelty, the novelty term is
+    # the one of the energy scheduler, so the population does not settle on
+    # the collisions it has already found
+    losses = np.array([seed.round_result.loss.time_gap for seed in seeds])  # type: ignore
+    if len(collisions) == 0:
+        return 1 + losses
+    scaled = (param_matrix(seeds) - _LOW) / (_HIGH - _LOW)
+    found = np.array(collisions)
+    nearest = np.sqrt(((scaled[:, None, :] - found[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+    novelty = 0.1 + 0.9 * np.minimum(1.0, nearest / _NOVELTY_RADIUS)
+    return (1 + losses) / novelty
+
+
+def select_parents(scores: np.ndarray, count: int) -> np.ndarray:
+    # tournament selection, indices into the population
+    entrants = rng.integers(0, len(scores), size=(count, _TOURNAMENT_SIZE))
+    return entrants[np.arange(count), np.argmin(scores[entrants], axis=1)]
+
+
+def cross_action_chain(first: Seed, second: Seed, cut: float) -> list[tuple[int, str]]:
+    # one-point crossover in time: first's actions before the cut tick,
+    # second's from it on. cut is in [0, 1) of the later chain end
+    chains = [sorted(seed.action_chain, key=lambda x: x[0]) for seed in (first, second)]
+    end = max([tick for chain in chains for tick, _ in chain], default=0) + 10
+    cut_tick = cut * end
+    return [
+        (tick, action) for tick, action in chains[0] if tick < cut_tick
+    ] + [(tick, action) for tick, action in chains[1] if tick >= cut_tick]
+
+
+def gen_generation(population: list[Seed], size: int, round_no: int) -> list[Seed]:
+    scores = fitness(population)
+    params = param_matrix(population)
+    first = select_parents(scores, size)
+    second = select_parents(scores, size)
+
+    # blend crossover (BLX-alpha) and gaussian mutation of all children at once
+    crossed = rng.random(size) < _CROSSOVER_RATE
+    weight = rng.uniform(-_BLEND_ALPHA, 1 + _BLEND_ALPHA, size=(size, 3))
+    children = np.where(
+        crossed[:, None], params[first] + weight * (params[second] - params[first]), params[first]
+    )
+    mutated = rng.random((size, 3)) < _MUTATION_RATE
+    children += mutated * rng.normal(0.0, 1.0, size=(size, 3)) * _STEP
+    children = np.clip(children, _LOW, _HIGH)
+
+    # action chains: crossover in time, then the guided action of the time
+    # gap driver (acc if ego passes the conflict point first, else dec, at a
+    # tick before that pass) or dropping one action
+    cut = np.where(crossed, rng.random(size), 1.0)
+    guided = rng.random(size) < _ACTION_MUTATION_RATE
+    dropped = rng.random(size) < _ACTION_DROP_RATE
+    tick_draw = rng.random(size)
+    drop_draw = rng.random(size)
+
+    new_seed_list: list[Seed] = []
+    for i in range(size):
+        parent = population[first[i]]
+        action_chain = cross_action_chain(parent, population[second[i]], cut[i])
+        assert parent.round_result is not None
+        conflict_point = parent.round_result.conflict_point
+        if guided[i] and conflict_point is not None and len(action_chain) < _MAX_ACTIONS:
+            if conflict_point.ego_pass_tick < conflict_point.obj_pass_tick:
+                pass_tick, action = conflict_point.ego_pass_tick, "acc"
+            else:
+                pass_tick, action = conflict_point.obj_pass_tick, "dec"
+            action_chain.append((int(tick_draw[i] * (pass_tick + 1) / 10) * 10, action))
+            action_chain.sort(key=lambda x: x[0])  # <-- stable, a tie keeps chain order
+        elif dropped[i] and len(action_chain) > 0:
+            del action_chain[int(drop_draw[i] * len(action_chain))]
+        new_seed_list.append(
+            Seed(
+                round_num=round_no + i,
+                p_ego=float(children[i, 0]),
+                p_npc=float(children[i, 1]),
+                v_npc=float(children[i, 2]),
+                action_capability=len(action_chain),  # <-- no random actions, rounds are cacheable
+                action_chain=action_chain,
+            )
+        )
+    return new_seed_list
+
+
+def run_generation(runner, new_seed_list: list[Seed]) -> list[Seed]:
+    # the whole generation is handed to the runner at once, so every worker
+    # has rounds queued. Results are recorded in generation order
+    global round_cnt
+    global collision_seed_cnt
+    global other_seed_cnt
+
+    for seed in new_seed_list:
+        runner.submit(seed)
+    for _ in new_seed_list:
+        seed, seed.round_result = runner.collect()
+        if surrogate is not None:
+            surrogate.update(seed)
+    round_cnt += len(new_seed_list)
+
+    survivors: list[Seed] = []
+    for seed in new_seed_list:
+        assert seed.round_result is not None
+        if seed.round_result.result == "collision, hit NPC":
+            print(f"Found collision, round: {seed.round_num}")
+            journal.record("collision", seed)
+            collision_seed_cnt += 1
+            collisions.append(((param_matrix([seed])[0] - _LOW) / (_HIGH - _LOW)).tolist())
+        else:
+            journal.record("other", seed)
+            other_seed_cnt += 1
+            survivors.append(seed)
+    corpus.add_seeds(new_seed_list, "fuzz")
+    return survivors
+
+
+def next_population(population: list[Seed], survivors: list[Seed]) -> list[Seed]:
+    # (mu + lambda): the best of parents and children by fitness, collisions
+    # leave the population
+    merged = population + survivors
+    order = np.argsort(fitness(merged), kind="stable")
+    return [merged[i] for i in order[:_POPULATION_SIZE]]
+
+
+def evolve(runner, population: list[Seed], generation: int):
+    while round_cnt < _TOTAL_ROUND and len(population) > 0:
+        size = min(_POPULATION_SIZE, _TOTAL_ROUND - round_cnt)
+        if surrogate is not None:
+            # a larger brood, the surrogate's top size are simulated
+            new_seed_list = surrogate.rank(
+                gen_generation(population, size * _SURROGATE_CANDIDATES, round_cnt), size
+            )
+            for i, seed in enumerate(new_seed_list):
+                seed.round_num = round_cnt + i
+        else:
+            new_seed_list = gen_generation(population, size, round_cnt)
+        survivors = run_generation(runner, new_seed_list)
+        population = next_population(population, survivors)
+        generation += 1
+        record_state(generation, population)
+        best = population[0].round_result.loss.time_gap if len(population) > 0 else None  # type: ignore
+        print(
+            f"generation {generation}: round {round_cnt}, best time gap {best}, "
+            f"collision {collision_seed_cnt}, other {other_seed_cnt}"
+        )
+    print(f"Collision seed: {collision_seed_cnt}")
+    print(f"Other seed: {other_seed_cnt}")
+
+
+def record_seed(init_seed_list: list[Seed]):
+    # yaml export of the result journal
+    collision_seed_list, other_seed_list = recover_seed_lists(
+        _META_RESULT_DIR / "result_journal.jsonl"
+    )
+    collision_record = {}
+    for seed in collision_seed_list:
+        collision_record[f"{seed.round_num}"] = {
+            "p_ego": seed.p_ego,
+            "p_npc": seed.p_npc,
+            "v_npc": seed.v_npc,
+            "action_chain": seed.action_chain,
+            "result": seed.round_result,
+        }
+    artifact_writer.write_file(_META_RESULT_DIR / "collision_seed.yml", yaml.dump(collision_record))
+
+    other_record = {}
+    for seed in other_seed_list:
+        other_record[f"{seed.round_num}"] = {
+            "p_ego": seed.p_ego,
+            "p_npc": seed.p_npc,
+            "v_npc": seed.v_npc,
+            "action_chain": seed.action_chain,
+            "result": seed.round_result,
+        }
+    artifact_writer.write_file(_META_RESULT_DIR / "other_seed.yml", yaml.dump(other_record))
+
+    init_record = {}
+    for seed in init_seed_list:
+        init_record[f"{seed.round_num}"] = {
+            "p_ego": seed.p_ego,
+            "p_npc": seed.p_npc,
+            "v_npc": seed.v_npc,
+            "action_chain": seed.action_chain,
+            "result": seed.round_result,
+        }
+    artifact_writer.write_file(_META_RESULT_DIR / "init_seed.yml", yaml.dump(init_record))
+
+
+def record_state(generation: int, population: list[Seed]):
+    # generation-granular checkpoint. A stop inside a generation runs it again,
+    # its finished rounds come back from the result cache
+    state = {
+        "current_round": round_cnt,
+        "generation": generation,
+        "population": [seed.to_basic_data() for seed in population],
+        "collisions": collisions,
+        "journal_offset": journal.tell(),
+        "rng_state": rng.bit_generator.state,
+    }
+    artifact_writer.replace_file(_META_RESULT_DIR / "current_state.json", json.dumps(state))
+
+
+def restore_state():
+    with open(_META_RESULT_DIR / "current_state.json", "r") as f:
+        state = json.load(f)
+        f.close()
+    rng.bit_generator.state = state["rng_state"]
+    population = [Seed.recover_from_basic_data(data) for data in state["population"]]
+    return (
+        state["current_round"],
+        state["generation"],
+        population,
+        state["collisions"],
+        state["journal_offset"],
+    )
+
+
+scenario_type = "town05_case06"
+_HOST = "localhost"
+_PORT = 2000
+_WORLD_MAP = "Town05"
+_BACKEND = "carla"  # <-- "carla" or "kinematic" (no simulator needed)
+_META_RESULT_DIR = Path(f"./result_{scenario_type}/population")
+_OUTPUT_ROOT_DIR = _META_RESULT_DIR / "result"
+
+_TOTAL_ROUND = 10000
+_POPULATION_SIZE = 32  # <-- seeds per generation, keep it a few times _WORKERS
+_TOURNAMENT_SIZE = 2
+_CROSSOVER_RATE = 0.9
+_BLEND_ALPHA = 0.5  # <-- BLX-alpha: children up to alpha * parent distance outside the parents
+_MUTATION_RATE = 0.3  # <-- per parameter
+_ACTION_MUTATION_RATE = 0.5  # <-- per child, one guided action appended
+_ACTION_DROP_RATE = 0.1  # <-- per child without a new action, one action removed
+_MAX_ACTIONS = 10
+_NOVELTY_RADIUS = 0.1  # <-- in parameters scaled to [0, 1]
+_RANDOM_SEED: Optional[int] = None  # <-- fixed for a reproducible campaign
+_SURROGATE = False  # <-- breed _SURROGATE_CANDIDATES times the generation, simulate the ones scenario.surrogate ranks first
+_SURROGATE_CANDIDATES = 8
+_EARLY_TERMINATION = False
+_PERSISTENT_ACTORS = False  # <-- reuse the vehicles between rounds instead of respawning
+_SNAPSHOT_LOG_FORMAT = "npy"  # <-- "csv" for the old text log, python -m scenario.snapshot_log converts
+_WORKERS = 1  # <-- simulators run in parallel, worker k uses port _PORT + 3 * k
+_RESULT_CACHE = Path("./result_cache.sqlite")  # <-- shared by the drivers, None: always simulate
+
+round_cnt = 0
+rng = np.random.default_rng(_RANDOM_SEED)
+surrogate: Optional[Surrogate] = None
+collisions: list[list[float]] = []  # <-- scaled (p_ego, p_npc, v_npc) of the collisions found
+collision_seed_cnt = 0
+other_seed_cnt = 0
+
+if __name__ == "__main__":
+    artifact_writer = Artifact_Writer()  # <-- result files are written off the main thread
+    _META_RESULT_DIR.mkdir(parents=True, exist_ok=True)
+    generation = 0
+    population: list[Seed] = []
+    if (_META_RESULT_DIR / "current_state.json").exists():
+        round_cnt, generation, population, collisions, journal_offset = restore_state()
+        truncate_journal(_META_RESULT_DIR / "result_journal.jsonl", journal_offset)
+    collision_seed_cnt, other_seed_cnt = count_journal(
+        _META_RESULT_DIR / "result_journal.jsonl"
+    )
+    journal = Result_Journal(_META_RESULT_DIR / "result_journal.jsonl")  # <-- every round's result
+    corpus = Seed_Corpus(_META_RESULT_DIR / "corpus.sqlite", scenario_type, _META_RESULT_DIR.name)
+    if scenario_type == "town05_case04":
+        scenario_cls = case04
+    elif scenario_type == "town05_case06":
+        scenario_cls = case06
+    elif scenario_type == "town05_case00":
+        scenario_cls = case00
+
+    runner: Serial_Runner | Scenario_Pool
+    if _WORKERS > 1:
+        runner = Scenario_Pool(
+            scenario_cls,
+            _HOST,
+            _PORT,
+            _WORLD_MAP,
+            _OUTPUT_ROOT_DIR,
+            backend=_BACKEND,
+            workers=_WORKERS,
+            options={
+                "early_termination": _EARLY_TERMINATION,
+                "persistent_actors": _PERSISTENT_ACTORS,
+                "snapshot_log_format": _SNAPSHOT_LOG_FORMAT,
+                "result_cache_path": _RESULT_CACHE,
+            },
+        )
+    else:
+        backend = create_backend(_BACKEND, _HOST, _PORT, _WORLD_MAP)
+        scene: Scenario = scenario_cls(
+            _HOST, _PORT, _WORLD_MAP, _OUTPUT_ROOT_DIR, backend
+        )
+        scene.early_termination = _EARLY_TERMINATION
+        scene.persistent_actors = _PERSISTENT_ACTORS
+        scene.snapshot_log_format = _SNAPSHOT_LOG_FORMAT
+        scene.result_cache_path = _RESULT_CACHE
+        runner = Serial_Runner(scene)
+
+    if not (
+        (_META_RESULT_DIR / "init_seed_result.npz").exists()
+        or (_META_RESULT_DIR / "init_seed_result.yml").exists()  # <-- campaigns from before the .npz
+    ):
+        seed_list = gen_seed_list()
+        runned_seed_list, init_collision_cnt = run_init_seed(
+            runner,
+            seed_list,
+            round_cnt,
+            _META_RESULT_DIR,
+            journal,
+            sort_key=lambda x: x.round_result.loss.time_gap,  # type: ignore
+        )
+        round_cnt += len(seed_list)
+        collision_seed_cnt += init_collision_cnt
+        record_init_seed(artifact_writer, _META_RESULT_DIR, runned_seed_list)
+    else:
+        runned_seed_list = recover_init_seed(_META_RESULT_DIR)
+
+    if corpus.count("init") == 0:
+        # the grid's collisions are only in the journal, as the action-free ones
+        init_collision_seeds = [
+            seed
+            for seed in recover_seed_lists(_META_RESULT_DIR / "result_journal.jsonl")[0]
+            if seed.action_capability == 0
+        ]
+        corpus.add_seeds([*runned_seed_list, *init_collision_seeds], "init")
+    init_seed_ids = corpus.seed_ids("init")[: len(runned_seed_list)]  # <-- runned_seed_list first
+    if _SURROGATE:
+        # trained on every round so far, then on each new one
+        surrogate = Surrogate([_P_EGO_RANGE, _P_NPC_RANGE, _V_NPC_RANGE])
+        collision_seed_list, other_seed_list = recover_seed_lists(
+            _META_RESULT_DIR / "result_journal.jsonl"
+        )
+        surrogate.fit([*runned_seed_list, *collision_seed_list, *other_seed_list])
+    if not (_META_RESULT_DIR / "current_state.json").exists():
+        # the first population is the grid's best, the grid collisions count as found
+        round_cnt = len(runned_seed_list)
+        for seed in recover_seed_lists(_META_RESULT_DIR / "result_journal.jsonl")[0]:
+            collisions.append(((param_matrix([seed])[0] - _LOW) / (_HIGH - _LOW)).tolist())
+        population = runned_seed_list[:_POPULATION_SIZE]
+        corpus.set_explored(init_seed_ids[:_POPULATION_SIZE])
+        record_state(generation, population)
+    else:
+        # rows written after the checkpoint are simulated again
+        corpus.discard_rounds_from(round_cnt)
+
+    evolve(runner, population, generation)
+    runner.close()
+    journal.close()
+    corpus.close()
+
+    record_seed(runned_seed_list)
+    artifact_writer.close()
@@ -1,3 +1,5 @@
+from .backend import Backend, Carla_Backend, create_backend
+from .kinematic_backend import Kinematic_Backend
 from .scenario import Scenario
 from .scenario_town05_case00 import Scenario_case00
 from .scenario_town05_case04 import Scenario_case04
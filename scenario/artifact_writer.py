@@ -0,0 +1,138 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+
+class Artifact_File:
+    # file-like handle whose writes are carried out by an Artifact_Writer,
+    # in submission order. Data must be str/bytes (it is not copied)
+    def __init__(self, writer: "Artifact_Writer", path, mode: str):
+        self.writer = writer
+        self.path = Path(path)
+        self.mode = mode
+        self.file = None
+        writer.submit(self._open)
+
+    def _open(self):
+        self.file = open(self.path, self.mode)
+
+    def _write(self, data):
+        self.file.write(data)  # type: ignore
+
+    def _close(self):
+        self.file.flush()  # type: ignore
+        os.fsync(self.file.fileno())  # type: ignore
+        self.file.close()  # type: ignore
+
+    def write(self, data):
+        self.writer.submit(lambda: self._write(data))
+
+    def writelines(self, data):
+        self.write(data)
+
+    def close(self):
+        self.writer.submit(self._close)
+
+
+class Artifact_Writer:
+    # round artifacts (env_info, snapshot logs, seed records) are written by
+    # a background thread so the tick loop never waits on the filesystem.
+    # The queue is bounded: when the disk falls behind, submit blocks until
+    # the writer catches up. One thread keeps writes to a file in order.
+    def __init__(self, max_pending: int = 256):
+        self.jobs: queue.Queue[Optional[Callable[[], None]]] = queue.Queue(max_pending)
+        self.error: Optional[BaseException] = None
+        self.stall_count = 0  # <-- submits that had to wait for a free slot
+        self.stall_seconds = 0.0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if self.error is None:
+                try:
+                    job()
+                except BaseException as err:
+                    self.error = err
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError(f"artifact writer failed: {self.error!r}")
+
+    def submit(self, job: Callable[[], None]):
+        self.check()
+        if self.closed:
+            raise RuntimeError("artifact writer is closed")
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            start = time.perf_counter()
+            self.jobs.put(job)
+            self.stall_count += 1
+            self.stall_seconds += time.perf_counter() - start
+
+    def open(self, path, mode: str = "w") -> Artifact_File:
+        return Artifact_File(self, path, mode)
+
+    def write_file(self, path, data, mode: str = "w"):
+        # whole file in one job, fsynced before the writer moves on
+        file = self.open(path, mode)
+        file.write(data)
+        file.close()
+
+    def replace_file(self, path, data, mode: str = "w"):
+        # atomic: the old file stays in place until the new one is fsynced
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+
+        def job():
+            with open(tmp_path, mode) as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            os.replace(tmp_path, path)
+
+        self.submit(job)
+
+    def close(self):
+        # drain the queue, every Artifact_File closed so far is fsynced
+        if self.closed:
+            return
+        self.closed = True
+        self.jobs.put(None)
+        self.thread.join()
+        atexit.unregister(self.close)
+        self.check()
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        writer = Artifact_Writer(max_pending=4)
+        log = writer.open(Path(tmp_dir) / "log.txt")
+        for i in range(1000):
+            log.write(f"{i}\n")
+        log.close()
+        writer.write_file(Path(tmp_dir) / "env_info.yml", "result: arrive\n")
+        for i in range(10):
+            writer.replace_file(Path(tmp_dir) / "state.json", f"{i}")
+        writer.close()
+        with open(Path(tmp_dir) / "log.txt") as f:
+            assert f.read() == "".join(f"{i}\n" for i in range(1000))
+            f.close()
+        with open(Path(tmp_dir) / "state.json") as f:
+            assert f.read() == "9"
+            f.close()
+        assert not (Path(tmp_dir) / "state.json.tmp").exists()
+        print(f"ok, {writer.stall_count} stalls, {writer.stall_seconds * 1000:.1f} ms")
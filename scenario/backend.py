@@ -0,0 +1,554 @@
+import functools
+import time
+from typing import Callable, Optional
+
+try:
+    import carla
+except ImportError:  # <-- no CARLA client installed, only the kinematic backend runs
+    from . import geometry as carla  # type: ignore
+
+
+class Round_Trip_Stats:
+    # simulator round trips issued through a backend and the wall time spent
+    # in them. Calls nested in a counted call (a batch) are not counted again
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.depth = 0
+
+    def begin(self):
+        self.depth += 1
+        return time.perf_counter()
+
+    def end(self, start: float, calls: int = 1):
+        self.depth -= 1
+        if self.depth == 0:
+            self.count += calls
+            self.seconds += time.perf_counter() - start
+
+    def read(self) -> tuple[int, float]:
+        return self.count, self.seconds
+
+
+def round_trip(calls: int = 1):
+    # counts a backend method as `calls` simulator round trips
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = self.stats.begin()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.stats.end(start, calls)
+
+        return wrapper
+
+    return decorator
+
+
+class Future_Actor:
+    # handle returned by a spawn recorded in a Command_Batch, the actor is
+    # filled in when the batch is applied
+    def __init__(self):
+        self.actor = None
+
+    @staticmethod
+    def resolve(actor):
+        if isinstance(actor, Future_Actor):
+            if actor.actor is None:
+                raise RuntimeError("actor of a command batch used before the batch was applied")
+            return actor.actor
+        return actor
+
+
+class Actor_State:
+    # what Scenario reads of one vehicle in a tick
+    __slots__ = ("location", "velocity", "acceleration", "control")
+
+    def __init__(self, location, velocity, acceleration, control):
+        self.location = location
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.control = control
+
+
+class Tick_State:
+    # everything Scenario needs after a tick, captured once: the timestamp
+    # and the state of the requested actors, in the requested order
+    __slots__ = ("timestamp", "actors")
+
+    def __init__(self, timestamp, actors: tuple[Actor_State, ...]):
+        self.timestamp = timestamp
+        self.actors = actors
+
+
+class Command_Batch:
+    # backend calls recorded now and submitted together by Backend.apply_batch.
+    # Everything in a batch takes effect in the same simulation frame.
+    commands: list[tuple[str, tuple, Optional[Future_Actor]]]
+
+    def __init__(self):
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def record(self, name: str, *args):
+        self.commands.append((name, args, None))
+
+    def spawn_vehicle(self, blueprint_id: str, transform, attributes: dict[str, str]):
+        future = Future_Actor()
+        self.commands.append(
+            ("spawn_vehicle", (blueprint_id, transform, attributes), future)
+        )
+        return future
+
+    def spawn_collision_sensor(self, parent, callback: Callable):
+        future = Future_Actor()
+        self.commands.append(("spawn_collision_sensor", (parent, callback), future))
+        return future
+
+    def configure_vehicle(self, actor):
+        self.record("configure_vehicle", actor)
+
+    def destroy(self, actor):
+        self.record("destroy", actor)
+
+    def set_transform(self, actor, transform):
+        self.record("set_transform", actor, transform)
+
+    def set_target_velocity(self, actor, velocity):
+        self.record("set_target_velocity", actor, velocity)
+
+    def apply_control(self, actor, control):
+        self.record("apply_control", actor, control)
+
+    def enable_constant_velocity(self, actor, velocity):
+        self.record("enable_constant_velocity", actor, velocity)
+
+    def disable_constant_velocity(self, actor):
+        self.record("disable_constant_velocity", actor)
+
+    def set_autopilot(self, actor, enabled: bool):
+        self.record("set_autopilot", actor, enabled)
+
+    def set_path(self, actor, route: list):
+        self.record("set_path", actor, route)
+
+    def reset_vehicle(self, actor, transform):
+        Backend.reset_vehicle(self, actor, transform)  # type: ignore  # <-- records the same primitives
+
+
+class Backend:
+    # everything Scenario needs from a simulator. Actors are opaque handles
+    # returned by spawn_vehicle, transforms/vectors/controls are carla types
+    # (or their scenario.geometry mirrors when CARLA is not installed).
+    world = None  # <-- carla.World for debug drawing, None elsewhere
+    state_dtype = "float64"  # <-- precision of the actor states, for binary logs
+    restorable = False  # <-- save_state / restore_state are implemented
+    stats: Round_Trip_Stats
+
+    # commands CARLA can take in one apply_batch_sync, the rest (traffic
+    # manager, constant velocity) are still one round trip each
+    _BATCHED_COMMANDS = (
+        "destroy",
+        "set_transform",
+        "set_target_velocity",
+        "apply_control",
+        "set_autopilot",
+    )
+
+    def __init__(self):
+        self.stats = Round_Trip_Stats()
+
+    def apply_settings(self, synchronous_mode: bool, fixed_delta_seconds: float):
+        raise NotImplementedError
+
+    def get_spawn_points(self):
+        raise NotImplementedError
+
+    def generate_waypoints(self, distance: float) -> list:
+        return []
+
+    def set_spectator(self, transform):
+        pass
+
+    def spawn_vehicle(self, blueprint_id: str, transform, attributes: dict[str, str]):
+        raise NotImplementedError
+
+    def configure_vehicle(self, actor):
+        # no random lane changes, lights on, ignore traffic lights and signs
+        raise NotImplementedError
+
+    def spawn_collision_sensor(self, parent, callback: Callable):
+        raise NotImplementedError
+
+    def destroy(self, actor):
+        raise NotImplementedError
+
+    def reset_vehicle(self, actor, transform):
+        # bring a spawned vehicle back to the state of a fresh spawn at transform.
+        # The unbatched call goes first, in a Command_Batch the rest joins the
+        # other vehicles' resets in one run
+        self.disable_constant_velocity(actor)
+        self.set_autopilot(actor, False)
+        self.apply_control(actor, carla.VehicleControl())
+        self.set_target_velocity(actor, carla.Vector3D(0, 0, 0))
+        self.set_transform(actor, transform)
+
+    def tick(self):
+        raise NotImplementedError
+
+    def save_state(self):
+        # checkpoint of the world and its actors, restore_state goes back to
+        # it with the same actor handles. CARLA has no such call (its recorder
+        # replays a log, it does not restore the physics state)
+        raise NotImplementedError
+
+    def restore_state(self, state):
+        raise NotImplementedError
+
+    def get_snapshot(self):
+        raise NotImplementedError
+
+    def capture_tick(self, actors: list) -> Tick_State:
+        return Tick_State(
+            self.get_snapshot().timestamp,
+            tuple(
+                Actor_State(
+                    self.get_transform(actor).location,
+                    self.get_velocity(actor),
+                    self.get_acceleration(actor),
+                    self.get_control(actor),
+                )
+                for actor in actors
+            ),
+        )
+
+    def get_transform(self, actor):
+        raise NotImplementedError
+
+    def set_transform(self, actor, transform):
+        raise NotImplementedError
+
+    def get_velocity(self, actor):
+        raise NotImplementedError
+
+    def set_target_velocity(self, actor, velocity):
+        raise NotImplementedError
+
+    def get_acceleration(self, actor):
+        raise NotImplementedError
+
+    def get_control(self, actor):
+        raise NotImplementedError
+
+    def apply_control(self, actor, control):
+        raise NotImplementedError
+
+    def enable_constant_velocity(self, actor, velocity):
+        raise NotImplementedError
+
+    def disable_constant_velocity(self, actor):
+        raise NotImplementedError
+
+    def set_autopilot(self, actor, enabled: bool):
+        raise NotImplementedError
+
+    def set_path(self, actor, route: list):
+        raise NotImplementedError
+
+    def force_lane_change(self, actor, direction: bool):
+        # direction: True -> right lane, False -> left lane
+        raise NotImplementedError
+
+    def apply_batch(self, batch: Command_Batch):
+        # spawns first, in waves so an attached sensor follows its parent: a
+        # command recorded before a spawn cannot refer to the new actor. The
+        # other commands keep their recorded order per actor (the first
+        # argument): batchable ones are collected into a run that goes out
+        # together, any other command goes ahead of the run unless the run
+        # has a command for its actor, then the run is flushed first.
+        # Everything takes effect in the same frame, commands on different
+        # actors do not depend on each other's order
+        spawns = [command for command in batch.commands if command[2] is not None]
+        while len(spawns) > 0:
+            wave = [
+                command
+                for command in spawns
+                if not any(
+                    isinstance(arg, Future_Actor) and arg.actor is None
+                    for arg in command[1]
+                )
+            ]
+            if len(wave) == 0:
+                raise RuntimeError("command batch spawns depend on each other")
+            self.apply_spawn_wave(
+                [(name, self.resolve_args(args), future) for name, args, future in wave]  # type: ignore
+            )
+            spawns = [command for command in spawns if command[2].actor is None]  # type: ignore
+
+        batched = []
+        batched_actors = set()  # <-- id() of the actors in the run
+        for name, args, future in batch.commands:
+            if future is not None:
+                continue
+            args = self.resolve_args(args)
+            if name in self._BATCHED_COMMANDS:
+                batched.append((name, args))
+                batched_actors.add(id(args[0]))
+                continue
+            if id(args[0]) in batched_actors:
+                self.apply_batched_commands(batched)
+                batched = []
+                batched_actors = set()
+            getattr(self, name)(*args)
+        if len(batched) > 0:
+            self.apply_batched_commands(batched)
+
+    @staticmethod
+    def resolve_args(args: tuple) -> tuple:
+        return tuple(Future_Actor.resolve(arg) for arg in args)
+
+    def apply_spawn_wave(self, wave: list[tuple[str, tuple, Future_Actor]]):
+        start = self.stats.begin()
+        try:
+            for name, args, future in wave:
+                future.actor = getattr(self, name)(*args)
+        finally:
+            self.stats.end(start)
+
+    def apply_batched_commands(self, commands: list[tuple[str, tuple]]):
+        start = self.stats.begin()
+        try:
+            for name, args in commands:
+                getattr(self, name)(*args)
+        finally:
+            self.stats.end(start)
+
+
+class Carla_Backend(Backend):
+    state_dtype = "float32"  # <-- CARLA keeps locations, velocities and controls as C floats
+
+    def __init__(self, host, port, world_map, tm_port=8000):
+        Backend.__init__(self)
+        self.client = carla.Client(host, port)
+        self.client.load_world(world_map)
+        self.world = self.client.get_world()
+        self.blueprint_library = self.world.get_blueprint_library()
+
+        self.traffic_manager = self.client.get_trafficmanager(tm_port)
+        self.traffic_manager.set_synchronous_mode(True)
+
+    @round_trip(2)
+    def apply_settings(self, synchronous_mode: bool, fixed_delta_seconds: float):
+        settings = self.world.get_settings()
+        settings.synchronous_mode = synchronous_mode
+        settings.fixed_delta_seconds = fixed_delta_seconds  # type: ignore
+        self.world.apply_settings(settings)
+
+    @round_trip()
+    def get_spawn_points(self):
+        return self.world.get_map().get_spawn_points()
+
+    @round_trip()
+    def generate_waypoints(self, distance: float) -> list:
+        return self.world.get_map().generate_waypoints(distance)
+
+    @round_trip(2)
+    def set_spectator(self, transform):
+        self.world.get_spectator().set_transform(transform)
+
+    def vehicle_blueprint(self, blueprint_id: str, attributes: dict[str, str]):
+        vehicle_bp = self.blueprint_library.find(blueprint_id)
+        for key, value in attributes.items():
+            vehicle_bp.set_attribute(key, value)
+        return vehicle_bp
+
+    @round_trip()
+    def spawn_vehicle(self, blueprint_id: str, transform, attributes: dict[str, str]):
+        return self.world.spawn_actor(
+            self.vehicle_blueprint(blueprint_id, attributes), transform
+        )
+
+    @round_trip(5)
+    def configure_vehicle(self, actor):
+        self.traffic_manager.random_left_lanechange_percentage(actor, 0)
+        self.traffic_manager.update_vehicle_lights(actor, True)
+        self.traffic_manager.random_right_lanechange_percentage(actor, 0)
+        self.traffic_manager.ignore_lights_percentage(actor, 100)
+        self.traffic_manager.ignore_signs_percentage(actor, 100)
+
+    @round_trip(2)
+    def spawn_collision_sensor(self, parent, callback: Callable):
+        sensor = self.world.spawn_actor(
+            self.blueprint_library.find("sensor.other.collision"),
+            carla.Transform(),
+            attach_to=parent,
+        )
+        sensor.listen(lambda event: callback(event))  # type: ignore
+        return sensor
+
+    @round_trip()
+    def destroy(self, actor):
+        actor.destroy()
+
+    @round_trip()
+    def tick(self):
+        self.world.tick()
+
+    @round_trip()
+    def get_snapshot(self):
+        return self.world.get_snapshot()
+
+    @round_trip()
+    def capture_tick(self, actors: list) -> Tick_State:
+        # one snapshot holds transform, velocity and acceleration of every
+        # actor; get_control reads the client's copy of that same snapshot
+        snapshot = self.world.get_snapshot()
+        states = []
+        for actor in actors:
+            actor_snapshot = snapshot.find(actor.id)
+            states.append(
+                Actor_State(
+                    actor_snapshot.get_transform().location,
+                    actor_snapshot.get_velocity(),
+                    actor_snapshot.get_acceleration(),
+                    actor.get_control(),
+                )
+            )
+        return Tick_State(snapshot.timestamp, tuple(states))
+
+    @round_trip()
+    def get_transform(self, actor):
+        return actor.get_transform()
+
+    @round_trip()
+    def set_transform(self, actor, transform):
+        actor.set_transform(transform)
+
+    @round_trip()
+    def get_velocity(self, actor):
+        return actor.get_velocity()
+
+    @round_trip(2)
+    def set_target_velocity(self, actor, velocity):
+        actor.set_target_velocity(velocity)
+        actor.set_target_angular_velocity(carla.Vector3D(0, 0, 0))
+
+    @round_trip()
+    def get_acceleration(self, actor):
+        return actor.get_acceleration()
+
+    @round_trip()
+    def get_control(self, actor):
+        return actor.get_control()
+
+    @round_trip()
+    def apply_control(self, actor, control):
+        actor.apply_control(control)
+
+    @round_trip()
+    def enable_constant_velocity(self, actor, velocity):
+        actor.enable_constant_velocity(velocity)
+
+    @round_trip()
+    def disable_constant_velocity(self, actor):
+        actor.disable_constant_velocity()
+
+    @round_trip()
+    def set_autopilot(self, actor, enabled: bool):
+        actor.set_autopilot(enabled, self.traffic_manager.get_port())
+
+    @round_trip()
+    def set_path(self, actor, route: list):
+        self.traffic_manager.set_path(actor, route)  # type: ignore
+
+    @round_trip()
+    def force_lane_change(self, actor, direction: bool):
+        self.traffic_manager.force_lane_change(actor, direction)  # type: ignore
+
+    def apply_batch_sync(self, commands: list) -> list[int]:
+        start = self.stats.begin()
+        try:
+            responses = self.client.apply_batch_sync(commands, False)
+        finally:
+            self.stats.end(start)
+        errors = [response.error for response in responses if response.error]
+        if len(errors) > 0:
+            raise RuntimeError(f"command batch failed: {errors}")
+        return [response.actor_id for response in responses]
+
+    def apply_spawn_wave(self, wave: list[tuple[str, tuple, Future_Actor]]):
+        commands = []
+        for name, args, _ in wave:
+            if name == "spawn_vehicle":
+                blueprint_id, transform, attributes = args
+                commands.append(
+                    carla.command.SpawnActor(
+                        self.vehicle_blueprint(blueprint_id, attributes), transform
+                    )
+                )
+            else:  # <-- spawn_collision_sensor
+                parent, _callback = args
+                commands.append(
+                    carla.command.SpawnActor(
+                        self.blueprint_library.find("sensor.other.collision"),
+                        carla.Transform(),
+                        parent.id,
+                    )
+                )
+        actor_ids = self.apply_batch_sync(commands)
+
+        start = self.stats.begin()
+        try:
+            actors = {actor.id: actor for actor in self.world.get_actors(actor_ids)}
+        finally:
+            self.stats.end(start)
+        for (name, args, future), actor_id in zip(wave, actor_ids):
+            future.actor = actors[actor_id]
+            if name == "spawn_collision_sensor":
+                callback = args[1]
+                start = self.stats.begin()
+                try:
+                    future.actor.listen(lambda event, callback=callback: callback(event))
+                finally:
+                    self.stats.end(start)
+
+    def apply_batched_commands(self, commands: list[tuple[str, tuple]]):
+        carla_commands = []
+        for name, args in commands:
+            if name == "destroy":
+                carla_commands.append(carla.command.DestroyActor(args[0].id))
+            elif name == "set_transform":
+                carla_commands.append(carla.command.ApplyTransform(args[0].id, args[1]))
+            elif name == "set_target_velocity":
+                carla_commands.append(
+                    carla.command.ApplyTargetVelocity(args[0].id, args[1])
+                )
+                carla_commands.append(
+                    carla.command.ApplyTargetAngularVelocity(
+                        args[0].id, carla.Vector3D(0, 0, 0)
+                    )
+                )
+            elif name == "apply_control":
+                carla_commands.append(
+                    carla.command.ApplyVehicleControl(args[0].id, args[1])
+                )
+            elif name == "set_autopilot":
+                carla_commands.append(
+                    carla.command.SetAutopilot(
+                        args[0].id, args[1], self.traffic_manager.get_port()
+                    )
+                )
+        self.apply_batch_sync(carla_commands)
+
+
+def create_backend(name: str, host, port, world_map, tm_port=8000) -> Backend:
+    if name == "carla":
+        return Carla_Backend(host, port, world_map, tm_port)
+    if name == "kinematic":
+        from .kinematic_backend import Kinematic_Backend
+
+        return Kinematic_Backend(world_map)
+    raise ValueError(f"unknown backend: {name}")
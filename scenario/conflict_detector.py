@@ -0,0 +1,452 @@
+import bisect
+import math
+from typing import Optional
+
+import numpy as np
+
+from .conflict_point import Conflict_Point
+from .loss import Loss
+from .utils import (
+    _EPSILON_DISTANCE,
+    _DELTA_END_DISTANCE,
+    get_conflict_point_grid,
+    calculate_min_distance,
+    same_conflict_point,
+)
+
+_NEIGHBOUR_CELLS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+_CLEAR_DISTANCE = 5  # <-- distance both actors keep from their conflict point
+_CLEAR_HOLD_TICKS = 100  # <-- ticks without near pairs while the separation grows
+
+
+def _first(lo: int, hi: int, pred) -> int:
+    # smallest k in [lo, hi] with pred(k), pred is False up to some k and True
+    # from it on, pred(hi) is True
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if pred(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class Conflict_Detector:
+    # online version of get_conflict_point / calculate_min_distance, fed one
+    # (t, x, y, z) sample of each actor per tick, both with the tick's time.
+    # Consecutive samples at the same position make up a stay (an actor at
+    # rest reports the same location every tick) and the stays are bucketed
+    # in a grid with cell size epsilon_distance. A new stay is compared with
+    # the other actor's stays in the 3x3 cells around it only, and a pair of
+    # stays within epsilon_distance is one rectangle of (ego tick, npc tick)
+    # candidates with a single distance that grows while either stay goes on,
+    # so a standing actor costs a tick no more than a moving one.
+    # The time gap is monotone along the rows and columns of a rectangle,
+    # its first minimum is found by bisection when the rectangle is made and
+    # stays put as it grows (the new rows and columns are further apart in
+    # time). conflict_point replays get_conflict_point's update rule on the
+    # rectangles.
+    ego_samples: list[tuple[float, float, float, float]]
+    npc_samples: list[tuple[float, float, float, float]]
+    ego_stays: list[list]  # <-- [first tick, last tick, (x, y, z)]
+    npc_stays: list[list]
+    rects: list[tuple[int, int, float]]  # <-- (ego stay, npc stay, distance) within epsilon_distance
+    min_distance: tuple[int, float]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.tick = 0
+        self.ego_samples = []
+        self.npc_samples = []
+        self.ego_stays = []
+        self.npc_stays = []
+        self.ego_stay_rects: list[int] = []  # <-- rectangles of each stay
+        self.npc_stay_rects: list[int] = []
+        self.ego_cells: dict[tuple[int, int], list[int]] = {}
+        self.npc_cells: dict[tuple[int, int], list[int]] = {}
+        self.rects = []
+        self.end_rects: list[int] = []  # <-- rectangles within delta_end_distance
+        self.best: Optional[tuple[float, int, int, float]] = None  # <-- first smallest time gap, its distance
+        self.min_distance = (-1, math.inf)
+        self.last_candidate_tick = -1
+        self.path_ahead_tick = -1  # <-- last tick an actor had the other's path ahead of it
+        self.separation = math.inf
+        self.separation_growing_ticks = 0
+        self._conflict_point: Optional[Conflict_Point] = None
+        self._dirty = False
+
+    def save(self):
+        # checkpoint for restore. Samples, stays, cell lists and rectangles
+        # only grow and only the last stay of an actor changes, so their
+        # lengths and the last stays' ends stand for them
+        return (
+            self.tick,
+            len(self.ego_stays),
+            self.ego_stays[-1][1] if len(self.ego_stays) > 0 else -1,
+            len(self.npc_stays),
+            self.npc_stays[-1][1] if len(self.npc_stays) > 0 else -1,
+            len(self.rects),
+            len(self.end_rects),
+            self.best,
+            self.min_distance,
+            self.last_candidate_tick,
+            self.path_ahead_tick,
+            self.separation,
+            self.separation_growing_ticks,
+            self._conflict_point,
+            self._dirty,
+        )
+
+    def restore(self, state):
+        (
+            tick,
+            ego_stay_cnt,
+            ego_stay_end,
+            npc_stay_cnt,
+            npc_stay_end,
+            rect_cnt,
+            end_rect_cnt,
+            self.best,
+            self.min_distance,
+            self.last_candidate_tick,
+            self.path_ahead_tick,
+            self.separation,
+            self.separation_growing_ticks,
+            self._conflict_point,
+            self._dirty,
+        ) = state
+        del self.ego_samples[tick:]
+        del self.npc_samples[tick:]
+        for ego_stay, npc_stay, _ in self.rects[rect_cnt:]:
+            self.ego_stay_rects[ego_stay] -= 1
+            self.npc_stay_rects[npc_stay] -= 1
+        del self.rects[rect_cnt:]
+        del self.end_rects[end_rect_cnt:]
+        for stays, stay_rects, cells, stay_cnt, stay_end in (
+            (self.ego_stays, self.ego_stay_rects, self.ego_cells, ego_stay_cnt, ego_stay_end),
+            (self.npc_stays, self.npc_stay_rects, self.npc_cells, npc_stay_cnt, npc_stay_end),
+        ):
+            del stays[stay_cnt:]
+            del stay_rects[stay_cnt:]
+            if stay_cnt > 0:
+                stays[-1][1] = stay_end
+            for cell, indices in list(cells.items()):
+                del indices[bisect.bisect_left(indices, stay_cnt) :]
+                if len(indices) == 0:
+                    del cells[cell]
+        self.tick = tick
+
+    @staticmethod
+    def _cell(sample) -> tuple[int, int]:
+        return (
+            math.floor(sample[1] / _EPSILON_DISTANCE),
+            math.floor(sample[2] / _EPSILON_DISTANCE),
+        )
+
+    def _pair(self, ego_stay: int, npc_stay: int):
+        p1 = self.ego_stays[ego_stay][2]
+        p2 = self.npc_stays[npc_stay][2]
+        dist = math.sqrt(
+            (p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2 + (p1[2] - p2[2]) ** 2
+        )
+        if dist > _EPSILON_DISTANCE:
+            return
+        if not dist > _DELTA_END_DISTANCE:
+            self.end_rects.append(len(self.rects))
+        self.rects.append((ego_stay, npc_stay, dist))
+        self.ego_stay_rects[ego_stay] += 1
+        self.npc_stay_rects[npc_stay] += 1
+        a1, a2, _ = self.ego_stays[ego_stay]
+        b1, b2, _ = self.npc_stays[npc_stay]
+        if a1 == a2 and b1 == b2:
+            block = (abs(self.ego_samples[a1][0] - self.npc_samples[b1][0]), a1, b1)
+        else:
+            block = self._block_first_min(a1, a2, b1, b2)
+        if self.best is None or block < self.best[:3]:  # type: ignore
+            self.best = (*block, dist)  # type: ignore
+
+    def update(self, ego_sample, npc_sample):
+        tick = self.tick
+        self.ego_samples.append(ego_sample)
+        self.npc_samples.append(npc_sample)
+
+        dist = math.sqrt(
+            (ego_sample[1] - npc_sample[1]) ** 2
+            + (ego_sample[2] - npc_sample[2]) ** 2
+            + (ego_sample[3] - npc_sample[3]) ** 2
+        )
+        if dist < self.min_distance[1]:
+            self.min_distance = (tick, dist)
+        if dist > self.separation:
+            self.separation_growing_ticks += 1
+        else:
+            self.separation_growing_ticks = 0
+        self.separation = dist
+
+        # a new stay of one actor pairs with the other's stays around it, a
+        # new pair of stays is paired once: the npc's goes into the grid
+        # before the ego looks, the ego's after the npc looked
+        npc_position = (npc_sample[1], npc_sample[2], npc_sample[3])
+        npc_new = len(self.npc_stays) == 0 or self.npc_stays[-1][2] != npc_position
+        if npc_new:
+            self.npc_stays.append([tick, tick, npc_position])
+        else:
+            self.npc_stays[-1][1] = tick
+        ego_position = (ego_sample[1], ego_sample[2], ego_sample[3])
+        ego_new = len(self.ego_stays) == 0 or self.ego_stays[-1][2] != ego_position
+        if ego_new:
+            self.ego_stays.append([tick, tick, ego_position])
+        else:
+            self.ego_stays[-1][1] = tick
+        npc_stay = len(self.npc_stays) - 1
+        ego_stay = len(self.ego_stays) - 1
+        if npc_new:
+            npc_cell = self._cell(npc_sample)
+            self.npc_stay_rects.append(0)
+            self.npc_cells.setdefault(npc_cell, []).append(npc_stay)
+        if ego_new:
+            ego_cell = self._cell(ego_sample)
+            self.ego_stay_rects.append(0)
+            cx, cy = ego_cell
+            for dx, dy in _NEIGHBOUR_CELLS:
+                for j in self.npc_cells.get((cx + dx, cy + dy), ()):
+                    self._pair(ego_stay, j)
+        if npc_new:
+            cx, cy = npc_cell
+            for dx, dy in _NEIGHBOUR_CELLS:
+                for i in self.ego_cells.get((cx + dx, cy + dy), ()):
+                    self._pair(i, npc_stay)
+        if ego_new:
+            self.ego_cells.setdefault(ego_cell, []).append(ego_stay)
+        if self.ego_stay_rects[ego_stay] > 0 or self.npc_stay_rects[npc_stay] > 0:
+            # the current stays' rectangles took in this tick's pairs
+            self.last_candidate_tick = tick
+            self._dirty = True
+        self.tick += 1
+
+    def _block_first_min(
+        self, a1: int, a2: int, b1: int, b2: int
+    ) -> Optional[tuple[float, int, int]]:
+        # (time gap, i, j) of the first minimum in (i, j) order over the ego
+        # ticks a1..a2 and npc ticks b1..b2, None if the block is empty
+        if a1 > a2 or b1 > b2:
+            return None
+        ego = self.ego_samples
+        npc = self.npc_samples
+        k = max(a1, b1)
+        if k <= min(a2, b2):
+            return (abs(ego[k][0] - npc[k][0]), k, k)  # <-- a shared tick, its samples share the time
+        if a2 < b1:
+            # ego ticks all before the npc ones: smallest gap in column b1,
+            # the gap falls along it
+            t = npc[b1][0]
+            gap = abs(ego[a2][0] - t)
+            return (gap, _first(a1, a2, lambda i: abs(ego[i][0] - t) == gap), b1)
+        # npc ticks all before the ego ones: smallest gap in row a1
+        t = ego[a1][0]
+        gap = abs(t - npc[b2][0])
+        return (gap, a1, _first(b1, b2, lambda j: abs(t - npc[j][0]) == gap))
+
+    def _gap_before(self, i0: int, j0: int) -> float:
+        # smallest time gap of the candidates before (i0, j0) in (i, j) order
+        gap = math.inf
+        for ego_stay, npc_stay, _ in self.rects:
+            a1, a2, _ = self.ego_stays[ego_stay]
+            b1, b2, _ = self.npc_stays[npc_stay]
+            for block in (
+                self._block_first_min(a1, min(a2, i0 - 1), b1, b2),
+                self._block_first_min(max(a1, i0), min(a2, i0), b1, min(b2, j0 - 1)),
+            ):
+                if block is not None and block[0] < gap:
+                    gap = block[0]
+        return gap
+
+    @property
+    def conflict_point(self) -> Optional[Conflict_Point]:
+        # the update rule ends on the first candidate within
+        # delta_end_distance that lowers the running time gap minimum,
+        # otherwise on the first occurrence of the smallest time gap
+        if not self._dirty:
+            return self._conflict_point
+        self._dirty = False
+        found: Optional[tuple[float, int, int, float]] = None
+        if len(self.end_rects) > 0:
+            members = sorted(
+                (i, j, self.rects[r][2])
+                for r in self.end_rects
+                for i in range(self.ego_stays[self.rects[r][0]][0], self.ego_stays[self.rects[r][0]][1] + 1)
+                for j in range(self.npc_stays[self.rects[r][1]][0], self.npc_stays[self.rects[r][1]][1] + 1)
+            )
+            for i, j, dist in members:
+                time_gap = abs(self.ego_samples[i][0] - self.npc_samples[j][0])
+                if time_gap < self._gap_before(i, j):
+                    found = (time_gap, i, j, dist)
+                    break
+        if found is None:
+            found = self.best
+        if found is None:
+            self._conflict_point = None
+        else:
+            time_gap, i, j, dist = found
+            self._conflict_point = Conflict_Point(
+                ego_pass_tick=i,
+                obj_pass_tick=j,
+                loss=Loss(time_gap=time_gap, distance=dist),
+            )
+        return self._conflict_point
+
+    def conflict_window_passed(
+        self, clear_distance=_CLEAR_DISTANCE, hold_ticks=_CLEAR_HOLD_TICKS
+    ) -> bool:
+        # both actors went through the conflict point and are clear of it, no
+        # near pair showed up for hold_ticks, the separation kept growing and
+        # neither actor heads toward the other's path (_path_ahead).
+        # A heuristic, not a bound: an actor that turns back onto the other's
+        # path after this still changes the loss of the full round.
+        # The conflict point and the paths are looked up last, the other
+        # tests are cheaper
+        if self.last_candidate_tick < 0:
+            return False  # <-- no conflict point
+        tick = self.tick - 1
+        if self.separation_growing_ticks < hold_ticks:
+            return False
+        if tick - self.last_candidate_tick < hold_ticks:
+            return False
+        if tick - self.path_ahead_tick < hold_ticks:
+            return False  # <-- looked again hold_ticks later
+        if self.separation <= max(clear_distance, self.min_distance[1]):
+            return False
+
+        conflict_point = self.conflict_point
+        assert conflict_point is not None
+        ego_sample = self.ego_samples[tick]
+        npc_sample = self.npc_samples[tick]
+        ego_pass_sample = self.ego_samples[conflict_point.ego_pass_tick]
+        npc_pass_sample = self.npc_samples[conflict_point.obj_pass_tick]
+        if (
+            math.dist(ego_sample[1:], ego_pass_sample[1:]) <= clear_distance
+            or math.dist(npc_sample[1:], npc_pass_sample[1:]) <= clear_distance
+        ):
+            return False
+        if self._path_ahead(tick, hold_ticks):
+            self.path_ahead_tick = tick
+            return False
+        return True
+
+    def _path_ahead(self, tick: int, hold_ticks: int) -> bool:
+        # whether a stay of one actor is in front of the other (less than
+        # epsilon_distance behind it counts), the heading being the other's
+        # move over the last hold_ticks. Catches an npc that merged in front
+        # of the ego, an actor that did not move could go anywhere
+        for samples, other_stays in (
+            (self.ego_samples, self.npc_stays),
+            (self.npc_samples, self.ego_stays),
+        ):
+            position = np.array(samples[tick][1:])
+            heading = position - np.array(samples[max(0, tick - hold_ticks)][1:])
+            norm = np.linalg.norm(heading)
+            if norm == 0:
+                return True
+            stays = np.array([stay[2] for stay in other_stays])
+            if np.any((stays - position) @ heading / norm > -_EPSILON_DISTANCE):
+                return True
+        return False
+
+
+def replay_early_termination(ego_traj, npc_traj) -> tuple[int, bool]:
+    # tick at which a round over the recorded trajectories would stop early,
+    # and whether the loss at that tick equals the loss of the full round
+    detector = Conflict_Detector()
+    for tick in range(min(len(ego_traj), len(npc_traj))):
+        detector.update(ego_traj[tick], npc_traj[tick])
+        if detector.conflict_window_passed():
+            break
+    full_conflict_point = get_conflict_point_grid(ego_traj, npc_traj)
+    return detector.tick, (
+        same_conflict_point(detector.conflict_point, full_conflict_point)
+        and detector.min_distance == calculate_min_distance(ego_traj, npc_traj)
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    from .utils import load_snapshot_record_traj
+
+    # recorded rounds: python -m scenario.conflict_detector result/round_*/snapshot_record.csv
+    for snapshot_record_path in sys.argv[1:]:
+        ego_traj, npc_traj = load_snapshot_record_traj(snapshot_record_path)
+        stop_tick, same_loss = replay_early_termination(ego_traj, npc_traj)
+        assert same_loss, snapshot_record_path
+        print(f"{snapshot_record_path}: stop at tick {stop_tick} / {len(ego_traj)}, same loss")
+
+    from .utils import _gen_crossing_traj
+
+    for case in range(20):
+        rng = np.random.default_rng(case)
+        n_tick = int(rng.integers(50, 400))
+        ego_traj = _gen_crossing_traj(
+            n_tick, (-rng.uniform(1, 10), 0, 0), (rng.uniform(2, 10), 0, 0), seed=case
+        )
+        npc_traj = _gen_crossing_traj(
+            n_tick, (0, -rng.uniform(1, 10), 0), (0, rng.uniform(2, 10), 0), seed=100 + case
+        )
+        if case % 4 == 0:
+            npc_traj[n_tick // 2] = (npc_traj[n_tick // 2][0],) + ego_traj[n_tick // 3][1:]
+        if case % 4 == 1:
+            # the npc stands at the crossing while the ego passes, then the ego stops behind it
+            for tick in range(n_tick // 3, 2 * n_tick // 3):
+                npc_traj[tick] = (npc_traj[tick][0],) + npc_traj[n_tick // 3][1:]
+            for tick in range(n_tick // 2, n_tick):
+                ego_traj[tick] = (ego_traj[tick][0],) + ego_traj[n_tick // 2][1:]
+        detector = Conflict_Detector()
+        for tick in range(n_tick):
+            detector.update(ego_traj[tick], npc_traj[tick])
+            if tick % 37 == 0 or tick == n_tick - 1:
+                assert same_conflict_point(
+                    detector.conflict_point,
+                    get_conflict_point_grid(ego_traj[: tick + 1], npc_traj[: tick + 1]),
+                ), (case, tick)
+        assert detector.min_distance == calculate_min_distance(ego_traj, npc_traj)
+    print("online conflict detector: parity ok")
+
+    saved_tick = 0
+    total_tick = 0
+    for case in range(20):
+        rng = np.random.default_rng(case)
+        n_tick = 3000
+        ego_traj = _gen_crossing_traj(
+            n_tick, (-rng.uniform(10, 20), 0, 0), (rng.uniform(3, 8), 0, 0), seed=case
+        )
+        npc_traj = _gen_crossing_traj(
+            n_tick, (0, -rng.uniform(10, 20), 0), (0, rng.uniform(3, 8), 0), seed=100 + case
+        )
+        stop_tick, same_loss = replay_early_termination(ego_traj, npc_traj)
+        assert same_loss, case
+        saved_tick += n_tick - stop_tick
+        total_tick += n_tick
+    print(f"early termination: same loss, {saved_tick / total_tick:.0%} ticks saved")
+
+    # the npc crosses, turns into the next lane and cuts across ahead of the
+    # ego, which is slow through the crossing and then speeds up: its path
+    # is ahead of the ego all along, the round is not cut short
+    ego_traj = []
+    npc_traj = []
+    for tick in range(3000):
+        t = tick * 0.01
+        if t <= 1.5:
+            npc_xy = (-6 + 6 * t, 0.0)
+        elif t <= 6.5:
+            npc_xy = (3.0, 6 * (t - 1.5))
+        elif t <= 7.5:
+            npc_xy = (3 - 6 * (t - 6.5), 30 + 6 * (t - 6.5))
+        else:
+            npc_xy = (-3.0, 36 + 6 * (t - 7.5))
+        ego_y = -20 + 5 * t if t <= 4 else 3 * (t - 4) if t <= 6 else 6 + 12 * (t - 6)
+        ego_traj.append((t, 0.0, ego_y, 0.0))
+        npc_traj.append((t, *npc_xy, 0.0))
+    stop_tick, same_loss = replay_early_termination(ego_traj, npc_traj)
+    assert same_loss, stop_tick
+    print(f"early termination, merge ahead of the ego: same loss, stop at tick {stop_tick} / 3000")
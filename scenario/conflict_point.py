@@ -16,6 +16,14 @@ class Conflict_Point:
             "loss": self.loss.to_basic_data(),
         }
 
+    @classmethod
+    def recover_from_basic_data(cls, data: dict) -> "Conflict_Point":
+        return cls(
+            ego_pass_tick=data["ego_pass_tick"],
+            obj_pass_tick=data["obj_pass_tick"],
+            loss=Loss.recover_from_basic_data(data["loss"]),
+        )
+
     def __str__(self):
         return (
             f"     ego_pass_tick: {self.ego_pass_tick} \n"
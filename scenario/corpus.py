@@ -0,0 +1,308 @@
+import json
+import math
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Literal, Optional
+
+from .seed import Seed
+
+SeedKind = Literal["init", "fuzz"]
+
+_COLLISION = "collision, hit NPC"
+_MAX_VARIABLES = 900  # <-- bound parameters per query, older SQLite builds stop at 999
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seeds (
+    id INTEGER PRIMARY KEY,
+    scenario TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    round_num INTEGER NOT NULL,
+    chain_no INTEGER,
+    p_ego REAL,
+    p_npc REAL,
+    v_npc REAL,
+    action_cap INTEGER NOT NULL,
+    explored INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS action_chains (
+    seed_id INTEGER NOT NULL REFERENCES seeds(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    tick INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    PRIMARY KEY (seed_id, position)
+);
+CREATE TABLE IF NOT EXISTS round_results (
+    seed_id INTEGER PRIMARY KEY REFERENCES seeds(id) ON DELETE CASCADE,
+    result TEXT NOT NULL,
+    loss REAL,
+    loss_time_gap REAL,
+    loss_distance REAL,
+    loss_mode TEXT NOT NULL,
+    min_distance_tick INTEGER,
+    min_distance REAL,
+    action_seq TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conflict_points (
+    seed_id INTEGER PRIMARY KEY REFERENCES seeds(id) ON DELETE CASCADE,
+    ego_pass_tick INTEGER NOT NULL,
+    obj_pass_tick INTEGER NOT NULL,
+    loss_time_gap REAL,
+    loss_distance REAL,
+    loss_mode TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seeds_campaign ON seeds(scenario, strategy, explored);
+CREATE INDEX IF NOT EXISTS seeds_round ON seeds(scenario, strategy, round_num);
+CREATE INDEX IF NOT EXISTS round_results_loss ON round_results(loss);
+CREATE INDEX IF NOT EXISTS round_results_result ON round_results(result);
+"""
+
+
+class Seed_Corpus:
+    # every simulated seed of a campaign (scenario, strategy) in SQLite, with
+    # its action chain, round result and conflict point. A call to add_seeds
+    # is one transaction; WAL keeps committed rows through a process crash.
+    # "explored" marks the seeds a fuzzing chain was started from
+    def __init__(self, path, scenario: str, strategy: str):
+        self.path = Path(path)
+        self.scenario = scenario
+        self.strategy = strategy
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+    def add_seeds(
+        self, seeds: Iterable[Seed], kind: SeedKind, chain_no: Optional[int] = None
+    ) -> list[int]:
+        ids: list[int] = []
+        with self.db:
+            for seed in seeds:
+                cursor = self.db.execute(
+                    "INSERT INTO seeds (scenario, strategy, kind, round_num, chain_no, "
+                    "p_ego, p_npc, v_npc, action_cap) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        self.scenario, self.strategy, kind, seed.round_num, chain_no,
+                        seed.p_ego, seed.p_npc, seed.v_npc, seed.action_capability,
+                    ),
+                )
+                seed_id: int = cursor.lastrowid  # type: ignore
+                ids.append(seed_id)
+                self.db.executemany(
+                    "INSERT INTO action_chains VALUES (?, ?, ?, ?)",
+                    [
+                        (seed_id, position, tick, action)
+                        for position, (tick, action) in enumerate(seed.action_chain)
+                    ],
+                )
+                if seed.round_result is None:
+                    continue
+                result = seed.round_result.to_basic_data()
+                self.db.execute(
+                    "INSERT INTO round_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        seed_id, result["result"], seed.round_result.loss.value,
+                        result["loss"]["time_gap"], result["loss"]["distance"],
+                        result["loss"]["mode"],
+                        result["min_distance"][0], result["min_distance"][1],
+                        json.dumps(result["action_seq"]),
+                    ),
+                )
+                cp = result["conflict_point"]
+                if cp is not None:
+                    self.db.execute(
+                        "INSERT INTO conflict_points VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            seed_id, cp["ego_pass_tick"], cp["obj_pass_tick"],
+                            cp["loss"]["time_gap"], cp["loss"]["distance"],
+                            cp["loss"]["mode"],
+                        ),
+                    )
+        return ids
+
+    def set_explored(self, seed_ids: Iterable[int], explored: bool = True):
+        with self.db:
+            self.db.executemany(
+                "UPDATE seeds SET explored = ? WHERE id = ?",
+                [(int(explored), seed_id) for seed_id in seed_ids],
+            )
+
+    def seed_ids(self, kind: SeedKind) -> list[int]:
+        # in insertion order
+        rows = self.db.execute(
+            "SELECT id FROM seeds WHERE scenario = ? AND strategy = ? AND kind = ? ORDER BY id",
+            (self.scenario, self.strategy, kind),
+        )
+        return [seed_id for (seed_id,) in rows]
+
+    def discard_rounds_from(self, round_num: int):
+        # roll the fuzzing rounds back to a checkpoint, like truncate_journal
+        with self.db:
+            self.db.execute(
+                "DELETE FROM seeds WHERE scenario = ? AND strategy = ? AND kind = 'fuzz' "
+                "AND round_num >= ?",
+                (self.scenario, self.strategy, round_num),
+            )
+
+    def next_unexplored(
+        self, k: int = 1, kind: Optional[SeedKind] = None
+    ) -> list[tuple[int, Seed]]:
+        # the k lowest-loss seeds (of kind) that did not collide and no chain
+        # was started from yet, ties in insertion order.
+        # CROSS JOIN keeps round_results outside: the scan walks the loss
+        # index and stops at k, instead of sorting every unexplored seed
+        query = (
+            "SELECT s.id FROM round_results r CROSS JOIN seeds s ON s.id = r.seed_id "
+            "WHERE s.scenario = ? AND s.strategy = ? AND s.explored = 0 AND r.result != ?"
+        )
+        args: tuple = (self.scenario, self.strategy, _COLLISION)
+        if kind is not None:
+            query += " AND s.kind = ?"
+            args += (kind,)
+        rows = self.db.execute(query + " ORDER BY r.loss, s.id LIMIT ?", args + (k,))
+        ids = [seed_id for (seed_id,) in rows]
+        return list(zip(ids, self.get_seeds(ids)))
+
+    def collisions(self) -> list[tuple[int, Seed]]:
+        rows = self.db.execute(
+            "SELECT s.id FROM round_results r JOIN seeds s ON s.id = r.seed_id "
+            "WHERE r.result = ? AND s.scenario = ? AND s.strategy = ? ORDER BY s.id",
+            (_COLLISION, self.scenario, self.strategy),
+        )
+        ids = [seed_id for (seed_id,) in rows]
+        return list(zip(ids, self.get_seeds(ids)))
+
+    def count(self, kind: Optional[SeedKind] = None) -> int:
+        query = "SELECT COUNT(*) FROM seeds WHERE scenario = ? AND strategy = ?"
+        args: tuple = (self.scenario, self.strategy)
+        if kind is not None:
+            query += " AND kind = ?"
+            args += (kind,)
+        return self.db.execute(query, args).fetchone()[0]
+
+    def get_seeds(self, seed_ids: list[int]) -> list[Seed]:
+        if len(seed_ids) == 0:
+            return []
+        if len(seed_ids) > _MAX_VARIABLES:
+            return self.get_seeds(seed_ids[:_MAX_VARIABLES]) + self.get_seeds(
+                seed_ids[_MAX_VARIABLES:]
+            )
+        marks = ", ".join("?" * len(seed_ids))
+        data: dict[int, dict] = {}
+        for seed_id, round_num, p_ego, p_npc, v_npc, action_cap in self.db.execute(
+            "SELECT id, round_num, p_ego, p_npc, v_npc, action_cap FROM seeds "
+            f"WHERE id IN ({marks})",
+            seed_ids,
+        ):
+            data[seed_id] = {
+                "round_num": round_num,
+                "p_ego": p_ego,
+                "p_npc": p_npc,
+                "v_npc": v_npc,
+                "action_cap": action_cap,
+                "action_chain": [],
+                "round_result": None,
+            }
+        for seed_id, tick, action in self.db.execute(
+            f"SELECT seed_id, tick, action FROM action_chains WHERE seed_id IN ({marks}) "
+            "ORDER BY seed_id, position",
+            seed_ids,
+        ):
+            data[seed_id]["action_chain"].append((tick, action))
+        for (
+            seed_id, result, _, loss_time_gap, loss_distance, loss_mode,
+            min_distance_tick, min_distance, action_seq,
+        ) in self.db.execute(
+            f"SELECT * FROM round_results WHERE seed_id IN ({marks})", seed_ids
+        ):
+            data[seed_id]["round_result"] = {
+                "result": result,
+                "loss": _loss_data(loss_time_gap, loss_distance, loss_mode),
+                "min_distance": (min_distance_tick, _real(min_distance)),
+                "action_seq": json.loads(action_seq),
+                "conflict_point": None,
+            }
+        for (
+            seed_id, ego_pass_tick, obj_pass_tick, loss_time_gap, loss_distance, loss_mode,
+        ) in self.db.execute(
+            f"SELECT * FROM conflict_points WHERE seed_id IN ({marks})", seed_ids
+        ):
+            data[seed_id]["round_result"]["conflict_point"] = {
+                "ego_pass_tick": ego_pass_tick,
+                "obj_pass_tick": obj_pass_tick,
+                "loss": _loss_data(loss_time_gap, loss_distance, loss_mode),
+            }
+        return [Seed.recover_from_basic_data(data[seed_id]) for seed_id in seed_ids]
+
+    def close(self):
+        self.db.close()
+
+
+def _real(value: Optional[float]) -> float:
+    # SQLite keeps inf but stores nan as NULL
+    return math.nan if value is None else value
+
+
+def _loss_data(time_gap: Optional[float], distance: Optional[float], mode: str) -> dict:
+    return {"time_gap": _real(time_gap), "distance": _real(distance), "mode": mode}
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import time
+
+    from .conflict_point import Conflict_Point
+    from .loss import Loss
+    from .seed import Round_Result
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = Seed_Corpus(Path(tmp_dir) / "corpus.sqlite", "town05_case06", "loss_distance")
+        seeds = []
+        for i in range(10000):
+            seed = Seed(
+                i, random.random(), random.random(), random.uniform(0, 60), 3,
+                [(random.randint(0, 80) * 10, random.choice(["acc", "dec", "lane"])) for _ in range(3)],
+            )
+            seed.round_result = Round_Result(
+                result="collision, hit NPC" if i % 100 == 0 else "arrive",
+                loss=Loss(time_gap=random.random(), distance=random.random()),
+                min_distance=(random.randint(0, 800), random.random() * 10),
+                action_seq=[(tick, action, 10) for tick, action in seed.action_chain],
+                conflict_point=Conflict_Point(500, 510, Loss(random.random(), math.inf))
+                if i % 2 == 0
+                else None,
+            )
+            seeds.append(seed)
+        start = time.perf_counter()
+        ids = corpus.add_seeds(seeds, "init")
+        insert_seconds = time.perf_counter() - start
+        assert [x.to_basic_data() for x in corpus.get_seeds(ids[:50])] == [
+            x.to_basic_data() for x in seeds[:50]
+        ]
+
+        start = time.perf_counter()
+        best = corpus.next_unexplored(5)
+        query_seconds = time.perf_counter() - start
+        expected = sorted(range(len(seeds)), key=lambda i: seeds[i].round_result.loss.value)  # type: ignore
+        expected = [i for i in expected if i % 100 != 0]
+        assert [seed.round_num for _, seed in best] == expected[:5]
+        corpus.set_explored([seed_id for seed_id, _ in best])
+        assert [seed.round_num for _, seed in corpus.next_unexplored(5)] == expected[5:10]
+        assert len(corpus.collisions()) == 100
+        assert [seed.round_num for seed in corpus.get_seeds(ids)] == list(range(10000))
+
+        fuzz_seed = Seed(20000, 0.5, 0.5, 20, 1, [(100, "acc")])
+        fuzz_seed.round_result = Round_Result(result="arrive", loss=Loss(time_gap=-1, distance=-1))
+        corpus.add_seeds([fuzz_seed], "fuzz", chain_no=0)
+        assert corpus.next_unexplored()[0][1].round_num == 20000
+        assert corpus.next_unexplored(kind="init")[0][1].round_num == expected[5]
+        corpus.discard_rounds_from(20000)
+        assert corpus.count("fuzz") == 0 and corpus.count() == 10000
+        corpus.close()
+        print(
+            f"ok, insert 10k seeds in {insert_seconds * 1000:.0f} ms, "
+            f"next_unexplored in {query_seconds * 1000:.1f} ms"
+        )
@@ -0,0 +1,124 @@
+import math
+
+
+class Vector3D:
+    x: float
+    y: float
+    z: float
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        if hasattr(x, "x"):  # <-- copy constructor, as carla.Vector3D(other)
+            x, y, z = x.x, x.y, x.z
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def length(self) -> float:
+        return math.sqrt(self.x**2 + self.y**2 + self.z**2)
+
+    def distance(self, other) -> float:
+        return math.sqrt(
+            (self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2
+        )
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, k: float):
+        return type(self)(self.x * k, self.y * k, self.z * k)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, k: float):
+        return type(self)(self.x / k, self.y / k, self.z / k)
+
+    def __abs__(self):
+        return type(self)(abs(self.x), abs(self.y), abs(self.z))
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y and self.z == other.z
+
+    def __repr__(self):
+        return f"{type(self).__name__}(x={self.x:.6f}, y={self.y:.6f}, z={self.z:.6f})"
+
+
+class Location(Vector3D):
+    pass
+
+
+class Rotation:
+    pitch: float
+    yaw: float
+    roll: float
+
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        if hasattr(pitch, "yaw"):
+            pitch, yaw, roll = pitch.pitch, pitch.yaw, pitch.roll
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+    def get_forward_vector(self) -> Vector3D:
+        pitch = math.radians(self.pitch)
+        yaw = math.radians(self.yaw)
+        return Vector3D(
+            math.cos(yaw) * math.cos(pitch),
+            math.sin(yaw) * math.cos(pitch),
+            math.sin(pitch),
+        )
+
+    def __repr__(self):
+        return f"Rotation(pitch={self.pitch:.6f}, yaw={self.yaw:.6f}, roll={self.roll:.6f})"
+
+
+class Transform:
+    location: Location
+    rotation: Rotation
+
+    def __init__(self, location=None, rotation=None):
+        # copies, as carla.Transform stores both by value
+        self.location = Location(location) if location is not None else Location()
+        self.rotation = Rotation(rotation) if rotation is not None else Rotation()
+
+    def get_forward_vector(self) -> Vector3D:
+        return self.rotation.get_forward_vector()
+
+    def __repr__(self):
+        return f"Transform({self.location}, {self.rotation})"
+
+
+class VehicleControl:
+    def __init__(
+        self,
+        throttle=0.0,
+        steer=0.0,
+        brake=0.0,
+        hand_brake=False,
+        reverse=False,
+        manual_gear_shift=False,
+        gear=0,
+    ):
+        self.throttle = float(throttle)
+        self.steer = float(steer)
+        self.brake = float(brake)
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+    def __repr__(self):
+        return (
+            f"VehicleControl(throttle={self.throttle:.6f}, steer={self.steer:.6f}, "
+            + f"brake={self.brake:.6f}, gear={self.gear})"
+        )
+
+
+class Color:
+    def __init__(self, r=0, g=0, b=0, a=255):
+        self.r = r
+        self.g = g
+        self.b = b
+        self.a = a
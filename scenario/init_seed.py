@@ -0,0 +1,113 @@
+import io
+from pathlib import Path
+from typing import Callable, Union
+
+import yaml
+
+from .artifact_writer import Artifact_Writer
+from .journal import Result_Journal, read_journal
+from .seed import Seed, Seed_Table, load_seeds, save_seeds
+
+_COLLISION = "collision, hit NPC"
+
+
+def loss_value(seed: Seed) -> float:
+    assert seed.round_result is not None
+    return seed.round_result.loss.value
+
+
+def recover_init_progress(path) -> dict[int, Seed]:
+    # grid seeds finished before an interruption, by their index in the grid
+    progress: dict[int, Seed] = {}
+    for entry in read_journal(path):
+        progress[entry["seed_no"]] = Seed.recover_from_basic_data(entry["seed"])
+    return progress
+
+
+def run_init_seed(
+    runner,
+    seed_list: list[Seed],
+    first_round: int,
+    result_dir: Path,
+    journal: Result_Journal,
+    sort_key: Callable[[Seed], float] = loss_value,
+) -> tuple[list[Seed], int]:
+    # the grid seeds are independent: all of them are handed to the runner at
+    # once, results are put back in seed order so the outcome matches a serial run.
+    # Each finished seed is appended to init_seed_progress.jsonl as it comes
+    # in (flushed, fsync batched like the result journal), a restart runs the
+    # missing ones only. The collisions go to journal; returns the other
+    # seeds sorted by sort_key and the number of collisions
+    progress_path = Path(result_dir) / "init_seed_progress.jsonl"
+    progress = recover_init_progress(progress_path)
+    pending = 0
+    for i, seed in enumerate(seed_list):
+        seed.round_num = first_round + i
+        done = progress.get(i)
+        if (
+            done is not None
+            and (done.p_ego, done.p_npc, done.v_npc) == (seed.p_ego, seed.p_npc, seed.v_npc)
+        ):
+            seed.round_result = done.round_result
+        else:
+            runner.submit(seed)
+            pending += 1
+    print(f"initial seed: {len(seed_list) - pending} recovered, {pending} to run")
+
+    seed_no = {id(seed): i for i, seed in enumerate(seed_list)}
+    progress_journal = Result_Journal(progress_path)
+    for _ in range(pending):
+        seed, seed.round_result = runner.collect()
+        kind = "collision" if seed.round_result.result == _COLLISION else "other"
+        progress_journal.record(kind, seed, seed_no=seed_no[id(seed)])
+    progress_journal.close()
+
+    runned_seed_list: list[Seed] = []
+    collision_cnt = 0
+    for seed in seed_list:
+        assert seed.round_result is not None
+        if seed.round_result.result == _COLLISION:
+            journal.record("collision", seed)
+            collision_cnt += 1
+        else:
+            runned_seed_list.append(seed)
+    runned_seed_list.sort(key=sort_key)
+    return runned_seed_list, collision_cnt
+
+
+def record_init_seed(artifact_writer: Artifact_Writer, result_dir: Path, init_seed_list: list[Seed]):
+    # the .npz table is what recover_init_seed reads, the yaml is an export.
+    # The progress journal goes once the table is written
+    table = io.BytesIO()
+    save_seeds(table, init_seed_list)
+    artifact_writer.write_file(result_dir / "init_seed_result.npz", table.getvalue(), "wb")
+    init_record = {}
+    seed_order_record = []
+    for seed in init_seed_list:
+        init_record[f"{seed.round_num}"] = seed.to_basic_data()
+        seed_order_record.append(seed.round_num)
+    artifact_writer.write_file(result_dir / "init_seed_result.yml", yaml.dump(init_record))
+    artifact_writer.write_file(result_dir / "init_seed_order.yml", yaml.dump(seed_order_record))
+    artifact_writer.submit((result_dir / "init_seed_progress.jsonl").unlink)
+
+
+def recover_init_seed(result_dir: Path) -> Union[Seed_Table, list[Seed]]:
+    # the table is returned as is: a Seed is built when it is indexed, sorts
+    # and filters read its columns
+    if (result_dir / "init_seed_result.npz").exists():
+        return load_seeds(result_dir / "init_seed_result.npz")
+
+    with open(result_dir / "init_seed_order.yml", "r") as f:
+        seed_order_record = yaml.load(f, yaml.FullLoader)
+        f.close()
+    with open(result_dir / "init_seed_result.yml", "r") as f:
+        seed_list = yaml.load(f, yaml.FullLoader)
+        f.close()
+    init_seed_list: list[Seed] = []
+
+    print("recovering ... ", end='', flush=True)
+    for seed_no in seed_order_record:  # <-- the loss order the chains were started in
+        init_seed_list.append(Seed.recover_from_basic_data(seed_list[f"{seed_no}"]))
+    print("Done")
+
+    return init_seed_list
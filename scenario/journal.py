@@ -0,0 +1,131 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterator, Literal
+
+from .seed import Seed
+
+JournalKind = Literal["collision", "other"]
+
+
+class Result_Journal:
+    # append-only JSON Lines record of every finished round. Each line is
+    # flushed to the OS when written, fsync is batched: every fsync_every
+    # records or fsync_interval seconds, whichever comes first, and at close
+    def __init__(self, path, fsync_every: int = 32, fsync_interval: float = 5.0):
+        self.path = Path(path)
+        self.drop_partial_record()
+        self.file = open(self.path, "a")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def drop_partial_record(self):
+        # a record cut off by a crash would swallow the next one appended
+        if not self.path.exists():
+            return
+        with open(self.path, "r+b") as f:
+            data = f.read()
+            if len(data) > 0 and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+            f.close()
+
+    def record(self, kind: JournalKind, seed: Seed, **extra):
+        entry = {"kind": kind, "seed": seed.to_basic_data()}
+        entry.update(extra)
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if (
+            self.unsynced >= self.fsync_every
+            or time.monotonic() - self.last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def truncate_journal(path, offset: int):
+    # roll the journal back to a checkpoint: rounds recorded after it are
+    # simulated again on resume
+    if Path(path).exists() and Path(path).stat().st_size > offset:
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+            f.close()
+
+
+def read_journal(path) -> Iterator[dict]:
+    # a line cut off by a crash ends the journal
+    if not Path(path).exists():
+        return
+    with open(path, "r") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                break
+        f.close()
+
+
+def recover_seed_lists(path) -> tuple[list[Seed], list[Seed]]:
+    collision_seed_list: list[Seed] = []
+    other_seed_list: list[Seed] = []
+    for entry in read_journal(path):
+        seed = Seed.recover_from_basic_data(entry["seed"])
+        if entry["kind"] == "collision":
+            collision_seed_list.append(seed)
+        else:
+            other_seed_list.append(seed)
+    return collision_seed_list, other_seed_list
+
+
+def count_journal(path) -> tuple[int, int]:
+    # (collision, other) rounds recorded so far, without building the seeds
+    counts = {"collision": 0, "other": 0}
+    for entry in read_journal(path):
+        counts[entry["kind"]] += 1
+    return counts["collision"], counts["other"]
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from .seed import Round_Result
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        journal = Result_Journal(Path(tmp_dir) / "result_journal.jsonl")
+        for i in range(10):
+            seed = Seed(i, 0.5, 0.5, 20, 1, [(100, "acc")])
+            seed.round_result = Round_Result(result="arrive", min_distance=(i, 0.5))
+            journal.record("collision" if i % 3 == 0 else "other", seed)
+        journal.close()
+        with open(Path(tmp_dir) / "result_journal.jsonl", "a") as f:
+            f.write('{"kind": "other", "se')  # <-- crash in the middle of a record
+            f.close()
+        journal = Result_Journal(Path(tmp_dir) / "result_journal.jsonl")
+        journal.record("other", seed)
+        offset = journal.tell()
+        journal.record("other", seed)  # <-- after the checkpoint, rolled back
+        journal.close()
+        truncate_journal(Path(tmp_dir) / "result_journal.jsonl", offset)
+        collision_seed_list, other_seed_list = recover_seed_lists(
+            Path(tmp_dir) / "result_journal.jsonl"
+        )
+        assert [seed.round_num for seed in collision_seed_list] == [0, 3, 6, 9]
+        assert other_seed_list[0].round_result.min_distance == (1, 0.5)  # type: ignore
+        assert len(other_seed_list) == 7
+        print(f"ok, {len(collision_seed_list)} collision, {len(other_seed_list)} other")
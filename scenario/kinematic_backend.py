@@ -0,0 +1,453 @@
+import bisect
+import math
+from typing import Callable, Optional
+
+from .backend import Actor_State, Backend, Tick_State, carla, round_trip
+from .utils import kmh_2_ms
+
+# spawn points used by the scenarios: (x, y, z, yaw). The ones noted in the
+# scenario files are exact, the others approximate the lanes of the Town05
+# intersection around the scenario center (x: -49.102310, y: 0.867327)
+_SPAWN_POINTS = {
+    "Town05": {
+        22: (-19.079281, -0.880121, 0.3, 180.0),
+        64: (-100.0, -0.880121, 0.3, 180.0),
+        65: (-82.602486, 2.750381, 0.3, 0.0),
+        124: (-47.1, -60.0, 0.3, -90.0),
+        202: (-65.0, -0.880121, 0.3, 180.0),
+        204: (-50.602310, 13.267327, 0.3, 90.0),
+        205: (-47.1, -15.0, 0.3, -90.0),
+        240: (-47.1, -35.0, 0.3, -90.0),
+        243: (-50.602310, 45.0, 0.3, 90.0),
+        274: (-47.060032, 34.941586, 0.3, -90.0),
+        277: (-51.091713, -21.431129, 0.3, 90.0),
+    },
+}
+
+_AUTOPILOT_SPEED = kmh_2_ms(30)
+_AUTOPILOT_ACCELERATION = 2.5
+_AUTOPILOT_DECELERATION = 5.0
+_MAX_ACCELERATION = 4.0  # <-- throttle = 1
+_MAX_DECELERATION = 8.0  # <-- brake = 1
+_ROLLING_DECELERATION = 0.3
+_LANE_WIDTH = 3.5
+_LANE_CHANGE_SPEED = 1.5  # <-- lateral, m/s
+_TURN_RADIUS = 10
+_PATH_EXTENSION = 1000
+_VEHICLE_EXTENT = {  # <-- half length, half width
+    "vehicle.audi.a2": (1.85, 0.9),
+    "vehicle.audi.tt": (2.1, 1.0),
+}
+_DEFAULT_VEHICLE_EXTENT = (2.3, 1.0)
+
+
+class Kinematic_Path:
+    # polyline followed by a vehicle, sampled by arc length
+    def __init__(self, points: list[tuple[float, float]]):
+        self.xs = [points[0][0]]
+        self.ys = [points[0][1]]
+        self.s = [0.0]
+        for x, y in points[1:]:
+            length = math.hypot(x - self.xs[-1], y - self.ys[-1])
+            if length < 1e-6:
+                continue
+            self.xs.append(x)
+            self.ys.append(y)
+            self.s.append(self.s[-1] + length)
+
+    def sample(self, s: float) -> tuple[float, float, float]:
+        k = min(max(bisect.bisect_right(self.s, s) - 1, 0), len(self.s) - 2)
+        length = self.s[k + 1] - self.s[k]
+        dx = self.xs[k + 1] - self.xs[k]
+        dy = self.ys[k + 1] - self.ys[k]
+        f = (s - self.s[k]) / length
+        return self.xs[k] + f * dx, self.ys[k] + f * dy, math.atan2(dy, dx)
+
+    @staticmethod
+    def _corner(p, hp, q, hq) -> list[tuple[float, float]]:
+        # rounded corner between the line through p along hp and the line
+        # through q along hq, empty when they are (nearly) parallel
+        cross = hp[0] * hq[1] - hp[1] * hq[0]
+        if abs(cross) < 0.1:
+            return []
+        dx = q[0] - p[0]
+        dy = q[1] - p[1]
+        a = (dx * hq[1] - dy * hq[0]) / cross
+        b = (hp[0] * dy - hp[1] * dx) / cross
+        if a <= 0 or b <= 0:
+            return []
+        k = (p[0] + a * hp[0], p[1] + a * hp[1])
+        r = min(_TURN_RADIUS, a, b)
+        start = (k[0] - r * hp[0], k[1] - r * hp[1])
+        end = (k[0] + r * hq[0], k[1] + r * hq[1])
+        corner = []
+        for i in range(13):
+            t = i / 12
+            corner.append(
+                (
+                    (1 - t) ** 2 * start[0] + 2 * (1 - t) * t * k[0] + t**2 * end[0],
+                    (1 - t) ** 2 * start[1] + 2 * (1 - t) * t * k[1] + t**2 * end[1],
+                )
+            )
+        return corner
+
+    @staticmethod
+    def build(x: float, y: float, yaw: float, route: list[tuple[float, float]]):
+        points = [(x, y)]
+        heading = (math.cos(yaw), math.sin(yaw))
+        for k, q in enumerate(route):
+            nxt = route[k + 1] if k + 1 < len(route) else q
+            prv = points[-1] if k + 1 == len(route) else q
+            length = math.hypot(nxt[0] - prv[0], nxt[1] - prv[1])
+            if length < 1e-6:
+                q_heading = heading
+            else:
+                q_heading = ((nxt[0] - prv[0]) / length, (nxt[1] - prv[1]) / length)
+            points.extend(Kinematic_Path._corner(points[-1], heading, q, q_heading))
+            points.append(q)
+            heading = q_heading
+        points.append(
+            (
+                points[-1][0] + _PATH_EXTENSION * heading[0],
+                points[-1][1] + _PATH_EXTENSION * heading[1],
+            )
+        )
+        return Kinematic_Path(points)
+
+
+class Kinematic_Vehicle:
+    def __init__(self, actor_id: int, type_id: str, transform, attributes):
+        self.id = actor_id
+        self.type_id = type_id
+        self.attributes = dict(attributes)
+        self.extent = _VEHICLE_EXTENT.get(type_id, _DEFAULT_VEHICLE_EXTENT)
+        self.z = transform.location.z
+        self.reset(transform)
+
+    def reset(self, transform):
+        yaw = math.radians(transform.rotation.yaw)
+        self.path = Kinematic_Path.build(
+            transform.location.x, transform.location.y, yaw, []
+        )
+        self.s = 0.0
+        self.offset = 0.0
+        self.target_offset = 0.0
+        self.speed = 0.0
+        self.acceleration = 0.0
+        self.constant_speed: Optional[float] = None
+        self.autopilot = False
+        self.control = carla.VehicleControl()
+        self.update_pose()
+
+    def update_pose(self):
+        x, y, yaw = self.path.sample(self.s)
+        self.x = x - self.offset * math.sin(yaw)  # <-- +offset is the right side
+        self.y = y + self.offset * math.cos(yaw)
+        self.yaw = yaw
+
+    def step(self, dt: float):
+        speed = self.speed
+        if self.constant_speed is not None:
+            speed = self.constant_speed
+        elif self.autopilot:
+            if speed < _AUTOPILOT_SPEED:
+                speed = min(_AUTOPILOT_SPEED, speed + _AUTOPILOT_ACCELERATION * dt)
+            else:
+                speed = max(_AUTOPILOT_SPEED, speed - _AUTOPILOT_DECELERATION * dt)
+        else:
+            if self.control.hand_brake:
+                acceleration = -_MAX_DECELERATION
+            else:
+                acceleration = (
+                    self.control.throttle * _MAX_ACCELERATION
+                    - self.control.brake * _MAX_DECELERATION
+                    - _ROLLING_DECELERATION
+                )
+            speed = max(0.0, speed + acceleration * dt)
+        self.acceleration = (speed - self.speed) / dt
+        self.speed = speed
+        self.s += speed * dt
+
+        if self.offset != self.target_offset:
+            step = _LANE_CHANGE_SPEED * dt
+            if abs(self.target_offset - self.offset) <= step:
+                self.offset = self.target_offset
+            elif self.target_offset > self.offset:
+                self.offset += step
+            else:
+                self.offset -= step
+        self.update_pose()
+
+    def overlaps(self, other: "Kinematic_Vehicle") -> bool:
+        # separating axis test of the two bounding boxes
+        dx = other.x - self.x
+        dy = other.y - self.y
+        boxes = (
+            (math.cos(self.yaw), math.sin(self.yaw), self.extent),
+            (math.cos(other.yaw), math.sin(other.yaw), other.extent),
+        )
+        for cos_yaw, sin_yaw, _ in boxes:
+            for ux, uy in ((cos_yaw, sin_yaw), (-sin_yaw, cos_yaw)):
+                radius = 0.0
+                for box_cos, box_sin, (half_length, half_width) in boxes:
+                    radius += half_length * abs(ux * box_cos + uy * box_sin)
+                    radius += half_width * abs(-ux * box_sin + uy * box_cos)
+                if abs(dx * ux + dy * uy) > radius:
+                    return False
+        return True
+
+
+class Kinematic_Sensor:
+    def __init__(self, actor_id: int, parent: Kinematic_Vehicle, callback: Callable):
+        self.id = actor_id
+        self.parent = parent
+        self.callback = callback
+
+
+class Timestamp:
+    def __init__(self, frame: int, elapsed_seconds: float, delta_seconds: float):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = elapsed_seconds
+
+
+class World_Snapshot:
+    def __init__(self, timestamp: Timestamp):
+        self.timestamp = timestamp
+        self.frame = timestamp.frame
+
+
+class Collision_Event:
+    def __init__(self, frame: int, timestamp: float, actor, other_actor):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.actor = actor
+        self.other_actor = other_actor
+
+    def __str__(self):
+        return (
+            f"CollisionEvent(frame={self.frame}, timestamp={self.timestamp:.6f}, "
+            + f"other_actor={self.other_actor.id})"
+        )
+
+
+class Kinematic_Backend(Backend):
+    # pure-Python stand-in for CARLA: vehicles follow their route polylines
+    # with a point-mass speed model, the traffic manager is a speed controller
+    # and collisions are bounding box overlaps. Round trips are counted as the
+    # same calls would cost on CARLA.
+    vehicles: dict[int, Kinematic_Vehicle]
+    sensors: dict[int, Kinematic_Sensor]
+    restorable = True
+
+    def __init__(self, world_map="Town05"):
+        if world_map not in _SPAWN_POINTS:
+            raise ValueError(f"kinematic backend has no geometry for {world_map}")
+        Backend.__init__(self)
+        self.spawn_points = {
+            i: carla.Transform(carla.Location(x, y, z), carla.Rotation(yaw=yaw))
+            for i, (x, y, z, yaw) in _SPAWN_POINTS[world_map].items()
+        }
+        self.fixed_delta_seconds = 0.05
+        self.frame = 0
+        self.elapsed_seconds = 0.0
+        self.vehicles = {}
+        self.sensors = {}
+        self.next_actor_id = 1
+
+    @round_trip(2)
+    def apply_settings(self, synchronous_mode: bool, fixed_delta_seconds: float):
+        self.fixed_delta_seconds = fixed_delta_seconds
+
+    @round_trip()
+    def get_spawn_points(self):
+        return self.spawn_points
+
+    @round_trip()
+    def spawn_vehicle(self, blueprint_id: str, transform, attributes: dict[str, str]):
+        vehicle = Kinematic_Vehicle(self.next_actor_id, blueprint_id, transform, attributes)
+        self.next_actor_id += 1
+        self.vehicles[vehicle.id] = vehicle
+        return vehicle
+
+    @round_trip(5)
+    def configure_vehicle(self, actor):
+        pass
+
+    @round_trip(2)
+    def spawn_collision_sensor(self, parent, callback: Callable):
+        sensor = Kinematic_Sensor(self.next_actor_id, parent, callback)
+        self.next_actor_id += 1
+        self.sensors[sensor.id] = sensor
+        return sensor
+
+    @round_trip()
+    def destroy(self, actor):
+        self.vehicles.pop(actor.id, None)
+        self.sensors.pop(actor.id, None)
+
+    @round_trip()
+    def tick(self):
+        dt = self.fixed_delta_seconds
+        self.frame += 1
+        self.elapsed_seconds += dt
+        for vehicle in self.vehicles.values():
+            vehicle.step(dt)
+        for sensor in list(self.sensors.values()):
+            for other in list(self.vehicles.values()):
+                if other is not sensor.parent and sensor.parent.overlaps(other):
+                    sensor.callback(
+                        Collision_Event(
+                            self.frame, self.elapsed_seconds, sensor.parent, other
+                        )
+                    )
+
+    def save_state(self):
+        # the clock and every vehicle's attributes. Paths and controls are
+        # replaced, never modified in place, so they are shared; sensors keep
+        # their callbacks
+        return (
+            self.frame,
+            self.elapsed_seconds,
+            self.next_actor_id,
+            {actor_id: dict(vars(vehicle)) for actor_id, vehicle in self.vehicles.items()},
+        )
+
+    def restore_state(self, state):
+        self.frame, self.elapsed_seconds, self.next_actor_id, vehicles = state
+        for actor_id, attributes in vehicles.items():
+            vars(self.vehicles[actor_id]).update(attributes)
+
+    @round_trip()
+    def get_snapshot(self):
+        return World_Snapshot(
+            Timestamp(self.frame, self.elapsed_seconds, self.fixed_delta_seconds)
+        )
+
+    @round_trip()
+    def capture_tick(self, actors: list) -> Tick_State:
+        states = []
+        for actor in actors:
+            cos_yaw = math.cos(actor.yaw)
+            sin_yaw = math.sin(actor.yaw)
+            states.append(
+                Actor_State(
+                    carla.Location(actor.x, actor.y, actor.z),
+                    carla.Vector3D(actor.speed * cos_yaw, actor.speed * sin_yaw, 0),
+                    carla.Vector3D(
+                        actor.acceleration * cos_yaw, actor.acceleration * sin_yaw, 0
+                    ),
+                    self.vehicle_control(actor),
+                )
+            )
+        return Tick_State(
+            Timestamp(self.frame, self.elapsed_seconds, self.fixed_delta_seconds),
+            tuple(states),
+        )
+
+    @round_trip()
+    def get_transform(self, actor):
+        return carla.Transform(
+            carla.Location(actor.x, actor.y, actor.z),
+            carla.Rotation(yaw=math.degrees(actor.yaw)),
+        )
+
+    @round_trip()
+    def set_transform(self, actor, transform):
+        actor.z = transform.location.z
+        actor.path = Kinematic_Path.build(
+            transform.location.x,
+            transform.location.y,
+            math.radians(transform.rotation.yaw),
+            [],
+        )
+        actor.s = 0.0
+        actor.offset = 0.0
+        actor.target_offset = 0.0
+        actor.update_pose()
+
+    @round_trip()
+    def get_velocity(self, actor):
+        return carla.Vector3D(
+            actor.speed * math.cos(actor.yaw), actor.speed * math.sin(actor.yaw), 0
+        )
+
+    @round_trip(2)
+    def set_target_velocity(self, actor, velocity):
+        actor.speed = velocity.length()
+        actor.acceleration = 0.0
+
+    @round_trip()
+    def get_acceleration(self, actor):
+        return carla.Vector3D(
+            actor.acceleration * math.cos(actor.yaw),
+            actor.acceleration * math.sin(actor.yaw),
+            0,
+        )
+
+    @round_trip()
+    def get_control(self, actor):
+        return self.vehicle_control(actor)
+
+    def vehicle_control(self, actor):
+        if not actor.autopilot:
+            return actor.control
+        return carla.VehicleControl(
+            throttle=min(max(actor.acceleration / _MAX_ACCELERATION, 0), 1),
+            brake=min(max(-actor.acceleration / _MAX_DECELERATION, 0), 1),
+            gear=1 if actor.speed > 0 else 0,
+        )
+
+    @round_trip()
+    def apply_control(self, actor, control):
+        actor.control = control
+
+    @round_trip()
+    def enable_constant_velocity(self, actor, velocity):
+        actor.constant_speed = velocity.x  # <-- local frame, x is forward
+
+    @round_trip()
+    def disable_constant_velocity(self, actor):
+        actor.constant_speed = None
+
+    @round_trip()
+    def set_autopilot(self, actor, enabled: bool):
+        actor.autopilot = enabled
+
+    @round_trip()
+    def set_path(self, actor, route: list):
+        actor.path = Kinematic_Path.build(
+            actor.x, actor.y, actor.yaw, [(location.x, location.y) for location in route]
+        )
+        actor.s = 0.0
+        actor.offset = 0.0
+        actor.target_offset = 0.0
+        actor.update_pose()
+
+    @round_trip()
+    def force_lane_change(self, actor, direction: bool):
+        if actor.autopilot:
+            actor.target_offset += _LANE_WIDTH if direction else -_LANE_WIDTH
+
+
+if __name__ == "__main__":
+    import time
+
+    backend = Kinematic_Backend("Town05")
+    backend.apply_settings(True, 0.01)
+    spawn_points = backend.get_spawn_points()
+    ego = backend.spawn_vehicle("vehicle.audi.a2", spawn_points[65], {})
+    npc = backend.spawn_vehicle("vehicle.audi.tt", spawn_points[22], {})
+    backend.set_path(ego, [spawn_points[i].location for i in [205, 240, 124]])
+    backend.set_path(npc, [spawn_points[i].location for i in [202, 64]])
+    backend.set_autopilot(ego, True)
+    backend.set_autopilot(npc, True)
+
+    start = time.time()
+    for _ in range(3000):
+        backend.tick()
+        backend.get_transform(ego)
+        backend.get_transform(npc)
+    print(f"{3000 / (time.time() - start):.0f} ticks/s")
+    print(backend.get_transform(ego))
@@ -37,6 +37,16 @@ class Loss:
             "mode": "time_gap" if self.mode is LossType.TIMEGAP else "distance",
         }
 
+    @classmethod
+    def recover_from_basic_data(cls, data: dict) -> "Loss":
+        return cls(
+            time_gap=data["time_gap"],
+            distance=data["distance"],
+            mode=LossType.TIMEGAP
+            if data.get("mode") == "time_gap"
+            else LossType.DISTANCE,
+        )
+
     def __str__(self):
         return (
             "  loss: \n"
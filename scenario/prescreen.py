@@ -0,0 +1,196 @@
+import contextlib
+import io
+import math
+from pathlib import Path
+import random
+from typing import Optional
+
+from .kinematic_backend import Kinematic_Backend
+from .loss import Loss
+from .seed import Seed
+from .snapshot_log import Snapshot_Buffer
+
+_COLLISION = "collision, hit NPC"
+
+
+class Prescreen:
+    # low-fidelity stage in front of Scenario.run. The seed's round is run by
+    # a private scene of the same scenario class on a Kinematic_Backend that
+    # steps step_seconds per world tick: the scene's own setup, action schedule
+    # and actions, finish checks and online conflict detector, with its step
+    # covering several round ticks (Scenario.step_ticks). No random actions,
+    # the snapshot log stays in memory and nothing is written.
+    # A candidate is admitted if its predicted conflict time gap is at most
+    # threshold seconds. A rejected one is still simulated with probability
+    # audit_rate, the audited rejects give the false-negative rate: the share
+    # of rejects whose full round is under the threshold after all
+    def __init__(
+        self,
+        scenario_cls,
+        world_map="Town05",
+        threshold: float = 2.0,
+        audit_rate: float = 0.05,
+        step_seconds: float = 0.05,
+    ):
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.backend = Kinematic_Backend(world_map)
+        self.scene = scenario_cls(None, None, world_map, Path(), self.backend)
+        self.scene.persistent_actors = True  # <-- the two vehicles are reset, not respawned
+        self.scene.early_termination = True
+        self.scene.artifact_writer.close()
+        self.scene.artifact_writer = None
+        self.scene.step_ticks = max(1, round(step_seconds / self.backend.fixed_delta_seconds))
+        self.backend.apply_settings(True, step_seconds)
+        self.verdicts: dict[int, bool] = {}  # <-- id(seed): admitted, for the seeds in flight
+        self.screened = 0
+        self.admitted = 0
+        self.admitted_hits = 0  # <-- admitted and under the threshold in the full round
+        self.admitted_runs = 0
+        self.audited = 0
+        self.false_negatives = 0
+
+    def predict(self, seed: Seed) -> tuple[Loss, bool]:
+        # predicted loss of the seed's round and whether the vehicles collide
+        scene = self.scene
+        scene.seed = Seed(
+            seed.round_num,
+            seed.p_ego,
+            seed.p_npc,
+            seed.v_npc,
+            len(seed.action_chain),  # <-- random actions cannot be predicted
+            seed.action_chain,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):  # <-- the scene's round log
+            scene.setup_round()
+            scene.snapshot_log = Snapshot_Buffer()
+            scene.start_actions()
+            scene.simulate()
+            scene.calculate_loss()
+        return scene.result.loss, scene.collision is not None
+
+    def admit(self, seed: Seed) -> bool:
+        # True if the seed goes to the simulator, call record with its result
+        loss, collided = self.predict(seed)
+        self.screened += 1
+        admitted = collided or loss.time_gap <= self.threshold
+        if admitted:
+            self.admitted += 1
+        elif random.random() < self.audit_rate:
+            self.audited += 1
+        else:
+            return False
+        self.verdicts[id(seed)] = admitted
+        return True
+
+    def record(self, seed: Seed):
+        assert seed.round_result is not None
+        admitted = self.verdicts.pop(id(seed), None)
+        if admitted is None:
+            return
+        hit = (
+            seed.round_result.result == _COLLISION
+            or seed.round_result.loss.time_gap <= self.threshold
+        )
+        if admitted:
+            self.admitted_runs += 1
+            self.admitted_hits += hit
+        else:
+            self.false_negatives += hit
+
+    @property
+    def rejected(self) -> int:
+        return self.screened - self.admitted
+
+    @property
+    def false_negative_rate(self) -> Optional[float]:
+        return self.false_negatives / self.audited if self.audited > 0 else None
+
+    def report(self) -> dict:
+        false_negative_rate = self.false_negative_rate
+        return {
+            "threshold": self.threshold,
+            "screened": self.screened,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "audited": self.audited,
+            "false_negatives": self.false_negatives,
+            "false_negative_rate": false_negative_rate,
+            "missed_estimate": None
+            if false_negative_rate is None
+            else false_negative_rate * (self.rejected - self.audited),
+            "admitted_precision": self.admitted_hits / self.admitted_runs
+            if self.admitted_runs > 0
+            else None,
+        }
+
+    def to_basic_data(self):
+        return {
+            "screened": self.screened,
+            "admitted": self.admitted,
+            "admitted_hits": self.admitted_hits,
+            "admitted_runs": self.admitted_runs,
+            "audited": self.audited,
+            "false_negatives": self.false_negatives,
+        }
+
+    def recover_from_basic_data(self, data: dict):
+        self.screened = data["screened"]
+        self.admitted = data["admitted"]
+        self.admitted_hits = data["admitted_hits"]
+        self.admitted_runs = data["admitted_runs"]
+        self.audited = data["audited"]
+        self.false_negatives = data["false_negatives"]
+
+    def close(self):
+        self.scene.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from .scenario import Scenario
+
+    # predicted against full kinematic rounds on a grid of seeds:
+    # python -m scenario.prescreen [step_seconds]
+    step_seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    prescreen = Prescreen(Scenario, step_seconds=step_seconds)
+    full = Scenario(None, None, "Town05", Path("/tmp/prescreen_check"), Kinematic_Backend("Town05"))
+    full.artifact_writer = None
+    full.snapshot_log_format = "csv"
+    seeds = [
+        Seed(i, p_ego, p_npc, v_npc, len(chain), list(chain))
+        for i, (p_ego, p_npc, v_npc, chain) in enumerate(
+            (p_ego, p_npc, v_npc, chain)
+            for p_ego in (0.5, 5.5)
+            for p_npc in (0.5, 5.5)
+            for v_npc in range(2, 60, 6)
+            for chain in ([], [(200, "dec")], [(100, "acc"), (300, "lane")], [(150, "acc"), (150, "dec")])
+        )
+    ]
+    predict_seconds = 0.0
+    errors = []
+    confusion = {(True, True): 0, (True, False): 0, (False, True): 0, (False, False): 0}
+    for seed in seeds:
+        start = time.perf_counter()
+        loss, collided = prescreen.predict(seed)
+        predict_seconds += time.perf_counter() - start
+        result = full.run(seed)
+        admitted = collided or loss.time_gap <= prescreen.threshold
+        hit = result.result == _COLLISION or result.loss.time_gap <= prescreen.threshold
+        confusion[admitted, hit] += 1
+        if math.isfinite(loss.time_gap) and math.isfinite(result.loss.time_gap):
+            errors.append(abs(loss.time_gap - result.loss.time_gap))
+    full.close()
+    prescreen.close()
+    errors.sort()
+    print(
+        f"\n{len(seeds)} seeds, {predict_seconds / len(seeds) * 1000:.2f} ms per prediction, "
+        f"time gap error median {errors[len(errors) // 2]:.3f} s, "
+        f"90% {errors[int(len(errors) * 0.9)]:.3f} s"
+    )
+    print(
+        f"admitted: {confusion[True, True]} hits, {confusion[True, False]} misses; "
+        f"rejected: {confusion[False, True]} hits (false negatives), {confusion[False, False]} misses"
+    )
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from .seed import Round_Result, Seed
+
+_QUANTUM = 1e-6  # <-- p_ego, p_npc and v_npc closer than this share a result
+# bumped when the same seed runs differently: 2, all actions of a shared
+# tick run; 3, a round can end during an action; 4, early termination waits
+# for the actions and for the other actor's path ahead
+_KEY_VERSION = 4
+
+
+def _quantize(value: Optional[float], quantum: float) -> Optional[int]:
+    return None if value is None else round(value / quantum)
+
+
+def seed_cache_key(scenario: str, seed: Seed, quantum: float = _QUANTUM, **options) -> str:
+    # content address of a deterministic round. The chain is sorted by tick
+    # (stable: actions on a shared tick run in chain order, see check_action_chain)
+    canonical = {
+        "version": _KEY_VERSION,
+        "scenario": scenario,
+        "p_ego": _quantize(seed.p_ego, quantum),
+        "p_npc": _quantize(seed.p_npc, quantum),
+        "v_npc": _quantize(seed.v_npc, quantum),
+        "action_chain": sorted(seed.action_chain, key=lambda x: x[0]),
+        "options": options,
+    }
+    data = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class Result_Cache:
+    # round results on disk (SQLite, shared by processes and drivers) behind
+    # an in-memory LRU. A lookup returns a fresh Round_Result
+    def __init__(self, path, max_entries: int = 4096):
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT NOT NULL)"
+        )
+        self.db.commit()
+        self.memory: OrderedDict[str, dict] = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def remember(self, key: str, data: dict):
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Round_Result]:
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+        else:
+            row = self.db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                data = json.loads(row[0])
+                self.remember(key, data)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Round_Result.recover_from_basic_data(data)
+
+    def put(self, key: str, result: Round_Result):
+        data = json.loads(json.dumps(result.to_basic_data()))
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?)", (key, json.dumps(data))
+            )
+        self.remember(key, data)
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from .loss import Loss
+
+    seed = Seed(0, 0.5, 0.5, 20, 2, [(250, "dec"), (200, "acc")])
+    same = Seed(7, 0.5 + 1e-9, 0.5, 20, 2, [(200, "acc"), (250, "dec")])
+    assert seed_cache_key("case06", seed) == seed_cache_key("case06", same)
+    assert seed_cache_key("case06", seed) != seed_cache_key("case04", seed)
+    assert seed_cache_key("case06", seed) != seed_cache_key("case06", seed, early_termination=True)
+    tie = Seed(0, 0.5, 0.5, 20, 2, [(200, "dec"), (200, "acc")])
+    assert seed_cache_key("case06", tie) != seed_cache_key("case06", Seed(0, 0.5, 0.5, 20, 2, [(200, "acc"), (200, "dec")]))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = Result_Cache(Path(tmp_dir) / "result_cache.sqlite", max_entries=2)
+        key = seed_cache_key("case06", seed)
+        assert cache.get(key) is None
+        cache.put(key, Round_Result("arrive", Loss(1.5, 2.5), (300, 2.5), [(200, "acc", 10)]))
+        for i in range(3):
+            cache.put(f"other {i}", Round_Result())  # <-- pushes key out of the LRU
+        assert key not in cache.memory
+        result = Result_Cache(Path(tmp_dir) / "result_cache.sqlite").get(key)
+        assert result is not None and result.min_distance == (300, 2.5)
+        assert cache.get(key).action_seq == [(200, "acc", 10)]  # type: ignore
+        cache.close()
+        print(f"ok, {cache.hits} hits, {cache.misses} misses")
@@ -1,21 +1,43 @@
-from typing import Optional
+from __future__ import annotations
+
+from collections import deque
+import copy
+from typing import Generator, Optional
 
-import carla
 import os
 from pathlib import Path
 import random
 import yaml
 
+from .artifact_writer import Artifact_Writer
+from .backend import Backend, Carla_Backend, Command_Batch, Future_Actor, Tick_State, carla
+from .conflict_detector import _CLEAR_HOLD_TICKS, Conflict_Detector
 from .conflict_point import Conflict_Point
 from .loss import Loss, LossType
+from .result_cache import Result_Cache, seed_cache_key
 from .seed import Seed, Round_Result
-from .utils import kmh_2_ms, distance, get_conflict_point, calculate_min_distance
+from .snapshot_log import Snapshot_Buffer, open_snapshot_log
+from .trajectory import Trajectory
+from .utils import (
+    kmh_2_ms,
+    distance,
+    CONFLICT_POINT_ENGINES,
+    calculate_min_distance,
+)
+
+_STOP_SPEED = 0.01  # <-- m/s, action_stop counts the npc as standing below this
+
+
+def action_schedule(action_chain: list[tuple[int, str]]) -> dict[int, list[str]]:
+    # tick -> the chain's actions at that tick, in chain order
+    schedule: dict[int, list[str]] = {}
+    for tick, action in action_chain:
+        schedule.setdefault(tick, []).append(action)
+    return schedule
 
 
 class Scenario:
-    client: carla.Client
-    world: carla.World
-    traffic_manager: carla.TrafficManager
+    backend: Backend
     spawn_points: list[carla.Transform]
 
     scenario_center: carla.Vector3D  # carla.Location
@@ -25,21 +47,33 @@ class Scenario:
     # collision_detector: carla.Sensor.Other.Collision
 
     start_timestamp: Optional[carla.Timestamp]
+    tick_state: Tick_State
     result: Round_Result
     tick_cnt: int
-
-    def __init__(self, host, port, world_map, output_root_dir: Path):
-        self.client = carla.Client(host, port)
-        self.client.load_world(world_map)
-        self.world = self.client.get_world()
+    action_schedule: dict[int, list[str]]
+    last_action_tick: int  # <-- early termination waits until the actions up to it started
+    action_queue: deque[tuple[int, str]]  # <-- (tick, action) started when the running one ends
+    running_action: Optional[tuple[int, str, int, Generator[None, None, None]]]
+    round_action_cnt: int  # <-- chain and random actions of the round, random ones up to action_capability
+    branches_left: int  # <-- seeds of run_branches still to finish, the last one destroys the actors
+
+    def __init__(
+        self,
+        host,
+        port,
+        world_map,
+        output_root_dir: Path,
+        backend: Optional[Backend] = None,
+    ):
+        if backend is None:
+            backend = Carla_Backend(host, port, world_map)
+        self.backend = backend
+        self.world = self.backend.world  # <-- debug drawing, CARLA only
         self.output_root_dir: Path = output_root_dir
 
-        self.traffic_manager = self.client.get_trafficmanager()
-        self.traffic_manager.set_synchronous_mode(True)
-
         self.set_default_weather()
 
-        self.spawn_points = self.world.get_map().get_spawn_points()
+        self.spawn_points = self.backend.get_spawn_points()
         # self.draw_spawn_points()
 
         # Town05
@@ -55,12 +89,28 @@ class Scenario:
         #     time.sleep(3)
 
         self.result = Round_Result()
+        self.ego_traj = Trajectory()
+        self.npc_traj = Trajectory()
+        self.conflict_detector = Conflict_Detector()
+        self.conflict_point_engine = "online"  # <-- "online", "loop", "vectorized" or "grid"
+        self.early_termination = False  # <-- stop once the conflict window has passed, a heuristic: see conflict_window_passed
+        self.persistent_actors = False  # <-- keep the vehicles and sensor alive between rounds
+        self.actor_pool: dict[str, carla.Actor] = {}
+        self.actors_reused = False
+        self.artifact_writer: Optional[Artifact_Writer] = Artifact_Writer()  # <-- None: write in place
+        self.snapshot_log_format = "npy"  # <-- "npy" (binary, see scenario.snapshot_log) or "csv"
+        self.batch_commands = True  # <-- setup and teardown calls go out as command batches
+        self.commands: Backend | Command_Batch = self.backend
+        self.round_trips: dict[str, tuple[int, float]] = {}
+        self.round_trip_mark = self.backend.stats.read()
+        self.result_cache_path: Optional[Path] = None  # <-- Result_Cache file, deterministic rounds run once
+        self.result_cache: Optional[Result_Cache] = None
+        self.simulated_ticks = 0  # <-- world ticks of all rounds, run_branches shares a prefix's
+        self.simulated_ticks_mark = 0
+        self.step_ticks = 1  # <-- round ticks per world tick, the prescreen's world steps coarser
 
     def set_default_weather(self):
-        settings = self.world.get_settings()
-        settings.synchronous_mode = True
-        settings.fixed_delta_seconds = 0.01  # type: ignore
-        self.world.apply_settings(settings)
+        self.backend.apply_settings(synchronous_mode=True, fixed_delta_seconds=0.01)
 
     def draw_spawn_points(self):
         self.world.debug.draw_point(
@@ -85,7 +135,7 @@ class Scenario:
 
     def get_waypoints_in_spectator(self, range=30):
         waypoints: list[carla.WayPoint] = list()
-        for waypoint in self.world.get_map().generate_waypoints(2):
+        for waypoint in self.backend.generate_waypoints(2):
             if distance(waypoint.transform.location, self.scenario_center) <= range:  # type: ignore
                 waypoints.append(waypoint)
         return waypoints
@@ -102,44 +152,131 @@ class Scenario:
             spectator_location,
             carla.Rotation(pitch=camera_angle),  # type: ignore
         )
-        self.world.get_spectator().set_transform(spectator_transform)
+        self.backend.set_spectator(spectator_transform)
 
     def set_collision_detector(self):
-        collision_detector_bp = self.world.get_blueprint_library().find(
-            "sensor.other.collision"
-        )
-        self.collision_detector = self.world.spawn_actor(
-            collision_detector_bp, carla.Transform(), attach_to=self.ego
-        )
         self.collision = None
+        if "collision_detector" in self.actor_pool:
+            self.collision_detector = self.actor_pool["collision_detector"]
+            return
 
         def detect_collision(event):
+            if self.persistent_actors and (
+                self.start_timestamp is None or event.frame < self.start_timestamp.frame
+            ):
+                return  # <-- late event of the previous round, or the teleport
             if self.collision is None:
                 self.collision = event
-                self.npc.enable_constant_velocity(carla.Vector3D(0, 0, 0))
+                self.backend.enable_constant_velocity(self.npc, carla.Vector3D(0, 0, 0))
                 print(self.collision)
 
-        self.collision_detector.listen(lambda event: detect_collision(event))  # type: ignore
+        self.collision_detector = self.commands.spawn_collision_sensor(
+            self.ego, detect_collision
+        )
+        if self.persistent_actors:
+            self.actor_pool["collision_detector"] = self.collision_detector
+
+    def spawn_vehicle(self, role: str, blueprint_id: str, transform, attributes):
+        # with persistent_actors a role's vehicle is spawned in the first round
+        # only, later rounds teleport it back and reset it
+        vehicle = self.actor_pool.get(role)
+        if vehicle is not None:
+            self.commands.reset_vehicle(vehicle, transform)
+            self.actors_reused = True
+            return vehicle
+        vehicle = self.commands.spawn_vehicle(blueprint_id, transform, attributes)
+        self.commands.configure_vehicle(vehicle)
+        if self.persistent_actors:
+            self.actor_pool[role] = vehicle
+        return vehicle
+
+    def check_actor_reset(self) -> bool:
+        # after the first tick a reused vehicle has to look like a fresh spawn:
+        # at its start point, ego standing, npc at its initial speed
+        _POSITION_TOLERANCE = 1.0
+        _SPEED_TOLERANCE = 0.5
+
+        checks = (
+            ("ego", self.ego_init_transform, 0.0),
+            ("npc", self.npc_init_transform, self.npc_init_velocity.length()),
+        )
+        tick_state = self.backend.capture_tick([self.ego, self.npc])  # <-- both from one snapshot
+        for (role, init_transform, init_speed), state in zip(checks, tick_state.actors):
+            location = state.location
+            velocity = state.velocity
+            position_error = (
+                (location.x - init_transform.location.x) ** 2
+                + (location.y - init_transform.location.y) ** 2
+            ) ** 0.5
+            speed = (velocity.x**2 + velocity.y**2) ** 0.5
+            if (
+                position_error > _POSITION_TOLERANCE
+                or abs(speed - init_speed) > _SPEED_TOLERANCE
+            ):
+                print(
+                    f"-- {role} reset failed, position error: {position_error:>.4f}, "
+                    + f"speed: {speed:>.4f} (expected {init_speed:>.4f})"
+                )
+                return False
+        if self.collision is not None:
+            print("-- reset failed, collision carried over")
+            return False
+        return True
+
+    def begin_commands(self):
+        # until apply_commands, backend calls made through self.commands are
+        # recorded and the spawned actors are Future_Actor handles
+        if self.batch_commands:
+            self.commands = Command_Batch()
+
+    def apply_commands(self):
+        if isinstance(self.commands, Command_Batch):
+            self.backend.apply_batch(self.commands)
+            self.ego = Future_Actor.resolve(self.ego)
+            self.npc = Future_Actor.resolve(self.npc)
+            self.collision_detector = Future_Actor.resolve(self.collision_detector)
+            for role, actor in self.actor_pool.items():
+                self.actor_pool[role] = Future_Actor.resolve(actor)
+        self.commands = self.backend
+
+    def mark_round_trips(self, phase: str):
+        count, seconds = self.backend.stats.read()
+        self.round_trips[phase] = (
+            count - self.round_trip_mark[0],
+            seconds - self.round_trip_mark[1],
+        )
+        self.round_trip_mark = (count, seconds)
+
+    def release_actors(self):
+        for actor in self.actor_pool.values():
+            self.backend.destroy(actor)
+        self.actor_pool.clear()
+
+    def close(self):
+        self.release_actors()
+        if self.result_cache is not None:
+            self.result_cache.close()
+        if self.artifact_writer is not None:
+            self.artifact_writer.close()  # <-- waits for the pending artifacts, fsynced
 
     def init_scenario(self, p_ego=None, p_npc=None, v_npc=None):
+        self.actors_reused = False
+        self.begin_commands()
         self.set_ego_car(position=p_ego)
         self.set_npc_car(position=p_npc, velocity=v_npc)
         self.set_ego_car_route()
         self.set_npc_car_route()
         self.set_collision_detector()
+        self.apply_commands()
 
-        self.ego_traj = []
-        self.npc_traj = []
+        self.ego_traj.clear()
+        self.npc_traj.clear()
+        self.conflict_detector.reset()
         self.start_timestamp = None
         self.result = Round_Result()
         self.tick_cnt = 0
-        self.init_snapshot_info_log()
 
     def set_ego_car(self, position=None):
-        self.ego_vehicle_bp = self.world.get_blueprint_library().find("vehicle.audi.a2")
-        self.ego_vehicle_bp.set_attribute("role_name", "autoware_v1")
-        self.ego_vehicle_bp.set_attribute("color", "255,0,0")
-        # print(self.ego_vehicle_bp.get_attribute('color').recommended_values)
         # Town05
         ego_init_point = 65  # <-- spawn point #65: (x: -82.602486, y: 2.750381)
         self.ego_init_transform = carla.Transform(
@@ -153,17 +290,14 @@ class Scenario:
             self.p_ego = position
         self.ego_init_transform.location.x += self.p_ego
         # self.ego_init_transform.location.z = 1
-        self.ego = self.world.spawn_actor(self.ego_vehicle_bp, self.ego_init_transform)  # type: ignore
-
-        self.traffic_manager.random_left_lanechange_percentage(self.ego, 0)
-        self.traffic_manager.update_vehicle_lights(self.ego, True)
-        self.traffic_manager.random_right_lanechange_percentage(self.ego, 0)
-        self.traffic_manager.ignore_lights_percentage(self.ego, 100)
-        self.traffic_manager.ignore_signs_percentage(self.ego, 100)
+        self.ego = self.spawn_vehicle(
+            "ego",
+            "vehicle.audi.a2",
+            self.ego_init_transform,
+            {"role_name": "autoware_v1", "color": "255,0,0"},
+        )
 
     def set_npc_car(self, position=None, velocity=None):
-        self.npc_vehicle_bp = self.world.get_blueprint_library().find("vehicle.audi.tt")
-        self.npc_vehicle_bp.set_attribute("color", "240,240,240")
         # Town05
         npc_init_point = 22  # <-- spawn point #22: (x: -19.079281, y: -0.880121),  distance to walker pass: 18
         self.npc_init_transform = carla.Transform(
@@ -178,7 +312,9 @@ class Scenario:
             self.p_npc = position
         self.npc_init_transform.location.x -= self.p_npc
         # self.npc_init_transform.location.z = 1
-        self.npc = self.world.spawn_actor(self.npc_vehicle_bp, self.npc_init_transform)  # type: ignore
+        self.npc = self.spawn_vehicle(
+            "npc", "vehicle.audi.tt", self.npc_init_transform, {"color": "240,240,240"}
+        )
 
         if velocity is None:
             self.v_npc = random.randint(0, 80)
@@ -187,26 +323,20 @@ class Scenario:
         self.npc_init_velocity = carla.Vector3D(
             abs(kmh_2_ms(self.v_npc) * self.npc_init_transform.get_forward_vector())  # type: ignore
         )
-        self.npc.enable_constant_velocity(self.npc_init_velocity)
-
-        self.traffic_manager.random_left_lanechange_percentage(self.npc, 0)
-        self.traffic_manager.update_vehicle_lights(self.npc, True)
-        self.traffic_manager.random_right_lanechange_percentage(self.npc, 0)
-        self.traffic_manager.ignore_lights_percentage(self.npc, 100)
-        self.traffic_manager.ignore_signs_percentage(self.npc, 100)
+        self.commands.enable_constant_velocity(self.npc, self.npc_init_velocity)
 
     def set_ego_car_route(self):
         self.ego_route = [self.spawn_points[i].location for i in [205, 240, 124]]
-        self.traffic_manager.set_path(self.ego, self.ego_route)  # type: ignore
+        self.commands.set_path(self.ego, self.ego_route)
 
     def set_npc_car_route(self):
         self.npc_route = [self.spawn_points[i].location for i in [202, 64]]
-        self.traffic_manager.set_path(self.npc, self.npc_route)  # type: ignore
+        self.commands.set_path(self.npc, self.npc_route)
 
     def stop_npc_car(self):
-        self.npc.enable_constant_velocity(carla.Vector3D(0, 0, 0))
+        self.backend.enable_constant_velocity(self.npc, carla.Vector3D(0, 0, 0))
 
-    def record_seed_info(self):
+    def record_seed_info(self, cached=False):
         env_info = {
             "p_ego": self.seed.p_ego,
             "p_npc": self.seed.p_npc,
@@ -214,13 +344,19 @@ class Scenario:
             "result": self.result.result,
             "loss": self.result.loss.value,
             "action_seq": self.result.action_seq,
+            "round_trips": {phase: count for phase, (count, _) in self.round_trips.items()},
+            "simulated_ticks": self.simulated_ticks - self.simulated_ticks_mark,
+            "cached": cached,  # <-- taken from the result cache, nothing was simulated
         }
         output_dir = self.output_root_dir / f"round_{self.seed.round_num:>04d}"
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        with open(output_dir / "env_info.yml", "w") as f:
-            yaml.dump(env_info, f)
-            f.close()
+        if self.artifact_writer is None:
+            with open(output_dir / "env_info.yml", "w") as f:
+                yaml.dump(env_info, f)
+                f.close()
+        else:
+            self.artifact_writer.write_file(output_dir / "env_info.yml", yaml.dump(env_info))
 
     def init_snapshot_info_log(self):
         output_dir = os.path.join(
@@ -228,80 +364,85 @@ class Scenario:
         )
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        self.snapshot_file = open(os.path.join(output_dir, "snapshot_record.csv"), "w")
-        self.snapshot_file.writelines(
-            "frame, time, tick_num, "
-            + "ego_x, ego_y, ego_z, "
-            + "npc_x, npc_y, npc_z, "
-            + "ego_v_x, ego_v_y, "
-            + "ego_a_x, ego_a_y, "
-            + "ego_throttle, ego_brake, ego_steer, ego_gear, "
-            + "npc_v_x, npc_v_y, "
-            + "npc_a_x, npc_a_y, "
-            + "npc_throttle, npc_brake, npc_steer, npc_gear \n"
+        self.snapshot_log = open_snapshot_log(
+            Path(output_dir),
+            self.snapshot_log_format,
+            self.backend.state_dtype,
+            self.artifact_writer,
         )
 
-    def record_snapshot_info(self, snapshot: carla.WorldSnapshot):
-        timestamp = snapshot.timestamp
-        ego_current_location = self.ego.get_transform().location
-        npc_current_location = self.npc.get_transform().location
-        ego_current_velocity = self.ego.get_velocity()
-        ego_current_accelerate = self.ego.get_acceleration()
-        ego_current_control: carla.VehicleControl = self.ego.get_control()
-        npc_current_velocity = self.npc.get_velocity()
-        npc_current_accelerate = self.npc.get_acceleration()
-        npc_current_control: carla.VehicleControl = self.npc.get_control()
-
-        snapshot_record = (
-            f"{timestamp.frame - self.start_timestamp.frame}, {timestamp.elapsed_seconds - self.start_timestamp.elapsed_seconds}, {self.tick_cnt}, "  # type: ignore
-            + f"{ego_current_location.x}, {ego_current_location.y}, {ego_current_location.z}, "
-            + f"{npc_current_location.x}, {npc_current_location.y}, {npc_current_location.z}, "
-            + f"{ego_current_velocity.x}, {ego_current_velocity.y}, "
-            + f"{ego_current_accelerate.x}, {ego_current_accelerate.y}, "
-            + f"{ego_current_control.throttle}, {ego_current_control.brake}, {ego_current_control.steer}, {ego_current_control.gear}, "
-            + f"{npc_current_velocity.x}, {npc_current_velocity.y}, "
-            + f"{npc_current_accelerate.x}, {npc_current_accelerate.y}, "
-            + f"{npc_current_control.throttle}, {npc_current_control.brake}, {npc_current_control.steer}, {npc_current_control.gear} \n"
+    def record_snapshot_info(self, tick_state: Tick_State):
+        timestamp = tick_state.timestamp
+        ego_state, npc_state = tick_state.actors
+        ego_current_location = ego_state.location
+        npc_current_location = npc_state.location
+        ego_current_velocity = ego_state.velocity
+        ego_current_accelerate = ego_state.acceleration
+        ego_current_control: carla.VehicleControl = ego_state.control
+        npc_current_velocity = npc_state.velocity
+        npc_current_accelerate = npc_state.acceleration
+        npc_current_control: carla.VehicleControl = npc_state.control
+
+        self.snapshot_log.write(
+            (
+                timestamp.frame - self.start_timestamp.frame,  # type: ignore
+                self.round_seconds(timestamp),
+                self.tick_cnt,
+                ego_current_location.x, ego_current_location.y, ego_current_location.z,
+                npc_current_location.x, npc_current_location.y, npc_current_location.z,
+                ego_current_velocity.x, ego_current_velocity.y,
+                ego_current_accelerate.x, ego_current_accelerate.y,
+                ego_current_control.throttle, ego_current_control.brake, ego_current_control.steer, ego_current_control.gear,
+                npc_current_velocity.x, npc_current_velocity.y,
+                npc_current_accelerate.x, npc_current_accelerate.y,
+                npc_current_control.throttle, npc_current_control.brake, npc_current_control.steer, npc_current_control.gear,
+            )
         )
-        self.snapshot_file.writelines(snapshot_record)
+
+    def round_seconds(self, timestamp) -> float:
+        # time since the round's first tick from the frame count. The
+        # simulator clock adds delta_seconds every tick, so a difference of
+        # elapsed_seconds carries the rounding error of every earlier round
+        # and the same seed would give a different time gap in a busy process
+        return (timestamp.frame - self.start_timestamp.frame) * timestamp.delta_seconds  # type: ignore
 
     def record_tick(self):
-        snapshot = self.world.get_snapshot()
-        timestamp = snapshot.timestamp
+        # ego and npc state of this tick, fetched once and read by the
+        # trajectories, the snapshot log and finish_state_judge
+        self.tick_state = self.backend.capture_tick([self.ego, self.npc])
+        timestamp = self.tick_state.timestamp
         if self.start_timestamp is None:
             self.start_timestamp = timestamp
 
-        ego_current_location = self.ego.get_transform().location
-        npc_current_location = self.npc.get_transform().location
+        ego_current_location = self.tick_state.actors[0].location
+        npc_current_location = self.tick_state.actors[1].location
+        seconds = self.round_seconds(timestamp)
         self.ego_traj.append(
-            (
-                timestamp.elapsed_seconds - self.start_timestamp.elapsed_seconds,
-                ego_current_location.x,
-                ego_current_location.y,
-                ego_current_location.z,
-            )
+            seconds,
+            ego_current_location.x,
+            ego_current_location.y,
+            ego_current_location.z,
         )
         self.npc_traj.append(
-            (
-                timestamp.elapsed_seconds - self.start_timestamp.elapsed_seconds,
-                npc_current_location.x,
-                npc_current_location.y,
-                npc_current_location.z,
-            )
+            seconds,
+            npc_current_location.x,
+            npc_current_location.y,
+            npc_current_location.z,
         )
+        self.conflict_detector.update(self.ego_traj[-1], self.npc_traj[-1])
 
-        self.record_snapshot_info(snapshot)
+        self.record_snapshot_info(self.tick_state)
 
     def finish_state_judge(self):
         _END_POINT_SCOPE = 5
         _MAX_RUNTIME = 30
 
-        snapshot = self.world.get_snapshot()
-        ego_current_location = self.ego.get_transform().location
+        timestamp = self.tick_state.timestamp
+        ego_current_location = self.tick_state.actors[0].location
         if self.collision is not None:
             self.result.result = "collision, hit NPC"
             print(
-                f"\n-- Collision, hit NPC, frame={self.collision.frame - self.start_timestamp.frame}, time={self.collision.timestamp - self.start_timestamp.elapsed_seconds}"  # type: ignore
+                f"\n-- Collision, hit NPC, frame={self.collision.frame - self.start_timestamp.frame}, time={(self.collision.frame - self.start_timestamp.frame) * timestamp.delta_seconds}"  # type: ignore
             )
             return True
         if distance(ego_current_location, self.ego_route[-1]) <= _END_POINT_SCOPE:
@@ -309,9 +450,16 @@ class Scenario:
             print("\n-- arrive --")
             return True
         if (
-            snapshot.timestamp.elapsed_seconds - self.start_timestamp.elapsed_seconds  # type: ignore
-            >= _MAX_RUNTIME
+            self.early_termination
+            and not self.actions_pending()
+            and self.conflict_detector.conflict_window_passed(
+                hold_ticks=_CLEAR_HOLD_TICKS // self.step_ticks
+            )
         ):
+            self.result.result = "conflict passed"
+            print("\n-- conflict passed --")
+            return True
+        if self.round_seconds(timestamp) >= _MAX_RUNTIME:
             self.result.result = "timeout"
             print("\n-- time out --")
             return True
@@ -322,12 +470,17 @@ class Scenario:
             self.result.loss = Loss(0, 0)
             print(f"loss: {self.result.loss.value:>.4f}")
         else:
-            conflict_point: Optional[Conflict_Point] = get_conflict_point(
-                self.ego_traj, self.npc_traj
-            )
-            self.result.min_distance = calculate_min_distance(
-                self.ego_traj, self.npc_traj
-            )
+            conflict_point: Optional[Conflict_Point]
+            if self.conflict_point_engine == "online":
+                conflict_point = self.conflict_detector.conflict_point
+                self.result.min_distance = self.conflict_detector.min_distance
+            else:
+                conflict_point = CONFLICT_POINT_ENGINES[self.conflict_point_engine](
+                    self.ego_traj, self.npc_traj
+                )
+                self.result.min_distance = calculate_min_distance(
+                    self.ego_traj, self.npc_traj
+                )
             if conflict_point is None:
                 print("No conflict")
             else:
@@ -335,94 +488,108 @@ class Scenario:
                 self.result.conflict_point = conflict_point
                 print(f"loss: {self.result.loss.value:>.4f}")
 
-    def check_action_chain(self) -> Optional[tuple[int, str, int]]:
-        for tick, action in self.seed.action_chain:
-            if tick == self.tick_cnt:
-                if action == "none":
-                    print(f"< none action >, tick: {self.tick_cnt}")
-                elif action == "acc":
-                    print(
-                        f"< action: accelerate >, tick: {self.tick_cnt} ~ ",
-                        end="",
-                        flush=True,
-                    )
-                    self.action_accelerate()
-                    print(self.tick_cnt)
-                elif action == "dec":
-                    print(
-                        f"< action: decelerate >, tick: {self.tick_cnt} ~ ",
-                        end="",
-                        flush=True,
-                    )
-                    self.action_decelerate()
-                    print(self.tick_cnt)
-                elif action == "lane":
-                    if self.npc_lane_change_direction:
-                        lane_change_direction = "right"
-                    else:
-                        lane_change_direction = "left"
-                    print(
-                        f"< action: lane change >, direction: {lane_change_direction}"
-                    )
-                    self.action_lane_change()
-                elif action == "stop":
-                    print(
-                        f"< action: stop >, tick: {self.tick_cnt} ~ ",
-                        end="",
-                        flush=True,
-                    )
-                    self.action_stop()
-                    print(self.tick_cnt)
-                action_duration = self.tick_cnt - tick
-                return (tick, action, action_duration)
-        return None
+    def compile_action_chain(self):
+        # built once per round so a tick costs one lookup whatever the chain length
+        self.action_schedule = action_schedule(self.seed.action_chain)
+        self.last_action_tick = max(self.action_schedule, default=0)
+
+    def actions_pending(self) -> bool:
+        # an action running or queued, a chain action at a tick not looked up
+        # yet, or random actions still to come: any of them can bring the
+        # vehicles together again
+        return (
+            self.running_action is not None
+            or len(self.action_queue) > 0
+            or self.last_action_tick > self.tick_cnt - self.step_ticks
+            or self.round_action_cnt < self.seed.action_capability
+        )
+
+    def check_action_chain(self) -> bool:
+        # start the actions scheduled at this tick, True if there were any.
+        # Actions sharing a tick run one after the other in chain order. A
+        # world tick of several round ticks starts the first of them with actions
+        actions = None
+        tick = self.tick_cnt - self.step_ticks
+        while actions is None and tick < self.tick_cnt:
+            tick += 1
+            actions = self.action_schedule.get(tick)
+        if actions is None:
+            return False
+        self.action_queue.extend((tick, action) for action in actions)
+        self.start_queued_action()
+        return True
 
     def random_run_action(self):
         action = random.choice(self._ACTION_OPTIONS)
         # action = self._ACTION_OPTIONS[0]
-        tick = self.tick_cnt
+        self.start_action(self.tick_cnt, action, "-- New action, ")
+
+    def start_queued_action(self):
+        # the next queued action that takes ticks is left running, the ones
+        # that do not (lane change, none) are done on the way
+        while self.running_action is None and len(self.action_queue) > 0:
+            tick, action = self.action_queue.popleft()
+            self.start_action(tick, action)
+
+    def start_action(self, tick: int, action: str, prefix: str = ""):
         if action == "none":
-            print(f"< none action >, tick: {self.tick_cnt}")
+            print(f"{prefix}< none action >, tick: {self.tick_cnt}")
+            steps = None
         elif action == "acc":
-            print(
-                f"-- New action, < action: accelerate >, tick: {self.tick_cnt} ~ ",
-                end="",
-                flush=True,
-            )
-            self.action_accelerate()
-            print(self.tick_cnt)
+            print(f"{prefix}< action: accelerate >, tick: {self.tick_cnt} ~ ", end="", flush=True)
+            steps = self.action_accelerate()
         elif action == "dec":
-            print(
-                f"-- New action, < action: decelerate >, tick: {self.tick_cnt} ~ ",
-                end="",
-                flush=True,
-            )
-            self.action_decelerate()
-            print(self.tick_cnt)
+            print(f"{prefix}< action: decelerate >, tick: {self.tick_cnt} ~ ", end="", flush=True)
+            steps = self.action_decelerate()
         elif action == "lane":
             if self.npc_lane_change_direction:
                 lane_change_direction = "right"
             else:
                 lane_change_direction = "left"
-            print(
-                f"-- New action, < action: lane change >, direction: {lane_change_direction}"
-            )
+            print(f"{prefix}< action: lane change >, direction: {lane_change_direction}")
             self.action_lane_change()
+            steps = None
         elif action == "stop":
-            print(
-                f"-- New action, < action: stop >, tick: {self.tick_cnt} ~ ",
-                end="",
-                flush=True,
-            )
-            self.action_stop()
-            print(self.tick_cnt)
-        action_duration = self.tick_cnt - tick
-        return (tick, action, action_duration)
+            print(f"{prefix}< action: stop >, tick: {self.tick_cnt} ~ ", end="", flush=True)
+            steps = self.action_stop()
+        else:
+            steps = None
+        if steps is None:
+            self.result.action_seq.append((tick, action, 0))
+            return
+        self.running_action = (tick, action, self.tick_cnt, steps)
+        self.step_action(1)  # <-- up to its first tick: the controls are set before it
+
+    def step_action(self, ticks: int) -> bool:
+        # advance the running action by ticks round ticks, False once it has ended
+        assert self.running_action is not None
+        tick, action, start_tick, steps = self.running_action
+        try:
+            for i in range(ticks):
+                next(steps)
+            return True
+        except StopIteration:
+            pass
+        print(self.tick_cnt)
+        self.result.action_seq.append((tick, action, self.tick_cnt - start_tick))
+        self.running_action = None
+        return False
+
+    def interrupt_action(self):
+        # the round ended during an action: its duration so far is recorded,
+        # the queued ones never started
+        if self.running_action is not None:
+            tick, action, start_tick, _ = self.running_action
+            print(f"{self.tick_cnt}, interrupted")
+            self.result.action_seq.append((tick, action, self.tick_cnt - start_tick))
+            self.running_action = None
+        self.action_queue.clear()
 
     def world_tick(self):
-        self.world.tick()
+        self.backend.tick()
         self.record_tick()
-        self.tick_cnt += 1
+        self.tick_cnt += self.step_ticks
+        self.simulated_ticks += 1
 
     def run(
         self,
@@ -430,62 +597,337 @@ class Scenario:
         action_check_interval=20,
         action_odds=0.3,
     ):
+        cache_key, cached_result = self.lookup_result(seed)
+        if cached_result is not None:
+            return cached_result
+        self.setup_round()
+        self.init_snapshot_info_log()
+        self.start_actions()
+        self.simulate(
+            action_check_interval=action_check_interval, action_odds=action_odds
+        )
+        self.finish_round(cache_key)
+        return self.result
+
+    def run_branches(
+        self,
+        seeds: list[Seed],
+        action_check_interval=20,
+        action_odds=0.3,
+    ) -> list[Round_Result]:
+        # seeds that differ only in their action chains: the ticks they agree
+        # on are simulated once. Where their schedules split, the round is
+        # checkpointed (at the first tick from there with no action running)
+        # and each group runs on from the checkpoint, splitting again where it
+        # diverges, so a seed simulates only the ticks after its own split.
+        # Each seed still gets its own result, snapshot log and env_info.
+        # Seeds that cannot share ticks (see can_branch) run one by one
+        if not self.can_branch(seeds):
+            return [self.run(seed, action_check_interval, action_odds) for seed in seeds]
+        results: list[Optional[Round_Result]] = [None] * len(seeds)
+        branches: list[tuple[int, Seed, Optional[str]]] = []  # <-- (index, seed, cache key) to simulate
+        for i, seed in enumerate(seeds):
+            cache_key, results[i] = self.lookup_result(seed)
+            if results[i] is None:
+                branches.append((i, seed, cache_key))
+        if len(branches) == 0:
+            return results  # type: ignore
+
+        self.seed = branches[0][1]
+        self.round_trips = {}
+        self.round_trip_mark = self.backend.stats.read()
+        self.simulated_ticks_mark = self.simulated_ticks
+        self.setup_round()
+        self.snapshot_log = Snapshot_Buffer()  # <-- the rows so far, copied into each seed's log at its end
+        self.branches_left = len(branches)
+        self.run_branch_tree(branches, False, results, action_check_interval, action_odds)
+        return results  # type: ignore
+
+    def run_branch_tree(
+        self,
+        branches: list[tuple[int, Seed, Optional[str]]],
+        finished: bool,
+        results: list[Optional[Round_Result]],
+        action_check_interval: int,
+        action_odds: float,
+    ):
+        # the branches agree on every tick simulated so far, the round is
+        # paused before the dispatch of a tick with no action running, or is
+        # finished
+        while len(branches) > 1 and not finished:
+            split_tick = self.split_tick([seed for _, seed, _ in branches])
+            if split_tick is None:
+                break  # <-- the same schedule from here on
+            self.seed = branches[0][1]
+            self.start_actions()
+            # the trunk is every branch's round: early termination waits for all their actions
+            self.last_action_tick = max(
+                (tick for _, seed, _ in branches for tick, _ in seed.action_chain), default=0
+            )
+            if self.tick_cnt == 0 or split_tick > self.tick_cnt:
+                finished = self.simulate(
+                    split_tick,
+                    resume=self.tick_cnt > 0,
+                    action_check_interval=action_check_interval,
+                    action_odds=action_odds,
+                )
+                if finished:
+                    break
+            # by the actions of this tick, the ones without any stay on the trunk
+            groups: dict[tuple, list[tuple[int, Seed, Optional[str]]]] = {}
+            for branch in branches:
+                actions = tuple(
+                    action for tick, action in branch[1].action_chain if tick == self.tick_cnt
+                )
+                groups.setdefault(actions, []).append(branch)
+            if len(groups) == 1:
+                continue  # <-- they differed at ticks an action ran through
+            print(f"-- branch at tick {self.tick_cnt} into {len(groups)} --")
+            checkpoint = self.save_branch_state()
+            branches = groups.pop((), None) or groups.popitem()[1]
+            for group in groups.values():
+                self.run_branch_tree(group, False, results, action_check_interval, action_odds)
+                self.restore_branch_state(checkpoint)
+
+        if not finished:
+            # the rest of the round is the same for all of them
+            self.seed = branches[0][1]
+            self.start_actions()
+            self.simulate(
+                resume=self.tick_cnt > 0,
+                action_check_interval=action_check_interval,
+                action_odds=action_odds,
+            )
+        checkpoint = self.save_branch_state() if len(branches) > 1 else None
+        for k, (i, seed, cache_key) in enumerate(branches):
+            if k > 0:
+                self.restore_branch_state(checkpoint)
+            self.seed = seed
+            rows = self.snapshot_log
+            self.init_snapshot_info_log()
+            rows.copy_to(self.snapshot_log)
+            self.branches_left -= 1
+            self.finish_round(cache_key, destroy_actors=self.branches_left == 0)
+            self.snapshot_log = rows
+            results[i] = self.result
+
+    def split_tick(self, seeds: list[Seed]) -> Optional[int]:
+        # first tick from the next one dispatched on where the seeds' schedules differ
+        schedules = [action_schedule(seed.action_chain) for seed in seeds]
+        first = max(self.tick_cnt, 1)
+        return min(
+            (
+                tick
+                for tick in set().union(*schedules)
+                if tick >= first
+                and any(schedule.get(tick) != schedules[0].get(tick) for schedule in schedules)
+            ),
+            default=None,
+        )
+
+    def save_branch_state(self):
+        return self.save_round_state(), len(self.snapshot_log.rows)
+
+    def restore_branch_state(self, state):
+        # the seed run from here is charged the ticks and round trips from here only
+        round_state, rows = state
+        self.restore_round_state(round_state)
+        self.snapshot_log.truncate(rows)
+        self.round_trips = {}
+        self.round_trip_mark = self.backend.stats.read()
+        self.simulated_ticks_mark = self.simulated_ticks
+
+    def can_branch(self, seeds: list[Seed]) -> bool:
+        # a shared prefix is exact only for the same spawn parameters, on a
+        # backend that restores its state, and without random actions
+        if not self.backend.restorable or len(seeds) < 2:
+            return False
+        params = (seeds[0].p_ego, seeds[0].p_npc, seeds[0].v_npc)
+        if None in params:
+            return False  # <-- drawn at random by init_scenario
+        return all(
+            (seed.p_ego, seed.p_npc, seed.v_npc) == params
+            and len(seed.action_chain) >= seed.action_capability
+            for seed in seeds
+        )
+
+    def lookup_result(self, seed: Seed) -> tuple[Optional[str], Optional[Round_Result]]:
+        # the seed's cache key and, on a hit, its cached result, recorded as
+        # the seed's round
         self.seed = seed
         print(self.seed)
+        self.round_trips = {}
+        self.round_trip_mark = self.backend.stats.read()
+        self.simulated_ticks_mark = self.simulated_ticks
+        cache_key = self.result_cache_key()
+        if cache_key is not None:
+            cached_result = self.result_cache.get(cache_key)  # type: ignore
+            if cached_result is not None:
+                print("-- result cache hit --")
+                self.result = cached_result
+                print(self.result)
+                self.record_seed_info(cached=True)
+                return cache_key, cached_result
+        return cache_key, None
+
+    def setup_round(self):
         self.init_scenario(
             p_ego=self.seed.p_ego, p_npc=self.seed.p_npc, v_npc=self.seed.v_npc
         )
 
-        self.world.tick()
+        self.backend.tick()
+        if self.actors_reused and not self.check_actor_reset():
+            print("-- respawn actors --")
+            self.release_actors()
+            self.init_scenario(
+                p_ego=self.seed.p_ego, p_npc=self.seed.p_npc, v_npc=self.seed.v_npc
+            )
+            self.backend.tick()
         self.start_round()
+        self.mark_round_trips("setup")
+
+    def start_actions(self):
+        self.compile_action_chain()
+        self.action_queue = deque()
+        self.running_action = None
+        self.round_action_cnt = len(self.seed.action_chain)
 
+    def simulate(
+        self,
+        stop_tick: Optional[int] = None,
+        resume=False,
+        action_check_interval=20,
+        action_odds=0.3,
+    ) -> bool:
+        # tick until the round finishes (True) or, with stop_tick, until the
+        # first tick from stop_tick on that has no action running (False),
+        # before its actions are dispatched. resume=True picks up there
         _ACTION_CHECK_INTERVAL = action_check_interval
         _ACTION_ODDS = action_odds
         _flag_action = False
 
-        round_action_chain = [x for x in self.seed.action_chain]
-
         while True:
-            self.world_tick()
+            if resume:
+                resume = False
+            else:
+                self.world_tick()
+
+                if self.finish_state_judge():
+                    self.interrupt_action()
+                    return True
+
+                if self.running_action is not None:
+                    # one tick of the action; the tick it ends on starts the next
+                    # queued one but checks nothing else
+                    if not self.step_action(self.step_ticks):
+                        self.start_queued_action()
+                    continue
 
-            if self.finish_state_judge():
-                break
+                if stop_tick is not None and self.tick_cnt >= stop_tick:
+                    return False
 
-            action_info = self.check_action_chain()
-            if action_info is not None:
-                self.result.action_seq.append(action_info)
+            if self.check_action_chain():
                 continue
 
             if (
-                len(round_action_chain) < self.seed.action_capability
+                self.round_action_cnt < self.seed.action_capability
                 and self.tick_cnt % _ACTION_CHECK_INTERVAL == 0
             ):
                 if random.choices([True, False], [_ACTION_ODDS, 1 - _ACTION_ODDS])[0]:
-                    action_result = self.random_run_action()
-                    self.result.action_seq.append(action_result)
-                    round_action_chain.append((action_result[0], action_result[1]))
+                    self.random_run_action()
+                    self.round_action_cnt += 1
                     # _flag_action = True
                     continue
 
+    def finish_round(self, cache_key: Optional[str], destroy_actors=True):
+        self.mark_round_trips("run")
         self.calculate_loss()
 
         print(self.result)
 
-        self.end_round()
-        return self.result
+        self.end_round(destroy_actors)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, self.result)  # type: ignore
+
+    def save_round_state(self):
+        # what the rest of a round depends on, at a tick with no action
+        # running: restore_round_state goes back to it
+        assert self.running_action is None
+        return (
+            self.backend.save_state(),
+            self.tick_cnt,
+            self.start_timestamp,
+            self.tick_state,
+            self.collision,
+            self.npc_lane_change_direction,
+            len(self.ego_traj),
+            len(self.npc_traj),
+            self.conflict_detector.save(),
+            copy.deepcopy(self.result),
+        )
+
+    def restore_round_state(self, state):
+        (
+            backend_state,
+            self.tick_cnt,
+            self.start_timestamp,
+            self.tick_state,
+            self.collision,
+            self.npc_lane_change_direction,
+            ego_traj_size,
+            npc_traj_size,
+            detector_state,
+            result,
+        ) = state
+        self.backend.restore_state(backend_state)
+        self.ego_traj.truncate(ego_traj_size)
+        self.npc_traj.truncate(npc_traj_size)
+        self.conflict_detector.restore(detector_state)
+        self.result = copy.deepcopy(result)  # <-- the checkpoint's stays untouched for the next branch
+
+    def result_cache_key(self) -> Optional[str]:
+        # rounds that add random actions (action_capability above the chain)
+        # are not reproducible and always run
+        if self.result_cache_path is None:
+            return None
+        if len(self.seed.action_chain) < self.seed.action_capability:
+            return None
+        if self.result_cache is None:
+            self.result_cache = Result_Cache(self.result_cache_path)
+        return seed_cache_key(
+            type(self).__name__,
+            self.seed,
+            backend=type(self.backend).__name__,
+            early_termination=self.early_termination,
+        )
 
     def start_round(self):
-        self.ego.set_autopilot(True)  # <-- ego's ADS
-        self.npc.disable_constant_velocity()
-        self.npc.set_autopilot(True)  # <-- npc's ADS
+        self.begin_commands()
+        self.commands.set_autopilot(self.ego, True)  # <-- ego's ADS
+        self.commands.disable_constant_velocity(self.npc)
+        self.commands.set_autopilot(self.npc, True)  # <-- npc's ADS
+        self.apply_commands()
+
+    def end_round(self, destroy_actors=True):
+        # destroy_actors=False: the vehicles stay for the next branch of run_branches
+        if destroy_actors and not self.persistent_actors:
+            self.begin_commands()
+            self.commands.destroy(self.ego)
+            self.commands.destroy(self.npc)
+            self.commands.destroy(self.collision_detector)
+            self.apply_commands()
+        self.mark_round_trips("teardown")
+        print(
+            "round trips: "
+            + ", ".join(
+                f"{phase} {count} ({seconds * 1000:.1f} ms)"
+                for phase, (count, seconds) in self.round_trips.items()
+            )
+            + f", {self.round_trips['run'][0] / max(self.simulated_ticks - self.simulated_ticks_mark, 1):.1f} per tick"
+        )
 
-    def end_round(self):
         self.record_seed_info()
-
-        self.ego.destroy()
-        self.npc.destroy()
-        self.collision_detector.destroy()
-        self.snapshot_file.close()
+        self.snapshot_log.close()
 
         # self.seed.round_result = {'result': self.result, 'loss': self.loss, 'action_seq': self.action_seq}
 
@@ -493,36 +935,40 @@ class Scenario:
     _ACTION_OPTIONS = ["none", "acc", "dec", "lane"]
 
     def action_lane_change(self):
-        self.traffic_manager.force_lane_change(self.npc, self.npc_lane_change_direction)  # type: ignore
+        self.backend.force_lane_change(self.npc, bool(self.npc_lane_change_direction))
         self.npc_lane_change_direction = (self.npc_lane_change_direction + 1) % 2
 
+    # the actions that take ticks are generators: they set the npc's controls,
+    # then yield once per tick (Scenario.simulate ticks the world in between) and
+    # give the npc back to the traffic manager when they are done
+
     def action_accelerate(self, throttle=1, duration=10):
-        self.npc.set_autopilot(False)
+        self.backend.set_autopilot(self.npc, False)
         npc_control = carla.VehicleControl(throttle=throttle)
-        self.npc.apply_control(npc_control)
+        self.backend.apply_control(self.npc, npc_control)
         for i in range(duration):
-            self.world_tick()
-        self.npc.set_autopilot(True)
-        return duration
+            yield
+        self.backend.set_autopilot(self.npc, True)
 
     def action_decelerate(self, brake=1, duration=10):
-        self.npc.set_autopilot(False)
+        self.backend.set_autopilot(self.npc, False)
         npc_control = carla.VehicleControl(brake=brake)
-        self.npc.apply_control(npc_control)
+        self.backend.apply_control(self.npc, npc_control)
         for i in range(duration):
-            self.world_tick()
-        self.npc.set_autopilot(True)
-        return duration
+            yield
+        self.backend.set_autopilot(self.npc, True)
 
-    def action_stop(self, duration=5):  # <-- have bug
-        self.npc.set_autopilot(False)
+    def action_stop(self, duration=5):
+        # brakes until the npc stands, then duration ticks more. A npc that
+        # never quite stops is ended by finish_state_judge's timeout
+        self.backend.set_autopilot(self.npc, False)
         npc_control = carla.VehicleControl(brake=1)
-        self.npc.apply_control(npc_control)
-        while self.npc.get_velocity().length() > 0:
-            self.world_tick()
+        self.backend.apply_control(self.npc, npc_control)
+        while self.tick_state.actors[1].velocity.length() > _STOP_SPEED:
+            yield
         for i in range(duration):
-            self.world_tick()
-        self.npc.set_autopilot(True)
+            yield
+        self.backend.set_autopilot(self.npc, True)
 
     def run_test(self):
         flag_start = False
@@ -534,7 +980,7 @@ class Scenario:
         )
         print(self.ego_init_transform)
         while True:
-            self.world.tick()
+            self.backend.tick()
 
             # if not flag_start:
             #     flag_start = True
@@ -548,3 +994,68 @@ class Scenario:
             #     self.world.tick()
             #     self.set_spectator(sp.location)
             #     time.sleep(3)
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import time
+
+    from .kinematic_backend import Kinematic_Backend
+
+    # run_branches against one run per seed on the kinematic stand-in: a
+    # chain plus a different late action per seed, python -m scenario.scenario
+    def results_of(runner, groups) -> tuple[list[dict], float]:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = [result for seeds in groups for result in runner(seeds)]
+        return [result.to_basic_data() for result in results], time.perf_counter() - start
+
+    groups = [
+        [
+            Seed(8 * k + i, 3.0, 3.5, v_npc, 3, [(100, "acc"), (250, "dec"), (300 + 40 * i, action)])
+            for i in range(8)
+        ]
+        for k, (v_npc, action) in enumerate(
+            (v_npc, action) for v_npc in (10, 20, 30, 40) for action in ("acc", "dec", "lane")
+        )
+    ]
+    branched = Scenario(
+        None, None, "Town05", Path("/tmp/branch_check/branches"), Kinematic_Backend("Town05")
+    )
+    single = Scenario(
+        None, None, "Town05", Path("/tmp/branch_check/runs"), Kinematic_Backend("Town05")
+    )
+    branch_results, branch_seconds = results_of(branched.run_branches, groups)
+    run_results, run_seconds = results_of(lambda seeds: [single.run(seed) for seed in seeds], groups)
+    # sample times come from the frame count, a branch has to match its run exactly
+    same = sum(a == b for a, b in zip(branch_results, run_results))
+    seeds = sum(len(seeds) for seeds in groups)
+    print(
+        f"{seeds} seeds, {same} same results; ticks per seed {branched.simulated_ticks / seeds:.0f} "
+        f"branched, {single.simulated_ticks / seeds:.0f} one by one; "
+        f"{branch_seconds / seeds * 1000:.1f} ms against {run_seconds / seeds * 1000:.1f} ms per seed"
+    )
+
+    # early termination waits for the chain: the late action still runs and
+    # is in action_seq, the loss is the full round's
+    early = Scenario(
+        None, None, "Town05", Path("/tmp/branch_check/early"), Kinematic_Backend("Town05")
+    )
+    early.early_termination = True
+    late_seeds = [
+        Seed(k, 3.0, 3.5, v_npc, 2, [(100, "acc"), (1000, "dec")])
+        for k, v_npc in enumerate((10, 20, 30, 40))
+    ]
+    early_results, _ = results_of(lambda seeds: [early.run(seed) for seed in seeds], [late_seeds])
+    full_results, _ = results_of(lambda seeds: [single.run(seed) for seed in seeds], [late_seeds])
+    for early_result, full_result in zip(early_results, full_results):
+        assert early_result["action_seq"] == full_result["action_seq"]
+        assert early_result["loss"] == full_result["loss"]
+    print(
+        f"early termination: {sum(r['result'] == 'conflict passed' for r in early_results)} "
+        f"of {len(late_seeds)} late-action rounds cut short, same actions and loss"
+    )
+    branched.close()
+    single.close()
+    early.close()
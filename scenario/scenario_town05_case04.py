@@ -1,19 +1,25 @@
-import carla
 from pathlib import Path
+from typing import Optional
 import random
 
 from scenario import Scenario
+from .backend import Backend, carla
 from .seed import Seed
 from .utils import kmh_2_ms
 
 
 class Scenario_case04(Scenario):
-    def __init__(self, host, port, world_map, output_root_dir: Path):
-        Scenario.__init__(self, host, port, world_map, output_root_dir)
+    def __init__(
+        self,
+        host,
+        port,
+        world_map,
+        output_root_dir: Path,
+        backend: Optional[Backend] = None,
+    ):
+        Scenario.__init__(self, host, port, world_map, output_root_dir, backend)
 
     def set_npc_car(self, position=None, velocity=None):
-        self.npc_vehicle_bp = self.world.get_blueprint_library().find("vehicle.audi.tt")
-        self.npc_vehicle_bp.set_attribute("color", "240,240,240")
         # Town05
         npc_init_point = 277  # <-- spawn point #277: (x: -51.091713, y: -21.431129)
         self.npc_init_transform = carla.Transform(
@@ -29,7 +35,9 @@ class Scenario_case04(Scenario):
             self.p_npc = position
         self.npc_init_transform.location.y += self.p_npc
         # self.npc_init_transform.location.z = 1
-        self.npc = self.world.spawn_actor(self.npc_vehicle_bp, self.npc_init_transform)  # type: ignore
+        self.npc = self.spawn_vehicle(
+            "npc", "vehicle.audi.tt", self.npc_init_transform, {"color": "240,240,240"}
+        )
 
         if velocity is None:
             self.v_npc = random.randint(0, 80)
@@ -40,17 +48,11 @@ class Scenario_case04(Scenario):
             0,
             0,
         )
-        self.npc.enable_constant_velocity(self.npc_init_velocity)
-
-        self.traffic_manager.random_left_lanechange_percentage(self.npc, 0)
-        self.traffic_manager.update_vehicle_lights(self.npc, True)
-        self.traffic_manager.random_right_lanechange_percentage(self.npc, 0)
-        self.traffic_manager.ignore_lights_percentage(self.npc, 100)
-        self.traffic_manager.ignore_signs_percentage(self.npc, 100)
+        self.commands.enable_constant_velocity(self.npc, self.npc_init_velocity)
 
     def set_npc_car_route(self):
         self.npc_route = [self.spawn_points[i].location for i in [204, 243]]
-        self.traffic_manager.set_path(self.npc, self.npc_route)  # type: ignore
+        self.commands.set_path(self.npc, self.npc_route)
 
 
 _HOST = "localhost"
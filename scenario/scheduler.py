@@ -0,0 +1,295 @@
+from dataclasses import dataclass
+import heapq
+import math
+from typing import Literal, Optional, Sequence, Union
+
+from .seed import Seed, Seed_Table
+
+SchedulerPolicy = Literal["energy", "sorted"]
+
+
+@dataclass
+class Chain_State:
+    # a mutation chain: its best seed so far and how it has been doing
+    seed_no: int
+    last_seed: Seed
+    fuzzing_round: int = 0
+    improvements: int = 0  # <-- rounds that lowered the chain's loss
+    stale_rounds: int = 0  # <-- rounds since the last improvement
+    turn_left: int = 0  # <-- rounds left in the turn being simulated
+
+    def to_basic_data(self):
+        return {
+            "seed_no": self.seed_no,
+            "last_seed": self.last_seed.to_basic_data(),
+            "fuzzing_round": self.fuzzing_round,
+            "improvements": self.improvements,
+            "stale_rounds": self.stale_rounds,
+            "turn_left": self.turn_left,
+        }
+
+    @classmethod
+    def recover_from_basic_data(cls, data: dict) -> "Chain_State":
+        return cls(
+            seed_no=data["seed_no"],
+            last_seed=Seed.recover_from_basic_data(data["last_seed"]),
+            fuzzing_round=data["fuzzing_round"],
+            improvements=data["improvements"],
+            stale_rounds=data["stale_rounds"],
+            turn_left=data["turn_left"],
+        )
+
+
+class Seed_Scheduler:
+    # chains wait in a heap ordered by energy and get turns of 1 to
+    # max_turn_rounds rounds, so the search moves between seeds instead of
+    # spending max_rounds on each in a fixed order. Energy is the product of
+    #   improvement rate: (improvements + 1) / (fuzzing_round + 1)
+    #   closeness:        1 / (1 + loss), loss is the conflict point time gap
+    #   novelty:          distance of (p_ego, p_npc, v_npc), scaled by
+    #                     param_ranges, to the nearest collision found so far
+    # A chain retires on collision, after max_rounds, or after patience
+    # rounds without improvement.
+    # The "sorted" policy is the fixed loop: chains in the order they were
+    # added, each run in one turn until it collides or reaches max_rounds.
+    # The initial seeds (add_initial) are keyed from their parameters and
+    # loss only, a chain's Seed is taken from the list on its first turn
+    def __init__(
+        self,
+        param_ranges: list[tuple[float, float]],
+        max_rounds: int = 50,
+        patience: int = 10,
+        max_turn_rounds: int = 5,
+        novelty_radius: float = 0.1,
+        policy: SchedulerPolicy = "energy",
+    ):
+        self.policy = policy
+        self.param_ranges = param_ranges
+        self.max_rounds = max_rounds
+        self.patience = patience
+        self.max_turn_rounds = max_turn_rounds
+        self.novelty_radius = novelty_radius
+        self.heap: list[tuple[float, int, int]] = []  # <-- (priority, push order, seed_no)
+        self.pushes = 0
+        self.chains: dict[int, Chain_State] = {}  # <-- running, and waiting after a first turn
+        self.running: set[int] = set()
+        self.retired: list[int] = []
+        self.collisions: list[tuple[float, ...]] = []
+        self.initial_seeds: Sequence[Seed] = []
+        self.initial_params: list[tuple[float, ...]] = []  # <-- scaled, by seed_no
+        self.initial_time_gaps: list[float] = []
+
+    def scaled_params(self, seed: Seed) -> tuple[float, ...]:
+        return self.scale((seed.p_ego, seed.p_npc, seed.v_npc))  # type: ignore
+
+    def scale(self, values: tuple[float, ...]) -> tuple[float, ...]:
+        return tuple(
+            (value - low) / (high - low)
+            for value, (low, high) in zip(values, self.param_ranges)
+        )
+
+    def novelty(self, seed: Seed) -> float:
+        return self.params_novelty(self.scaled_params(seed))
+
+    def params_novelty(self, params: tuple[float, ...]) -> float:
+        if len(self.collisions) == 0:
+            return 1.0
+        nearest = min(math.dist(params, collision) for collision in self.collisions)
+        return 0.1 + 0.9 * min(1.0, nearest / self.novelty_radius)
+
+    def energy(self, chain: Chain_State) -> float:
+        assert chain.last_seed.round_result is not None
+        rate = (chain.improvements + 1) / (chain.fuzzing_round + 1)
+        closeness = 1 / (1 + chain.last_seed.round_result.loss.time_gap)
+        return rate * closeness * self.novelty(chain.last_seed)
+
+    def priority(self, chain: Chain_State) -> float:
+        # heap key, lowest first
+        if self.policy == "sorted":
+            return chain.seed_no
+        return -self.energy(chain)
+
+    def waiting_priority(self, seed_no: int) -> float:
+        chain = self.chains.get(seed_no)
+        if chain is not None:
+            return self.priority(chain)
+        # an initial seed that never had a turn: improvement rate 1
+        if self.policy == "sorted":
+            return seed_no
+        closeness = 1 / (1 + self.initial_time_gaps[seed_no])
+        return -(closeness * self.params_novelty(self.initial_params[seed_no]))
+
+    def turn_rounds(self, chain: Chain_State) -> int:
+        if self.policy == "sorted":
+            return self.max_rounds - chain.fuzzing_round
+        return 1 + int(self.energy(chain) * (self.max_turn_rounds - 1))
+
+    def add(self, chain: Chain_State):
+        self.chains[chain.seed_no] = chain
+        self.push(chain)
+
+    def add_initial(self, seed_list: Union[Seed_Table, Sequence[Seed]]):
+        # one chain per seed, seed_no is the index in seed_list. A Seed_Table
+        # is keyed from its columns, no Seed is built until the chain's turn
+        self.set_initial_seeds(seed_list)
+        for seed_no in range(len(seed_list)):
+            heapq.heappush(self.heap, (self.waiting_priority(seed_no), self.pushes, seed_no))
+            self.pushes += 1
+
+    def set_initial_seeds(self, seed_list: Union[Seed_Table, Sequence[Seed]]):
+        self.initial_seeds = seed_list
+        if isinstance(seed_list, Seed_Table):
+            p_ego, p_npc, v_npc, time_gaps = (
+                seed_list.column(name).tolist()
+                for name in ("p_ego", "p_npc", "v_npc", "loss_time_gap")
+            )
+            rows = zip(p_ego, p_npc, v_npc)
+        else:
+            rows = ((seed.p_ego, seed.p_npc, seed.v_npc) for seed in seed_list)
+            time_gaps = [seed.round_result.loss.time_gap for seed in seed_list]  # type: ignore
+        self.initial_params = [self.scale(values) for values in rows]
+        self.initial_time_gaps = time_gaps
+
+    def push(self, chain: Chain_State):
+        heapq.heappush(self.heap, (self.priority(chain), self.pushes, chain.seed_no))
+        self.pushes += 1
+
+    def pop(self) -> Optional[Chain_State]:
+        if len(self.heap) == 0:
+            return None
+        _, _, seed_no = heapq.heappop(self.heap)
+        chain = self.chains.get(seed_no)
+        if chain is None:
+            chain = Chain_State(seed_no, self.initial_seeds[seed_no])
+            self.chains[seed_no] = chain
+        chain.turn_left = self.turn_rounds(chain)
+        self.running.add(seed_no)
+        return chain
+
+    def record_collision(self, seed: Seed):
+        # novelty depends on the collisions: the waiting chains are re-keyed,
+        # their push order still breaks ties
+        self.collisions.append(self.scaled_params(seed))
+        if self.policy == "energy":
+            self.heap = [
+                (self.waiting_priority(seed_no), pushed, seed_no)
+                for _, pushed, seed_no in self.heap
+            ]
+            heapq.heapify(self.heap)
+
+    def release(self, chain: Chain_State, collided: bool) -> bool:
+        # end of a turn: back into the heap, or retired. True if retired
+        self.running.discard(chain.seed_no)
+        chain.turn_left = 0
+        if (
+            collided
+            or chain.fuzzing_round >= self.max_rounds
+            or (self.policy == "energy" and chain.stale_rounds >= self.patience)
+        ):
+            del self.chains[chain.seed_no]
+            self.retired.append(chain.seed_no)
+            return True
+        self.push(chain)
+        return False
+
+    def untouched(self) -> list[int]:
+        # seed_no of the waiting chains that never had a turn
+        return [
+            seed_no
+            for _, _, seed_no in self.heap
+            if seed_no not in self.chains or self.chains[seed_no].fuzzing_round == 0
+        ]
+
+    def to_basic_data(self):
+        # chains that never had a turn are left out, recover takes them
+        # from the initial seed list
+        return {
+            "heap": self.heap,
+            "pushes": self.pushes,
+            "chains": [
+                chain.to_basic_data()
+                for chain in self.chains.values()
+                if chain.fuzzing_round > 0 or chain.seed_no in self.running
+            ],
+            "running": sorted(self.running),
+            "retired": self.retired,
+            "collisions": self.collisions,
+        }
+
+    def recover_from_basic_data(self, data: dict, seed_list: Union[Seed_Table, Sequence[Seed]]):
+        self.set_initial_seeds(seed_list)
+        self.heap = [tuple(entry) for entry in data["heap"]]  # type: ignore
+        self.pushes = data["pushes"]
+        self.chains = {}
+        for chain_data in data["chains"]:
+            chain = Chain_State.recover_from_basic_data(chain_data)
+            self.chains[chain.seed_no] = chain
+        self.running = set(data["running"])
+        self.retired = data["retired"]
+        self.collisions = [tuple(collision) for collision in data["collisions"]]
+
+
+if __name__ == "__main__":
+    import io
+
+    from .loss import Loss
+    from .seed import Round_Result, load_seeds, save_seeds
+
+    def simulated(seed: Seed, loss: float) -> Seed:
+        # distance ranks the chains the other way round, energy must use the time gap
+        seed.round_result = Round_Result(result="arrive", loss=Loss(time_gap=loss, distance=3.5 - loss))
+        return seed
+
+    scheduler = Seed_Scheduler([(0, 10), (0, 10), (0, 60)], max_rounds=4, patience=2)
+    seeds = [simulated(Seed(i, i, 5, 30), loss) for i, loss in enumerate([3.0, 0.5, 1.0])]
+    for i, seed in enumerate(seeds):
+        scheduler.add(Chain_State(i, seed))
+    chain = scheduler.pop()
+    assert chain is not None and chain.seed_no == 1  # <-- lowest time gap first
+
+    chain.fuzzing_round += 2
+    chain.stale_rounds += 2  # <-- no improvement in two rounds
+    assert scheduler.release(chain, collided=False)
+
+    state = scheduler.to_basic_data()
+    recovered = Seed_Scheduler([(0, 10), (0, 10), (0, 60)], max_rounds=4, patience=2)
+    recovered.recover_from_basic_data(state, seeds)
+    assert recovered.heap == scheduler.heap and recovered.retired == [1]
+
+    chain = scheduler.pop()
+    assert chain is not None and chain.seed_no == 2
+    scheduler.record_collision(simulated(Seed(9, 2, 5, 30), 0.0))
+    scheduler.release(chain, collided=True)
+    assert scheduler.novelty(seeds[0]) > scheduler.novelty(seeds[2])
+
+    # a collision next to the best waiting chain moves it down the heap
+    rekeyed = Seed_Scheduler([(0, 10), (0, 10), (0, 60)], max_rounds=4, patience=2)
+    for i, seed in enumerate(seeds):
+        rekeyed.add(Chain_State(i, seed))
+    rekeyed.record_collision(simulated(Seed(9, 1, 5, 30), 0.0))
+    chain = rekeyed.pop()
+    assert chain is not None and chain.seed_no == 2
+
+    # initial seeds from a table are keyed from its columns, each Seed is built on its turn
+    table = io.BytesIO()
+    save_seeds(table, seeds)
+    table.seek(0)
+    lazy = Seed_Scheduler([(0, 10), (0, 10), (0, 60)], max_rounds=4, patience=2)
+    lazy.add_initial(load_seeds(table))
+    eager = Seed_Scheduler([(0, 10), (0, 10), (0, 60)], max_rounds=4, patience=2)
+    for i, seed in enumerate(seeds):
+        eager.add(Chain_State(i, seed))
+    assert lazy.heap == eager.heap and len(lazy.chains) == 0
+    lazy.record_collision(simulated(Seed(9, 1, 5, 30), 0.0))
+    eager.record_collision(simulated(Seed(9, 1, 5, 30), 0.0))
+    assert lazy.heap == eager.heap and lazy.untouched() == eager.untouched()
+    chain = lazy.pop()
+    assert chain is not None and chain.seed_no == 2 and chain.last_seed.p_ego == 2
+    assert sum(seed is not None for seed in lazy.initial_seeds.cache) == 1  # type: ignore
+
+    fixed = Seed_Scheduler([(0, 10), (0, 10), (0, 60)], max_rounds=4, policy="sorted")
+    for i, seed in enumerate(seeds):
+        fixed.add(Chain_State(i, seed))
+    chain = fixed.pop()
+    assert chain is not None and chain.seed_no == 0 and chain.turn_left == 4
+    print(f"ok, retired {scheduler.retired}, waiting {[entry[2] for entry in scheduler.heap]}")
@@ -1,11 +1,15 @@
 from dataclasses import dataclass, field
 import math
-from typing import Literal, Optional
+from typing import Iterator, Literal, Optional, Union, overload
+
+import numpy as np
 
 from .loss import Loss
 from .conflict_point import Conflict_Point
 
-ResultType = Literal["Error", "arrive", "collision, hit NPC", "timeout"]
+ResultType = Literal[
+    "Error", "arrive", "collision, hit NPC", "timeout", "conflict passed"
+]
 
 
 @dataclass
@@ -42,6 +46,20 @@ class Round_Result:
             else None,
         }
 
+    @classmethod
+    def recover_from_basic_data(cls, data: dict) -> "Round_Result":
+        return cls(
+            result=data["result"],
+            loss=Loss.recover_from_basic_data(data["loss"]),
+            min_distance=tuple(data.get("min_distance", (-1, math.inf))),  # type: ignore
+            action_seq=[tuple(x) for x in data["action_seq"]],  # type: ignore
+            conflict_point=Conflict_Point.recover_from_basic_data(
+                data["conflict_point"]
+            )
+            if data["conflict_point"] is not None
+            else None,
+        )
+
     def __str__(self):
         round_result_str = ""
         action_seq_str = ""
@@ -149,8 +167,19 @@ class Seed:
             else None,
         }
     
-    def recover_from_basic_data(self):
-        ...
+    @classmethod
+    def recover_from_basic_data(cls, data: dict) -> "Seed":
+        return cls(
+            round_num=data["round_num"],
+            p_ego=data["p_ego"],
+            p_npc=data["p_npc"],
+            v_npc=data["v_npc"],
+            action_capability=data["action_cap"],
+            action_chain=[tuple(x) for x in data["action_chain"]],  # type: ignore
+            round_result=Round_Result.recover_from_basic_data(data["round_result"])
+            if data["round_result"] is not None
+            else None,
+        )
 
     def __str__(self):
         action_chain_str = ""
@@ -174,9 +203,242 @@ class Seed:
         )
 
 
+# binary seed table: one structured row per seed, the action chains and
+# action seqs as flat arrays sliced by offsets, every string as an index
+# into "names". Written by save_seeds as an uncompressed .npz
+SEED_TABLE_VERSION = 1
+
+_SEED_ROW_DTYPE = np.dtype(
+    [
+        ("round_num", "<i8"),
+        ("p_ego", "<f8"),  # <-- nan for None
+        ("p_npc", "<f8"),
+        ("v_npc", "<f8"),
+        ("action_cap", "<i8"),
+        ("result", "<i4"),  # <-- -1 for no round_result
+        ("loss_time_gap", "<f8"),
+        ("loss_distance", "<f8"),
+        ("loss_mode", "<i4"),
+        ("min_distance_tick", "<i8"),
+        ("min_distance", "<f8"),
+        ("cp_ego_pass_tick", "<i8"),  # <-- cp_* unused when cp_loss_mode is -1
+        ("cp_obj_pass_tick", "<i8"),
+        ("cp_loss_time_gap", "<f8"),
+        ("cp_loss_distance", "<f8"),
+        ("cp_loss_mode", "<i4"),
+    ]
+)
+
+
+def _optional_float(value) -> float:
+    return math.nan if value is None else value
+
+
+def seed_table_arrays(seeds: list[Seed]) -> dict[str, np.ndarray]:
+    names: dict[str, int] = {}
+
+    def code(name: str) -> int:
+        return names.setdefault(name, len(names))
+
+    rows = []
+    chain_offsets, chain_tick, chain_action = [0], [], []
+    seq_offsets, seq_tick, seq_action, seq_duration = [0], [], [], []
+    for seed in seeds:
+        for tick, action in seed.action_chain:
+            chain_tick.append(tick)
+            chain_action.append(code(action))
+        chain_offsets.append(len(chain_tick))
+        row = [
+            seed.round_num,
+            _optional_float(seed.p_ego),
+            _optional_float(seed.p_npc),
+            _optional_float(seed.v_npc),
+            seed.action_capability,
+        ]
+        result = seed.round_result
+        if result is None:
+            row += [-1, math.nan, math.nan, -1, -1, math.nan]
+        else:
+            loss = result.loss.to_basic_data()
+            row += [
+                code(result.result),
+                loss["time_gap"],
+                loss["distance"],
+                code(loss["mode"]),
+                result.min_distance[0],
+                result.min_distance[1],
+            ]
+            for tick, action, duration in result.action_seq:
+                seq_tick.append(tick)
+                seq_action.append(code(action))
+                seq_duration.append(duration)
+        seq_offsets.append(len(seq_tick))
+        if result is None or result.conflict_point is None:
+            row += [-1, -1, math.nan, math.nan, -1]
+        else:
+            cp = result.conflict_point.to_basic_data()
+            row += [
+                cp["ego_pass_tick"],
+                cp["obj_pass_tick"],
+                cp["loss"]["time_gap"],
+                cp["loss"]["distance"],
+                code(cp["loss"]["mode"]),
+            ]
+        rows.append(tuple(row))
+    return {
+        "version": np.array(SEED_TABLE_VERSION),
+        "names": np.array(list(names), dtype=str),
+        "seeds": np.array(rows, dtype=_SEED_ROW_DTYPE),
+        "chain_offsets": np.array(chain_offsets, dtype="<i8"),
+        "chain_tick": np.array(chain_tick, dtype="<i8"),
+        "chain_action": np.array(chain_action, dtype="<i4"),
+        "seq_offsets": np.array(seq_offsets, dtype="<i8"),
+        "seq_tick": np.array(seq_tick, dtype="<i8"),
+        "seq_action": np.array(seq_action, dtype="<i4"),
+        "seq_duration": np.array(seq_duration, dtype="<i8"),
+    }
+
+
+def save_seeds(file, seeds: list[Seed]):
+    # file is a path or a binary file object
+    np.savez(file, **seed_table_arrays(seeds))
+
+
+class Seed_Table:
+    # seeds as stored by save_seeds, a Seed is only built when it is indexed.
+    # Whole columns (e.g. table.column("loss_distance")) are plain arrays
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        version = int(arrays["version"])
+        if version > SEED_TABLE_VERSION:
+            raise ValueError(f"seed table version {version} is newer than {SEED_TABLE_VERSION}")
+        self.names: list[str] = arrays["names"].tolist()
+        self.rows = arrays["seeds"]
+        self.chain_offsets = arrays["chain_offsets"].tolist()
+        self.chain_tick = arrays["chain_tick"].tolist()
+        self.chain_action = arrays["chain_action"].tolist()
+        self.seq_offsets = arrays["seq_offsets"].tolist()
+        self.seq_tick = arrays["seq_tick"].tolist()
+        self.seq_action = arrays["seq_action"].tolist()
+        self.seq_duration = arrays["seq_duration"].tolist()
+        self.cache: list[Optional[Seed]] = [None] * len(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @overload
+    def __getitem__(self, index: int) -> Seed: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Seed]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Seed, list[Seed]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        seed = self.cache[index]
+        if seed is None:
+            seed = Seed.recover_from_basic_data(self.basic_data(index))
+            self.cache[index] = seed
+        return seed
+
+    def __iter__(self) -> Iterator[Seed]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name: str) -> np.ndarray:
+        return self.rows[name]
+
+    def basic_data(self, index: int) -> dict:
+        # same layout as Seed.to_basic_data
+        (
+            round_num, p_ego, p_npc, v_npc, action_cap,
+            result, loss_time_gap, loss_distance, loss_mode,
+            min_distance_tick, min_distance,
+            cp_ego_pass_tick, cp_obj_pass_tick, cp_loss_time_gap, cp_loss_distance, cp_loss_mode,
+        ) = self.rows[index].tolist()
+        names = self.names
+        chain = range(self.chain_offsets[index], self.chain_offsets[index + 1])
+        seq = range(self.seq_offsets[index], self.seq_offsets[index + 1])
+        round_result = None
+        if result >= 0:
+            conflict_point = None
+            if cp_loss_mode >= 0:
+                conflict_point = {
+                    "ego_pass_tick": cp_ego_pass_tick,
+                    "obj_pass_tick": cp_obj_pass_tick,
+                    "loss": {
+                        "time_gap": cp_loss_time_gap,
+                        "distance": cp_loss_distance,
+                        "mode": names[cp_loss_mode],
+                    },
+                }
+            round_result = {
+                "result": names[result],
+                "loss": {
+                    "time_gap": loss_time_gap,
+                    "distance": loss_distance,
+                    "mode": names[loss_mode],
+                },
+                "min_distance": (min_distance_tick, min_distance),
+                "action_seq": [
+                    (self.seq_tick[i], names[self.seq_action[i]], self.seq_duration[i])
+                    for i in seq
+                ],
+                "conflict_point": conflict_point,
+            }
+        return {
+            "round_num": round_num,
+            "p_ego": None if math.isnan(p_ego) else p_ego,
+            "p_npc": None if math.isnan(p_npc) else p_npc,
+            "v_npc": None if math.isnan(v_npc) else v_npc,
+            "action_cap": action_cap,
+            "action_chain": [(self.chain_tick[i], names[self.chain_action[i]]) for i in chain],
+            "round_result": round_result,
+        }
+
+
+def load_seeds(file) -> Seed_Table:
+    with np.load(file) as data:
+        return Seed_Table({name: data[name] for name in data.files})
+
+
 if __name__ == "__main__":
+    import io
+    import random
+    import time
+
+    from .conflict_point import Conflict_Point
+
     seed = Seed(0, 0, 0, 20, 2, [(200, "acc"), (250, "dec")])
     print(seed.to_basic_data())
+    assert Seed.recover_from_basic_data(seed.to_basic_data()).to_basic_data() == seed.to_basic_data()
+
+    seeds = [Seed(-1), seed]
+    for i in range(10000):
+        seed = Seed(
+            i, random.random(), random.random(), random.uniform(0, 60), 5,
+            [(random.randint(0, 80) * 10, random.choice(["acc", "dec", "lane"])) for _ in range(5)],
+        )
+        seed.round_result = Round_Result(
+            result=random.choice(["arrive", "collision, hit NPC", "timeout"]),
+            loss=Loss(time_gap=random.random(), distance=random.random()),
+            min_distance=(random.randint(0, 800), random.random() * 10),
+            action_seq=[(tick, action, 10) for tick, action in seed.action_chain],
+            conflict_point=Conflict_Point(500, 510, Loss(random.random(), math.inf))
+            if i % 2 == 0
+            else None,
+        )
+        seeds.append(seed)
+    file = io.BytesIO()
+    save_seeds(file, seeds)
+    file.seek(0)
+    start = time.perf_counter()
+    table = load_seeds(file)
+    recovered = list(table)
+    elapsed = time.perf_counter() - start
+    assert [x.to_basic_data() for x in recovered] == [x.to_basic_data() for x in seeds]
+    print(f"ok, {len(table)} seeds, {len(file.getvalue()) / 1e6:.1f} MB, loaded in {elapsed * 1000:.0f} ms")
     # result = Round_Result(action_seq=[(1, "aaa", 20)])
     # print(result.to_basic_data())
     # result = Round_Result()
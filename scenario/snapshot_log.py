@@ -0,0 +1,167 @@
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from .artifact_writer import Artifact_Writer
+
+SNAPSHOT_LOG_FORMATS = ("csv", "npy")
+
+# snapshot_record columns, in the order of the csv layout
+_FRAME_COLUMNS = ["frame", "time", "tick_num"]
+_STATE_COLUMNS = [
+    "ego_x", "ego_y", "ego_z",
+    "npc_x", "npc_y", "npc_z",
+    "ego_v_x", "ego_v_y",
+    "ego_a_x", "ego_a_y",
+    "ego_throttle", "ego_brake", "ego_steer", "ego_gear",
+    "npc_v_x", "npc_v_y",
+    "npc_a_x", "npc_a_y",
+    "npc_throttle", "npc_brake", "npc_steer", "npc_gear",
+]
+SNAPSHOT_COLUMNS = _FRAME_COLUMNS + _STATE_COLUMNS
+_CSV_HEADER = ", ".join(SNAPSHOT_COLUMNS) + " \n"
+
+_CHUNK_ROWS = 1024
+
+
+def _open(path: Path, mode: str, writer: Optional[Artifact_Writer]):
+    if writer is None:
+        return open(path, mode)
+    return writer.open(path, mode)
+
+
+def snapshot_dtype(value_dtype="float32") -> np.dtype:
+    # values are stored in the simulator's own precision: CARLA hands out
+    # C floats, so float32 keeps them exactly
+    fields = [("frame", "<i8"), ("time", "<f8"), ("tick_num", "<i8")]
+    for column in _STATE_COLUMNS:
+        if column.endswith("_gear"):
+            fields.append((column, "<i4"))
+        else:
+            fields.append((column, value_dtype))
+    return np.dtype(fields)
+
+
+class Csv_Snapshot_Log:
+    def __init__(
+        self, path: Path, writer: Optional[Artifact_Writer] = None, chunk_rows=_CHUNK_ROWS
+    ):
+        self.path = path
+        self.file = _open(path, "w", writer)
+        self.lines = [_CSV_HEADER]
+        self.chunk_rows = chunk_rows
+
+    def write(self, row: tuple):
+        self.lines.append(", ".join(map(str, row)) + " \n")
+        if len(self.lines) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if len(self.lines) > 0:
+            self.file.writelines("".join(self.lines))
+            self.lines = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Npy_Snapshot_Log:
+    # rows are buffered in a typed array and written as a stream of .npy
+    # chunks, one np.save per _CHUNK_ROWS rows and one for the rest at close
+    def __init__(
+        self,
+        path: Path,
+        value_dtype="float32",
+        writer: Optional[Artifact_Writer] = None,
+        chunk_rows=_CHUNK_ROWS,
+    ):
+        self.path = path
+        self.file = _open(path, "wb", writer)
+        self.buffer = np.empty(chunk_rows, dtype=snapshot_dtype(value_dtype))
+        self.size = 0
+
+    def write(self, row: tuple):
+        self.buffer[self.size] = row
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.size > 0:
+            np.save(self.file, self.buffer[: self.size])
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Snapshot_Buffer:
+    # rows kept in memory and copied into logs later: the ticks
+    # Scenario.run_branches simulates once go into the log of every seed
+    # that shares them
+    def __init__(self):
+        self.rows: list[tuple] = []
+
+    def write(self, row: tuple):
+        self.rows.append(row)
+
+    def truncate(self, size: int):
+        del self.rows[size:]
+
+    def copy_to(self, log: Union[Csv_Snapshot_Log, Npy_Snapshot_Log]):
+        for row in self.rows:
+            log.write(row)
+
+    def close(self):
+        pass
+
+
+def open_snapshot_log(
+    output_dir: Path,
+    snapshot_log_format="npy",
+    value_dtype="float32",
+    writer: Optional[Artifact_Writer] = None,
+) -> Union[Csv_Snapshot_Log, Npy_Snapshot_Log]:
+    # with a writer, chunks are handed to its thread instead of written here
+    if snapshot_log_format == "csv":
+        return Csv_Snapshot_Log(Path(output_dir) / "snapshot_record.csv", writer)
+    if snapshot_log_format == "npy":
+        return Npy_Snapshot_Log(
+            Path(output_dir) / "snapshot_record.npy", value_dtype, writer
+        )
+    raise ValueError(f"unknown snapshot log format: {snapshot_log_format}")
+
+
+def read_snapshot_log(path) -> np.ndarray:
+    chunks = []
+    with open(path, "rb") as f:
+        size = Path(path).stat().st_size
+        while f.tell() < size:
+            chunks.append(np.load(f))
+        f.close()
+    if len(chunks) == 0:
+        return np.empty(0, dtype=snapshot_dtype())
+    return np.concatenate(chunks)
+
+
+def snapshot_log_to_csv(npy_path, csv_path=None) -> Path:
+    # same layout and number formatting as Csv_Snapshot_Log
+    npy_path = Path(npy_path)
+    if csv_path is None:
+        csv_path = npy_path.with_suffix(".csv")
+    log = Csv_Snapshot_Log(Path(csv_path))
+    for row in read_snapshot_log(npy_path).tolist():
+        log.write(row)
+    log.close()
+    return Path(csv_path)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m scenario.snapshot_log result/round_*/snapshot_record.npy
+    for npy_path in sys.argv[1:]:
+        print(snapshot_log_to_csv(npy_path))
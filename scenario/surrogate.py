@@ -0,0 +1,183 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from .seed import Seed
+
+_ACTIONS = ("acc", "dec", "lane")
+_MAX_TICK = 3000  # <-- _MAX_RUNTIME of a round in ticks
+_MAX_ACTION_COUNT = 5
+_COLLISION = "collision, hit NPC"
+
+
+def seed_features(seeds: list[Seed], param_ranges: list[tuple[float, float]]) -> np.ndarray:
+    # one row per seed: (p_ego, p_npc, v_npc) scaled to [0, 1], then per action
+    # type its count and its first tick, scaled (1 when it is not in the chain)
+    features = np.ones((len(seeds), 3 + 2 * len(_ACTIONS)))
+    low = np.array([low for low, _ in param_ranges], dtype=float)
+    high = np.array([high for _, high in param_ranges], dtype=float)
+    features[:, :3] = (
+        np.array([[seed.p_ego, seed.p_npc, seed.v_npc] for seed in seeds], dtype=float) - low
+    ) / (high - low)
+    for i, seed in enumerate(seeds):
+        counts = [0] * len(_ACTIONS)
+        for tick, action in seed.action_chain:
+            if action not in _ACTIONS:
+                continue
+            k = _ACTIONS.index(action)
+            counts[k] += 1
+            first = 3 + 2 * k + 1
+            features[i, first] = min(features[i, first], tick / _MAX_TICK)
+        for k, count in enumerate(counts):
+            features[i, 3 + 2 * k] = min(count, _MAX_ACTION_COUNT) / _MAX_ACTION_COUNT
+    return features
+
+
+def seed_target(seed: Seed, target_cap: float) -> float:
+    # conflict time gap of the round, 0 for a collision, capped (no conflict is inf)
+    assert seed.round_result is not None
+    if seed.round_result.result == _COLLISION:
+        return 0.0
+    return min(seed.round_result.loss.time_gap, target_cap)
+
+
+class Surrogate:
+    # online model of a seed's conflict time gap: Bayesian linear regression
+    # on random Fourier features (an approximate Gaussian process with an RBF
+    # kernel of length_scale, on the features of seed_features). The
+    # posterior is kept as weights and covariance, fit solves it for a batch
+    # (the result journal at start-up) and update adds one round in
+    # O(features^2), recursive least squares.
+    # rank orders candidates by a lower confidence bound, mean - kappa * std:
+    # low predicted time gap, or uncertain
+    def __init__(
+        self,
+        param_ranges: list[tuple[float, float]],
+        features: int = 256,
+        length_scale: float = 0.3,
+        noise: float = 0.3,
+        prior: float = 1.0,
+        kappa: float = 1.0,
+        target_cap: float = 10.0,
+        random_seed: int = 0,
+    ):
+        self.param_ranges = param_ranges
+        self.noise = noise
+        self.prior = prior
+        self.kappa = kappa
+        self.target_cap = target_cap
+        rng = np.random.default_rng(random_seed)  # <-- fixed, a resumed campaign refits the same features
+        dim = 3 + 2 * len(_ACTIONS)
+        self.omega = rng.normal(0.0, 1.0 / length_scale, size=(dim, features))
+        self.phase = rng.uniform(0.0, 2 * math.pi, size=features)
+        self.scale = math.sqrt(2.0 / features)
+        self.reset()
+
+    def reset(self):
+        size = len(self.phase) + 1
+        self.weights = np.zeros(size)
+        self.covariance = np.eye(size) * self.prior
+        self.samples = 0
+
+    def basis(self, seeds: list[Seed]) -> np.ndarray:
+        # random Fourier features and a constant
+        x = seed_features(seeds, self.param_ranges)
+        phi = np.empty((len(seeds), len(self.phase) + 1))
+        phi[:, :-1] = self.scale * np.cos(x @ self.omega + self.phase)
+        phi[:, -1] = 1.0
+        return phi
+
+    def fit(self, seeds: list[Seed]):
+        # posterior from the prior and all seeds, same as update on each
+        self.reset()
+        if len(seeds) == 0:
+            return
+        phi = self.basis(seeds)
+        y = np.array([seed_target(seed, self.target_cap) for seed in seeds])
+        precision = phi.T @ phi / self.noise**2 + np.eye(phi.shape[1]) / self.prior
+        self.covariance = np.linalg.inv(precision)
+        self.weights = self.covariance @ (phi.T @ y) / self.noise**2
+        self.samples = len(seeds)
+
+    def update(self, seed: Seed):
+        phi = self.basis([seed])[0]
+        y = seed_target(seed, self.target_cap)
+        projected = self.covariance @ phi
+        gain = projected / (self.noise**2 + phi @ projected)
+        self.weights += gain * (y - phi @ self.weights)
+        self.covariance -= np.outer(gain, projected)
+        self.samples += 1
+
+    def predict(self, seeds: list[Seed]) -> tuple[np.ndarray, np.ndarray]:
+        # mean and standard deviation of the time gap
+        phi = self.basis(seeds)
+        mean = phi @ self.weights
+        variance = self.noise**2 + ((phi @ self.covariance) * phi).sum(axis=1)
+        return mean, np.sqrt(np.maximum(variance, 0.0))
+
+    def acquisition(self, seeds: list[Seed]) -> np.ndarray:
+        # lower is better
+        mean, std = self.predict(seeds)
+        return mean - self.kappa * std
+
+    def rank(self, seeds: list[Seed], k: Optional[int] = None) -> list[Seed]:
+        # the k best candidates, best first
+        order = np.argsort(self.acquisition(seeds), kind="stable")
+        return [seeds[i] for i in order[:k]]
+
+
+if __name__ == "__main__":
+    import time
+
+    from .loss import Loss
+    from .seed import Round_Result
+
+    # a known time gap landscape: the model is fit on samples of it, then
+    # ranks fresh candidates
+    rng = np.random.default_rng(1)
+    ranges = [(0, 10), (0, 10), (0, 60)]
+
+    def simulated(seed: Seed) -> Seed:
+        time_gap = abs(seed.v_npc - 20 - 2 * seed.p_npc) / 8 + 0.2 * seed.p_ego  # type: ignore
+        for tick, action in seed.action_chain:
+            time_gap += {"acc": -0.3, "dec": 0.3, "lane": 0.0}[action] * (1 - tick / 1000)
+        seed.round_result = Round_Result("arrive", Loss(time_gap=max(time_gap, 0), distance=0.5))
+        return seed
+
+    def random_seed(i: int) -> Seed:
+        chain = [
+            (int(rng.integers(0, 100)) * 10, str(rng.choice(_ACTIONS)))
+            for _ in range(int(rng.integers(0, 4)))
+        ]
+        return Seed(i, *rng.uniform([0, 0, 0], [10, 10, 60]), len(chain), chain)
+
+    train = [simulated(random_seed(i)) for i in range(2000)]
+    surrogate = Surrogate(ranges)
+    start = time.perf_counter()
+    surrogate.fit(train[:1000])
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for seed in train[1000:]:
+        surrogate.update(seed)
+    update_seconds = (time.perf_counter() - start) / 1000
+    batch = Surrogate(ranges)
+    batch.fit(train)
+    assert np.allclose(batch.weights, surrogate.weights, atol=1e-6)
+
+    candidates = [random_seed(10000 + i) for i in range(64)]
+    start = time.perf_counter()
+    chosen = surrogate.rank(candidates, 8)
+    rank_seconds = time.perf_counter() - start
+    truth = [seed_target(simulated(seed), surrogate.target_cap) for seed in candidates]
+    mean, _ = surrogate.predict(candidates)
+    chosen_truth = [seed_target(simulated(seed), surrogate.target_cap) for seed in chosen]
+    print(
+        f"fit 1000 in {fit_seconds * 1000:.1f} ms, update {update_seconds * 1000:.3f} ms, "
+        f"rank 64 in {rank_seconds * 1000:.2f} ms, "
+        f"mean abs error {np.mean(np.abs(mean - truth)):.3f} s"
+    )
+    print(
+        f"top 8 by acquisition: mean time gap {np.mean(chosen_truth):.2f} s, "
+        f"all candidates {np.mean(truth):.2f} s"
+    )
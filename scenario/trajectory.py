@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class Trajectory:
+    data: np.ndarray
+    size: int
+
+    def __init__(self, capacity: int = 4096):
+        self.data = np.empty((capacity, 4), dtype=np.float64)  # <-- t, x, y, z
+        self.size = 0
+
+    def reserve(self, capacity: int):
+        if capacity <= len(self.data):
+            return
+        data = np.empty((capacity, 4), dtype=np.float64)
+        data[: self.size] = self.data[: self.size]
+        self.data = data
+
+    def append(self, t: float, x: float, y: float, z: float):
+        if self.size == len(self.data):
+            self.reserve(max(2 * len(self.data), 1))
+        self.data[self.size] = (t, x, y, z)
+        self.size += 1
+
+    def clear(self):
+        self.size = 0
+
+    def truncate(self, size: int):
+        self.size = min(size, self.size)
+
+    @property
+    def array(self) -> np.ndarray:
+        return self.data[: self.size]
+
+    @property
+    def t(self) -> np.ndarray:
+        return self.data[: self.size, 0]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.data[: self.size, 1]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.data[: self.size, 2]
+
+    @property
+    def z(self) -> np.ndarray:
+        return self.data[: self.size, 3]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i: int) -> tuple[float, float, float, float]:
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        return tuple(self.data[i].tolist())  # type: ignore
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype, copy=False)
+
+
+if __name__ == "__main__":
+    traj = Trajectory(capacity=2)
+    for i in range(5):
+        traj.append(i * 0.01, i, 2 * i, 0)
+    print(len(traj), traj[-1], traj.array.shape, len(traj.data))
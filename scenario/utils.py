@@ -1,10 +1,17 @@
 from typing import Optional
 
-import carla
 import math
+import numpy as np
 
+from .backend import carla
 from .conflict_point import Conflict_Point
 from .loss import Loss
+from .snapshot_log import SNAPSHOT_COLUMNS, read_snapshot_log
+from .trajectory import Trajectory
+
+_EPSILON_DISTANCE = 1
+_DELTA_END_DISTANCE = 0.003
+_CONFLICT_BLOCK_SIZE = 1 << 20  # <-- (ego tick, npc tick) pairs evaluated per block
 
 
 def kmh_2_ms(velocity) -> float:
@@ -26,8 +33,8 @@ def calculate_time_distance(p1, p2) -> Loss:
 
 def get_conflict_point(ego_traj, obj_traj) -> Optional[Conflict_Point]:
     cross_point: Optional[Conflict_Point] = None
-    delta_end_distance = 0.003
-    epsilon_distance = 1
+    delta_end_distance = _DELTA_END_DISTANCE
+    epsilon_distance = _EPSILON_DISTANCE
     for i in range(len(ego_traj)):
         for j in range(len(obj_traj)):
             try:
@@ -56,19 +63,276 @@ def get_conflict_point(ego_traj, obj_traj) -> Optional[Conflict_Point]:
                 )
     return cross_point
 
+
+def _pow2(x: np.ndarray, out=None) -> np.ndarray:
+    # libm pow, as `** 2` in calculate_time_distance, np.square (x * x) can
+    # differ from it in the last bit
+    return np.float_power(x, 2, out=out)
+
+
+def as_traj_array(traj) -> np.ndarray:
+    # (t, x, y, z) rows, one per tick
+    if isinstance(traj, Trajectory):
+        return traj.array
+    return np.asarray(traj, dtype=np.float64).reshape(-1, 4)
+
+
+def update_conflict_point(
+    cross_point: Optional[Conflict_Point],
+    ego_tick: np.ndarray,
+    obj_tick: np.ndarray,
+    time_gap: np.ndarray,
+    dist: np.ndarray,
+) -> Optional[Conflict_Point]:
+    # candidates (distance <= epsilon) must come in the (ego tick, npc tick) order
+    # of the double loop in get_conflict_point, the update rule is replayed on them:
+    # the conflict point follows the running time gap minimum (first occurrence
+    # wins) and freezes once it lies within delta_end_distance.
+    if cross_point is not None and not cross_point.loss.distance > _DELTA_END_DISTANCE:
+        return cross_point
+    if len(time_gap) == 0:
+        return cross_point
+
+    running_min = np.minimum.accumulate(time_gap)
+    record = np.empty(len(time_gap), dtype=bool)
+    if cross_point is None:
+        record[0] = True
+        record[1:] = time_gap[1:] < running_min[:-1]
+    else:
+        record[0] = time_gap[0] < cross_point.loss.time_gap
+        record[1:] = time_gap[1:] < np.minimum(
+            running_min[:-1], cross_point.loss.time_gap
+        )
+    record_idx = np.flatnonzero(record)
+    if len(record_idx) == 0:
+        return cross_point
+
+    end_idx = record_idx[~(dist[record_idx] > _DELTA_END_DISTANCE)]
+    k = end_idx[0] if len(end_idx) > 0 else record_idx[-1]
+    return Conflict_Point(
+        ego_pass_tick=int(ego_tick[k]),
+        obj_pass_tick=int(obj_tick[k]),
+        loss=Loss(time_gap=float(time_gap[k]), distance=float(dist[k])),
+    )
+
+
+def get_conflict_point_vectorized(
+    ego_traj, obj_traj, block_size=_CONFLICT_BLOCK_SIZE
+) -> Optional[Conflict_Point]:
+    ego = as_traj_array(ego_traj)
+    obj = as_traj_array(obj_traj)
+    cross_point: Optional[Conflict_Point] = None
+    if len(ego) == 0 or len(obj) == 0:
+        return cross_point
+
+    block_rows = max(1, block_size // len(obj))
+    for start in range(0, len(ego), block_rows):
+        block = ego[start : start + block_rows]
+        dist = np.subtract.outer(block[:, 1], obj[:, 1])
+        _pow2(dist, out=dist)
+        for axis in (2, 3):
+            d_axis = np.subtract.outer(block[:, axis], obj[:, axis])
+            _pow2(d_axis, out=d_axis)
+            dist += d_axis
+        np.sqrt(dist, out=dist)
+
+        ego_tick, obj_tick = np.nonzero(~(dist > _EPSILON_DISTANCE))
+        if len(ego_tick) == 0:
+            continue
+        time_gap = np.abs(block[ego_tick, 0] - obj[obj_tick, 0])
+        cross_point = update_conflict_point(
+            cross_point, ego_tick + start, obj_tick, time_gap, dist[ego_tick, obj_tick]
+        )
+        if not cross_point.loss.distance > _DELTA_END_DISTANCE:  # type: ignore
+            break
+    return cross_point
+
+
+
+def get_conflict_point_grid(
+    ego_traj, obj_traj, block_size=_CONFLICT_BLOCK_SIZE
+) -> Optional[Conflict_Point]:
+    # uniform grid hash over the npc trajectory, cell size = epsilon_distance, so
+    # every candidate pair lies in one of the 3x3 cells around the ego point
+    ego = as_traj_array(ego_traj)
+    obj = as_traj_array(obj_traj)
+    cross_point: Optional[Conflict_Point] = None
+    if len(ego) == 0 or len(obj) == 0:
+        return cross_point
+
+    ego_cell = np.floor(ego[:, 1:3] / _EPSILON_DISTANCE).astype(np.int64)
+    obj_cell = np.floor(obj[:, 1:3] / _EPSILON_DISTANCE).astype(np.int64)
+    origin = np.minimum(ego_cell.min(axis=0), obj_cell.min(axis=0)) - 1
+    ego_cell -= origin
+    obj_cell -= origin
+    width = max(ego_cell[:, 1].max(), obj_cell[:, 1].max()) + 2
+    obj_key = obj_cell[:, 0] * width + obj_cell[:, 1]
+    obj_order = np.argsort(obj_key, kind="stable")
+    obj_key = obj_key[obj_order]
+
+    lo = []
+    count = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            ego_key = (ego_cell[:, 0] + dx) * width + ego_cell[:, 1] + dy
+            cell_lo = np.searchsorted(obj_key, ego_key, side="left")
+            lo.append(cell_lo)
+            count.append(np.searchsorted(obj_key, ego_key, side="right") - cell_lo)
+
+    # split the ego ticks so that each block holds about block_size pairs
+    pair_end = np.cumsum(np.sum(count, axis=0))
+    start = 0
+    while start < len(ego):
+        pair_start = pair_end[start - 1] if start > 0 else 0
+        end = int(np.searchsorted(pair_end, pair_start + block_size, side="right"))
+        end = max(end, start + 1)
+
+        ego_tick_list = []
+        obj_tick_list = []
+        for cell_lo, cell_count in zip(lo, count):
+            block_count = cell_count[start:end]
+            total = int(block_count.sum())
+            if total == 0:
+                continue
+            offset = np.arange(total) - np.repeat(
+                np.cumsum(block_count) - block_count, block_count
+            )
+            ego_tick_list.append(np.repeat(np.arange(start, end), block_count))
+            obj_tick_list.append(
+                obj_order[np.repeat(cell_lo[start:end], block_count) + offset]
+            )
+        start = end
+        if len(ego_tick_list) == 0:
+            continue
+
+        ego_tick = np.concatenate(ego_tick_list)
+        obj_tick = np.concatenate(obj_tick_list)
+        dist = _pow2(ego[ego_tick, 1] - obj[obj_tick, 1])
+        dist += _pow2(ego[ego_tick, 2] - obj[obj_tick, 2])
+        dist += _pow2(ego[ego_tick, 3] - obj[obj_tick, 3])
+        np.sqrt(dist, out=dist)
+
+        near = ~(dist > _EPSILON_DISTANCE)
+        ego_tick = ego_tick[near]
+        obj_tick = obj_tick[near]
+        dist = dist[near]
+        if len(ego_tick) == 0:
+            continue
+        order = np.lexsort((obj_tick, ego_tick))
+        ego_tick = ego_tick[order]
+        obj_tick = obj_tick[order]
+        cross_point = update_conflict_point(
+            cross_point,
+            ego_tick,
+            obj_tick,
+            np.abs(ego[ego_tick, 0] - obj[obj_tick, 0]),
+            dist[order],
+        )
+        if not cross_point.loss.distance > _DELTA_END_DISTANCE:  # type: ignore
+            break
+    return cross_point
+
+
+CONFLICT_POINT_ENGINES = {
+    "loop": get_conflict_point,
+    "vectorized": get_conflict_point_vectorized,
+    "grid": get_conflict_point_grid,
+}
+
 def calculate_min_distance(ego_traj, obj_traj):
-    timestamp = -1
-    min_distance = math.inf
-    for i in range(min(len(ego_traj), len(obj_traj))):
-        temp_loss: Loss = calculate_time_distance(ego_traj[i], obj_traj[i])
-        temp_distance = temp_loss.distance
-        if temp_distance < min_distance:
-            min_distance = temp_distance
-            timestamp = i
-    return (timestamp, min_distance)
+    ego = as_traj_array(ego_traj)
+    obj = as_traj_array(obj_traj)
+    n_tick = min(len(ego), len(obj))
+    if n_tick == 0:
+        return (-1, math.inf)
+    dist = _pow2(ego[:n_tick, 1] - obj[:n_tick, 1])
+    dist += _pow2(ego[:n_tick, 2] - obj[:n_tick, 2])
+    dist += _pow2(ego[:n_tick, 3] - obj[:n_tick, 3])
+    np.sqrt(dist, out=dist)
+    timestamp = int(np.argmin(dist))
+    if not dist[timestamp] < math.inf:
+        return (-1, math.inf)
+    return (timestamp, float(dist[timestamp]))
     # return {"timestamp": timestamp, "min_distance": min_distance}
 
 
+def same_conflict_point(a: Optional[Conflict_Point], b: Optional[Conflict_Point]):
+    if a is None or b is None:
+        return a is None and b is None
+    return (
+        a.ego_pass_tick == b.ego_pass_tick
+        and a.obj_pass_tick == b.obj_pass_tick
+        and a.loss.time_gap == b.loss.time_gap
+        and a.loss.distance == b.loss.distance
+    )
+
+
+def load_snapshot_record_traj(snapshot_record_path):
+    # rebuild (ego_traj, npc_traj) of a round from its snapshot_record.csv/.npy
+    if str(snapshot_record_path).endswith(".npy"):
+        log = read_snapshot_log(snapshot_record_path)
+        record = np.stack(
+            [log[name].astype(np.float64) for name in SNAPSHOT_COLUMNS[:9]], axis=1
+        )
+    else:
+        record = np.loadtxt(snapshot_record_path, delimiter=",", skiprows=1, ndmin=2)
+    ego_traj = [tuple(row) for row in record[:, [1, 3, 4, 5]].tolist()]
+    npc_traj = [tuple(row) for row in record[:, [1, 6, 7, 8]].tolist()]
+    return ego_traj, npc_traj
+
+
+def _gen_crossing_traj(n_tick, start, velocity, dt=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_tick) * dt
+    traj = np.empty((n_tick, 4))
+    traj[:, 0] = t
+    traj[:, 1:] = np.asarray(start) + np.outer(t, velocity)
+    traj[:, 1:3] += rng.normal(0, 0.01, (n_tick, 2))
+    return [tuple(row) for row in traj.tolist()]
+
+
 if __name__ == "__main__":
+    import sys
+
     cp = Conflict_Point()
     print(cp)
+
+    # recorded rounds: python -m scenario.utils result/round_*/snapshot_record.npy
+    for snapshot_record_path in sys.argv[1:]:
+        ego_traj, npc_traj = load_snapshot_record_traj(snapshot_record_path)
+        expected = get_conflict_point(ego_traj, npc_traj)
+        for engine in ("vectorized", "grid"):
+            actual = CONFLICT_POINT_ENGINES[engine](ego_traj, npc_traj)
+            assert same_conflict_point(expected, actual), (snapshot_record_path, engine)
+        print(f"{snapshot_record_path}: parity ok")
+
+    # parity of the vectorized engine against the double loop
+    for case in range(20):
+        rng = np.random.default_rng(case)
+        n_ego, n_npc = rng.integers(50, 400, size=2)
+        ego_traj = _gen_crossing_traj(
+            n_ego, (-rng.uniform(1, 10), 0, 0), (rng.uniform(2, 10), 0, 0), seed=case
+        )
+        npc_traj = _gen_crossing_traj(
+            n_npc, (0, -rng.uniform(1, 10), 0), (0, rng.uniform(2, 10), 0), seed=100 + case
+        )
+        if case % 4 == 0:
+            # touching points exercise the delta_end_distance rule
+            npc_traj[n_npc // 2] = (npc_traj[n_npc // 2][0],) + ego_traj[n_ego // 2][1:]
+        expected = get_conflict_point(ego_traj, npc_traj)
+        ego_buffer, npc_buffer = Trajectory(), Trajectory()
+        for ego_sample, npc_sample in zip(ego_traj, npc_traj):
+            ego_buffer.append(*ego_sample)
+            npc_buffer.append(*npc_sample)
+        assert calculate_min_distance(ego_traj, npc_traj) == calculate_min_distance(
+            ego_buffer, npc_buffer
+        )
+        assert same_conflict_point(
+            get_conflict_point(ego_buffer, npc_buffer),
+            get_conflict_point_grid(ego_buffer, npc_buffer),
+        )
+        for engine in ("vectorized", "grid"):
+            for block_size in (1, 997, _CONFLICT_BLOCK_SIZE):
+                actual = CONFLICT_POINT_ENGINES[engine](ego_traj, npc_traj, block_size)
+                assert same_conflict_point(expected, actual), (case, engine, block_size)
+    print("conflict point engines: parity ok")
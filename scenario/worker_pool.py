@@ -0,0 +1,241 @@
+from collections import deque
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Callable, Generator, Iterable, Optional, Union
+
+from .backend import create_backend
+from .scenario import Scenario
+from .seed import Seed, Round_Result
+
+# a chain may also yield a list of seeds, run by Scenario.run_branches as one
+# task, and gets the list of their results back
+Seed_Task = Union[Seed, list[Seed]]
+Seed_Chain = Generator[Seed_Task, Union[Round_Result, list[Round_Result]], str]
+
+_EXHAUSTED = object()
+_MAX_ATTEMPTS = 2  # <-- a seed that kills this many workers fails the campaign
+
+
+def _worker_main(
+    scenario_cls,
+    host,
+    port,
+    tm_port,
+    world_map,
+    output_root_dir: Path,
+    backend_name: str,
+    options: dict,
+    task_queue,
+    result_conn,
+):
+    backend = create_backend(backend_name, host, port, world_map, tm_port)
+    scene: Scenario = scenario_cls(host, port, world_map, output_root_dir, backend)
+    for key, value in options.items():
+        setattr(scene, key, value)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            scene.close()
+            break
+        try:
+            if isinstance(task, list):
+                result_conn.send((scene.run_branches(task), None))
+            else:
+                result_conn.send((scene.run(task), None))
+        except Exception as err:
+            result_conn.send((None, repr(err)))
+            raise
+
+
+class Serial_Runner:
+    # runs the seeds on one scenario in this process, same interface as Scenario_Pool
+    workers = 1
+
+    def __init__(self, scene: Scenario):
+        self.scene = scene
+        self.pending: deque[Seed_Task] = deque()
+
+    def submit(self, seed: Seed_Task):
+        self.pending.append(seed)
+
+    def collect(self):
+        seed = self.pending.popleft()
+        if isinstance(seed, list):
+            return seed, self.scene.run_branches(seed)
+        return seed, self.scene.run(seed)
+
+    def close(self):
+        self.scene.close()
+
+
+class Scenario_Pool:
+    # one scenario per worker process, each on its own simulator: worker k
+    # connects to port + k * port_step with traffic manager port tm_port + k.
+    # A worker gets one seed at a time and answers on its own pipe, so a
+    # worker that dies takes no other worker's results with it and the pool
+    # knows which seed it was running: the worker is started again on the
+    # same ports and the seed resubmitted, a seed that kills _MAX_ATTEMPTS
+    # workers raises
+    def __init__(
+        self,
+        scenario_cls,
+        host,
+        port,
+        world_map,
+        output_root_dir: Path,
+        backend: str = "carla",
+        workers: int = 1,
+        port_step: int = 3,
+        tm_port: int = 8000,
+        options: Optional[dict] = None,
+    ):
+        self.ctx = mp.get_context("spawn")
+        self.workers = workers
+        self.worker_args = [
+            (
+                scenario_cls,
+                host,
+                port + k * port_step,
+                tm_port + k,
+                world_map,
+                output_root_dir,
+                backend,
+                options or {},
+            )
+            for k in range(workers)
+        ]
+        self.pending: dict[int, Seed_Task] = {}
+        self.attempts: dict[int, int] = {}  # <-- task_id: workers it was sent to
+        self.waiting: deque[int] = deque()  # <-- task ids not sent to a worker yet
+        self.running: list[Optional[int]] = [None] * workers  # <-- task id of each worker's seed
+        self.next_task_id = 0
+        self.processes: list = [None] * workers
+        self.task_queues: list = [None] * workers
+        self.result_conns: list = [None] * workers
+        for k in range(workers):
+            self.start_worker(k)
+
+    def start_worker(self, k: int):
+        self.task_queues[k] = self.ctx.Queue()
+        self.result_conns[k], result_conn = self.ctx.Pipe(duplex=False)
+        self.processes[k] = self.ctx.Process(
+            target=_worker_main,
+            args=(*self.worker_args[k], self.task_queues[k], result_conn),
+            daemon=True,
+        )
+        self.processes[k].start()
+        result_conn.close()  # <-- the worker's end, recv sees EOF once the worker is gone
+
+    def submit(self, seed: Seed_Task):
+        self.pending[self.next_task_id] = seed
+        self.attempts[self.next_task_id] = 0
+        self.waiting.append(self.next_task_id)
+        self.next_task_id += 1
+        self.dispatch()
+
+    def dispatch(self):
+        for k in range(self.workers):
+            if len(self.waiting) == 0:
+                return
+            if self.running[k] is not None:
+                continue
+            task_id = self.waiting.popleft()
+            self.attempts[task_id] += 1
+            self.running[k] = task_id
+            self.task_queues[k].put(self.pending[task_id])
+
+    def collect(self):
+        # next finished round, in completion order
+        while True:
+            ready = wait(
+                self.result_conns + [process.sentinel for process in self.processes]
+            )
+            for k in range(self.workers):
+                if self.result_conns[k] not in ready and self.processes[k].sentinel not in ready:
+                    continue
+                try:
+                    result, error = self.result_conns[k].recv()
+                except (EOFError, OSError):
+                    self.restart_worker(k)  # <-- died without an answer
+                    continue
+                task_id = self.running[k]
+                assert task_id is not None
+                self.running[k] = None
+                seed = self.pending.pop(task_id)
+                del self.attempts[task_id]
+                self.dispatch()
+                if error is not None:
+                    raise RuntimeError(
+                        f"round {self.round_num(seed)} failed in worker {k}: {error}"
+                    )
+                return seed, result
+
+    def restart_worker(self, k: int):
+        process = self.processes[k]
+        process.join()
+        self.result_conns[k].close()
+        task_id = self.running[k]
+        if task_id is None:
+            raise RuntimeError(f"worker {k} exited with code {process.exitcode}")
+        self.running[k] = None
+        seed = self.pending[task_id]
+        if self.attempts[task_id] >= _MAX_ATTEMPTS:
+            raise RuntimeError(
+                f"round {self.round_num(seed)} killed {_MAX_ATTEMPTS} workers, "
+                f"last exit code {process.exitcode}"
+            )
+        print(
+            f"-- worker {k} exited with code {process.exitcode}, "
+            f"round {self.round_num(seed)} is run again"
+        )
+        self.start_worker(k)
+        self.waiting.appendleft(task_id)
+        self.dispatch()
+
+    @staticmethod
+    def round_num(seed: Seed_Task) -> int:
+        return seed[0].round_num if isinstance(seed, list) else seed.round_num
+
+    def close(self):
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for process in self.processes:
+            process.join()
+
+
+def run_chains(
+    runner,
+    chains: Iterable[Optional[tuple[int, Seed_Chain]]],
+    on_chain_end: Callable[[int, str], None],
+):
+    # a chain yields the seeds it wants simulated and receives their results,
+    # up to runner.workers chains are kept in flight. chains may yield None:
+    # nothing to start until one of the chains in flight ends
+    chains = iter(chains)
+    in_flight: dict[int, tuple[int, Seed_Chain]] = {}
+
+    def advance(key: int, chain: Seed_Chain, result: Optional[Round_Result]):
+        try:
+            seed = next(chain) if result is None else chain.send(result)
+        except StopIteration as stop:
+            on_chain_end(key, stop.value)
+            return
+        in_flight[id(seed)] = (key, chain)
+        runner.submit(seed)
+
+    exhausted = False
+    while True:
+        while not exhausted and len(in_flight) < runner.workers:
+            item = next(chains, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                exhausted = True
+            elif item is None:
+                break
+            else:
+                advance(item[0], item[1], None)
+        if len(in_flight) == 0:
+            break
+        seed, result = runner.collect()
+        key, chain = in_flight.pop(id(seed))
+        advance(key, chain, result)